@@ -0,0 +1,6 @@
+"""
+Benchmarks of the framework. They are run as modules from the repository root,
+so the framework and the test stubs are imported from the working tree:
+
+    python -m benchmarks.bench_injection
+"""
@@ -0,0 +1,100 @@
+"""
+Memory and append cost of the chat history storage.
+
+Every user has a system prompt and `__messages__` messages. The histories are stored as lists of message dicts
+(the previous storage) and as ChatHistory of ChatMessage records. Content strings are shared by all users,
+so the numbers show the cost of the storage itself, the text of real messages comes on top of both.
+The memory of `__target_users__` users is extrapolated from the measured sample, pass the number of users
+to measure it directly (a million users of dicts take about 18 GiB):
+
+    python -m benchmarks.bench_chat_history [users]
+
+The append benchmark adds messages to a history of a limited size and drops the oldest message on every append,
+the worst case for the previous slice-and-concatenate trim: its cost grows with the limit, the ring's doesn't.
+"""
+import sys
+import time
+import tracemalloc
+
+import sidusai.core.history as history
+
+__users__ = 10_000
+__target_users__ = 1_000_000
+__messages__ = 100
+__appends__ = 100_000
+__append_limits__ = [100, 1_000, 10_000]
+__contents__ = [f'message {i} ' * 8 for i in range(__messages__)]
+
+
+def build_dict_histories(users: int) -> list:
+    histories = []
+    for _ in range(users):
+        messages = [{'role': 'system', 'content': __contents__[0]}]
+        for i in range(__messages__):
+            messages.append({'role': 'user' if i % 2 == 0 else 'assistant', 'content': __contents__[i]})
+        histories.append(messages)
+    return histories
+
+
+def build_chat_histories(users: int) -> list:
+    histories = []
+    for _ in range(users):
+        messages = history.ChatHistory()
+        messages.append(history.ChatMessage('system', __contents__[0]))
+        for i in range(__messages__):
+            messages.append(history.ChatMessage('user' if i % 2 == 0 else 'assistant', __contents__[i]))
+        histories.append(messages)
+    return histories
+
+
+def measure_memory(builder, users: int) -> int:
+    tracemalloc.start()
+    histories = builder(users)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del histories
+    return current
+
+
+def append_to_list(appends: int, limit: int) -> float:
+    messages = [{'role': 'system', 'content': __contents__[0]}]
+    started_at = time.perf_counter()
+    for i in range(appends):
+        messages.append({'role': 'user', 'content': __contents__[i % __messages__]})
+        if len(messages) > limit:
+            messages = messages[:1] + messages[2:]
+    return time.perf_counter() - started_at
+
+
+def append_to_history(appends: int, limit: int) -> float:
+    messages = history.ChatHistory([history.ChatMessage('system', __contents__[0])])
+    started_at = time.perf_counter()
+    for i in range(appends):
+        messages.append(history.ChatMessage('user', __contents__[i % __messages__]))
+        if len(messages) > limit:
+            del messages[1:2]
+    return time.perf_counter() - started_at
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else __users__
+    scale = __target_users__ / users
+
+    print(f'{users} users x {__messages__} messages, extrapolated to {__target_users__} users')
+    print(f'{"storage":>12} {"bytes/user":>11} {"bytes/message":>14} {"GiB total":>10}')
+    for name, builder in [('dict list', build_dict_histories), ('ChatHistory', build_chat_histories)]:
+        memory = measure_memory(builder, users)
+        per_user = memory / users
+        print(f'{name:>12} {per_user:11.0f} {per_user / (__messages__ + 1):14.1f} {memory * scale / 2 ** 30:10.2f}')
+
+    print()
+    print(f'{__appends__} appends, the oldest message is dropped on every append, ns/message')
+    print(f'{"limit":>12} {"dict list":>10} {"ChatHistory":>12}')
+    for limit in __append_limits__:
+        list_elapsed = append_to_list(__appends__, limit)
+        history_elapsed = append_to_history(__appends__, limit)
+        print(f'{limit:12d} {list_elapsed / __appends__ * 1e9:10.0f} {history_elapsed / __appends__ * 1e9:12.0f}')
+
+
+if __name__ == '__main__':
+    main()
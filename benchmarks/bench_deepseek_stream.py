@@ -0,0 +1,43 @@
+"""
+Time to the first token of the streaming mode compared with the latency of the regular one.
+
+The requests are sent to the local stub of the DeepSeek endpoint (tests/deepseek_sse_stub.py),
+which generates one token every `token_delay_sec` seconds. Run it from the repository root:
+
+    python -m benchmarks.bench_deepseek_stream
+"""
+import time
+
+import sidusai as sai
+import sidusai.plugins.deepseek.components as components
+from tests.deepseek_sse_stub import SSEStubServer
+
+
+def main():
+    with SSEStubServer() as server:
+        client = components.DeepSeekClientComponent('key', url=server.url)
+        chat = sai.ChatAgentValue([{'role': 'user', 'content': 'Tell me about the fox'}])
+
+        started_at = time.perf_counter()
+        response = client.request(chat)
+        regular = time.perf_counter() - started_at
+
+        first_token_at = []
+        started_at = time.perf_counter()
+        stream_response = client.request_stream(
+            chat, on_token=lambda _: first_token_at.append(time.perf_counter()) if not first_token_at else None
+        )
+        streamed = time.perf_counter() - started_at
+        client.close()
+
+    assert stream_response.last_message['content'] == response.last_message['content']
+
+    print(f'tokens: {len(server.tokens)}, delay per token: {server.token_delay_sec * 1000:.0f} ms')
+    print(f'regular:   first content after {regular * 1000:8.1f} ms')
+    print(f'streaming: first token after   {(first_token_at[0] - started_at) * 1000:8.1f} ms, '
+          f'complete after {streamed * 1000:.1f} ms')
+    print(f'usage: {stream_response.total_tokens} tokens')
+
+
+if __name__ == '__main__':
+    main()
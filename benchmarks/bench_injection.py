@@ -0,0 +1,47 @@
+"""
+Microbenchmark of the skill call overhead.
+
+Compares the reflective call (execute_executable: build_parameters, update_parameters_from_dict
+and signature binding on every call) with the precompiled injection plan used by the agent.
+
+    python -m benchmarks.bench_injection
+"""
+import timeit
+
+import sidusai as sai
+import sidusai.core.execute as ex
+import sidusai.core.types as types
+
+
+class FirstComponent:
+    pass
+
+
+class SecondComponent:
+    pass
+
+
+def sample_skill(value: sai.ChatAgentValue, first: FirstComponent, second: SecondComponent) -> sai.ChatAgentValue:
+    return value
+
+
+def main(number: int = 100000):
+    components = types.NamedTypedContainer()
+    components.put(FirstComponent(), 'first')
+    components.put(SecondComponent(), 'second')
+
+    skill = ex.Executable(sample_skill)
+    plan = skill.compile(components, flow_name='value', flow_type=sai.AgentValue)
+    value = sai.ChatAgentValue([])
+
+    reflective = timeit.timeit(lambda: ex.execute_executable(skill, components, {'value': value}), number=number)
+    compiled = timeit.timeit(lambda: plan(value), number=number)
+
+    print(f'calls: {number}')
+    print(f'execute_executable: {reflective / number * 1e6:8.3f} us/call')
+    print(f'compiled plan:      {compiled / number * 1e6:8.3f} us/call')
+    print(f'speedup:            {reflective / compiled:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Scaling benchmark of the skill graph construction and path resolution.
+
+Every task uses four skills, one of them three times, so the graph has three vertices per registered skill.
+The complete graph materialized with networkx is measured as well when networkx is installed
+(only up to 60 skills, it grows quadratically).
+
+    python -m benchmarks.bench_skill_graph
+"""
+import time
+import tracemalloc
+
+import sidusai.core.graph as graph
+
+__skill_counts__ = [10, 30, 60, 100, 250, 500]
+__legacy_max_skills__ = 60
+
+
+def build_task_skills(full_skill_names: list) -> list:
+    first, second, third = full_skill_names[:3]
+    return [first, second, first, third, first]
+
+
+def measure(handler):
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    result = handler()
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def build_and_resolve(full_skill_names: list, task_skills: list):
+    skill_graph = graph.AgentSkillGraph(full_skill_names, task_skills)
+    return skill_graph.get_active_nodes()
+
+
+def build_and_resolve_legacy(full_skill_names: list, task_skills: list):
+    import networkx as nx
+
+    depth = graph.max_skill_contains(task_skills)
+    nodes = graph.build_repeatable_nodes_names(full_skill_names, depth)
+    edges = {}
+    for from_node in [graph.__in__] + nodes + [graph.__out__]:
+        for to_node in nodes:
+            if from_node != to_node:
+                edges[(from_node, to_node)] = 100
+
+    prev = graph.__in__
+    for node in graph.build_skill_names_at_index(task_skills):
+        for key in list(edges):
+            if key == (prev, node) or key == (node, prev):
+                edges[key] = 1
+        prev = node
+
+    nx_graph = nx.Graph()
+    nx_graph.add_weighted_edges_from((a, b, w) for (a, b), w in edges.items())
+    path = nx.dijkstra_path(nx_graph, graph.__in__, graph.__out__)
+    return [v.split(graph.__separator__)[0] for v in path if v not in [graph.__in__, graph.__out__]]
+
+
+def main():
+    try:
+        import networkx
+        has_networkx = True
+    except ModuleNotFoundError:
+        has_networkx = False
+
+    print(f'{"skills":>6} {"vertices":>8} {"build+path ms":>14} {"peak KiB":>9} {"legacy ms":>10} {"legacy KiB":>11}')
+    for count in __skill_counts__:
+        full_skill_names = [f'skill_{i}' for i in range(count)]
+        task_skills = build_task_skills(full_skill_names)
+
+        path, elapsed, peak = measure(lambda: build_and_resolve(full_skill_names, task_skills))
+        assert path == task_skills
+
+        legacy = f'{"-":>10} {"-":>11}'
+        if has_networkx and count <= __legacy_max_skills__:
+            legacy_path, legacy_elapsed, legacy_peak = measure(
+                lambda: build_and_resolve_legacy(full_skill_names, task_skills)
+            )
+            assert legacy_path == path
+            legacy = f'{legacy_elapsed * 1e3:10.1f} {legacy_peak / 1024:11.0f}'
+
+        vertices = count * graph.max_skill_contains(task_skills) + 2
+        print(f'{count:6d} {vertices:8d} {elapsed * 1e3:14.2f} {peak / 1024:9.0f} {legacy}')
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,14 @@ from sidusai.core.plugin import (
     AgentPlugin
 )
 
+from sidusai.core.history import (
+    ChatHistory
+)
+
+from sidusai.core.ratelimit import (
+    RateLimiter
+)
+
 import sidusai.config as config
 import sidusai.core.utils as utils
 import sidusai.logger as logger
@@ -1,12 +1,25 @@
+import asyncio
 import inspect
+import logging
+import queue
+import threading as th
 import time
 
+from concurrent import futures
+
 import sidusai.core.context as context
 import sidusai.core.execute as ex
+import sidusai.core.process as process
+import sidusai.core.scheduler as sc
 import sidusai.core.types as types
 import sidusai.core.utils as utils
 
 __default_agent_name__ = '_default_agent_name_'
+__default_drain_timeout_sec__ = 30
+# Wait for cancelled tasks to stop before their next skill
+__default_cancel_grace_sec__ = 1
+
+_log = logging.getLogger(__name__)
 
 
 class Agent:
@@ -14,42 +27,57 @@ class Agent:
     Default wrap application life cycle
     """
 
-    def __init__(self, agent_name: str = __default_agent_name__):
+    def __init__(self, agent_name: str = __default_agent_name__, thread_pool: ex.ThreadPool = None,
+                 process_pool: process.ProcessPool = None, lazy_components: bool = False):
         self.agent_name = agent_name
         self.ctx = context.AgentContext(self.agent_name)
+        self.ctx.lazy_components = lazy_components
         self.is_builded = False
         self.is_enabled = True
+        self.is_accepting = True
 
-        self._thread_pool = ex.ThreadPool()
+        self._thread_pool = thread_pool if thread_pool is not None else ex.ThreadPool()
+        self._process_pool = process_pool if process_pool is not None else process.ProcessPool()
+        self._mailboxes = ex.KeySerialExecutor(self._thread_pool)
+        self._scheduler = None
+        self._loop_workers = []
+
+        # Handles of the accepted tasks that are not completed yet
+        self._in_flight = set()
+        self._in_flight_condition = th.Condition()
+        self._halt_report = None
 
     #################################################################
     # Core decorators
     #################################################################
 
-    def component(self, name: str = None):
+    def component(self, name: str = None, lazy: bool = None):
         """
         Injectable to context services.
         This is a special class or method builder that initializes the singleton component,
         available for use as part of the agent's execution of its tasks.
+        :param name:
+        :param lazy: Build the component on first injection instead of the application build
         :return:
         """
 
         def decorator(handler):
-            self.add_component_builder(builder=handler, name=name)
+            self.add_component_builder(builder=handler, name=name, lazy=lazy)
             return handler
 
         return decorator
 
-    def skill(self, name: str = None):
+    def skill(self, name: str = None, executor: str = None):
         """
         Decorator for create application skill.
         This is a special class or method for forming the logic of an agent's available action.
         :param name:
+        :param executor: 'thread' (default) or 'process' to run a CPU-bound skill in the process pool
         :return:
         """
 
         def decorator(handler):
-            self.add_skill(handler, name)
+            self.add_skill(handler, name, executor)
             return handler
 
         return decorator
@@ -95,16 +123,25 @@ class Agent:
 
         return decorator
 
-    def loop(self, fixed_interval_sec: int = None, order: int = 0):
+    def loop(self, fixed_interval_sec: float = None, order: int = 0, cron: str = None,
+             missed_tick_policy: str = sc.__missed_delay__, continuous: bool = False, error_backoff_sec: float = 1.0):
         """
         Decorator for life cycle methods
-        :param fixed_interval_sec:
+        :param fixed_interval_sec: Interval between runs, fractions of a second are allowed
         :param order:
+        :param cron: Five-field cron expression instead of the fixed interval
+        :param missed_tick_policy: 'delay' - wait the interval after the end of the previous run,
+        'skip' - keep the fixed rate and skip ticks missed by a long run, 'catch_up' - keep the fixed rate
+        and run missed ticks one after another
+        :param continuous: Run the method by a dedicated worker and re-invoke it as soon as it is completed.
+        Used for blocking methods like long polls, the interval and cron are not allowed
+        :param error_backoff_sec: Delay of a continuous loop after an error, doubled on consecutive errors
         :return:
         """
 
         def decorator(handler):
-            self.add_loop_method(handler, fixed_interval_sec, order)
+            self.add_loop_method(handler, fixed_interval_sec, order, cron, missed_tick_policy,
+                                 continuous, error_backoff_sec)
             return handler
 
         return decorator
@@ -121,25 +158,28 @@ class Agent:
     # Configuration context method
     #################################################################
 
-    def add_component_builder(self, builder, name: str = None):
+    def add_component_builder(self, builder, name: str = None, lazy: bool = None):
         """
         Add component builder (factory or factory method) to context
         :param builder:
         :param name:
+        :param lazy: Build the component on first injection. None to use the agent default
         :return:
         """
         if not inspect.isfunction(builder) and not inspect.isclass(builder) and not inspect.ismethod(builder):
             raise ValueError(f'Invalid service. Service \'{builder}\' must be class or function')
-        self.ctx.add_component_builder(builder, name=name)
+        self.ctx.add_component_builder(builder, name=name, lazy=lazy)
 
-    def add_skill(self, handler, name: str = None):
+    def add_skill(self, handler, name: str = None, executor: str = None):
         """
         Add skill method/class to context
         :param handler: Function/Method/class skill.
         :param name: Skill name
+        :param executor: 'thread' (default) or 'process'. Process skills get a copy of the value
+        and components built in the worker process
         :return:
         """
-        self.ctx.add_agent_skill(skill=handler, skill_name=name)
+        self.ctx.add_agent_skill(skill=handler, skill_name=name, executor=executor)
 
     def task_registration(self, handler, name: str = None, skill_names: [str] = None):
         """
@@ -169,15 +209,22 @@ class Agent:
         """
         self.ctx.add_post_processor(handler, order)
 
-    def add_loop_method(self, handler, fixed_interval_sec: int = 0, order: int = 0):
+    def add_loop_method(self, handler, fixed_interval_sec: float = None, order: int = 0, cron: str = None,
+                        missed_tick_policy: str = sc.__missed_delay__, continuous: bool = False,
+                        error_backoff_sec: float = 1.0):
         """
         Add custom loop method to life cycle context
         :param handler:
-        :param fixed_interval_sec:
+        :param fixed_interval_sec: Interval between runs, fractions of a second are allowed
         :param order:
+        :param cron: Five-field cron expression instead of the fixed interval
+        :param missed_tick_policy: 'delay', 'skip' or 'catch_up'
+        :param continuous: Re-invoke the method by a dedicated worker as soon as the previous run is completed
+        :param error_backoff_sec: Delay of a continuous loop after an error, doubled on consecutive errors
         :return:
         """
-        self.ctx.add_loop_method(handler, fixed_interval_sec, order)
+        self.ctx.add_loop_method(handler, fixed_interval_sec, order, cron, missed_tick_policy,
+                                 continuous, error_backoff_sec)
 
     def add_exception_handler_method(self, handler, error_types: list = None, order: int = 0):
         self.ctx.add_exception_handler(handler, error_types, order)
@@ -195,16 +242,94 @@ class Agent:
         """
         return self.ctx.build_task(task)
 
-    def task_execute(self, task: types.AgentTask):
+    def task_execute(self, task: types.AgentTask, key=None) -> ex.TaskFuture:
         """
-        Performing a task using active skills in a separate thread
+        Performing a task using active skills in the agent thread pool
         :param task:
-        :return:
+        :param key: Optional hashable key (user id, chat id). Tasks with the same key are executed
+        one by one in submission order, tasks with different keys are executed in parallel
+        :return: Handle to wait for the task result, cancel the task and get its timing.
+        After halt the task is not accepted and the handle is cancelled
+        """
+        handle = ex.TaskFuture(task)
+        with self._in_flight_condition:
+            if not self.is_accepting:
+                handle.cancel()
+                return handle
+            self._in_flight.add(handle)
+        handle.add_done_callback(self._release_task)
+
+        try:
+            if key is None:
+                self._thread_pool.execute(
+                    target=self._execute_task,
+                    args=(task, handle),
+                    on_drop=handle.cancel
+                )
+            else:
+                self._mailboxes.execute(
+                    key,
+                    target=self._execute_task,
+                    args=(task, handle),
+                    on_drop=handle.cancel
+                )
+        except BaseException:
+            # The task is not accepted by the pool (OverflowError of the reject policy)
+            handle.cancel()
+            self._release_task(handle)
+            raise
+        return handle
+
+    def task_execute_many(self, tasks, max_concurrency: int = None):
         """
-        self._thread_pool.execute(
-            target=self._execute_task,
-            args=(task,)
-        )
+        Performing a batch of tasks with a limited number of tasks in flight.
+        Tasks are submitted as previous ones are completed, so the batch can be a lazy iterable.
+        :param tasks: Iterable of tasks
+        :param max_concurrency: Max tasks in flight. The thread pool size by default
+        :return: Generator of completed task handles in completion order
+        """
+        if max_concurrency is None:
+            max_concurrency = self._thread_pool.pool_max_size
+        if max_concurrency < 1:
+            raise ValueError('Max concurrency must be greater than zero')
+
+        completed = queue.SimpleQueue()
+        in_flight = 0
+        for task in tasks:
+            if in_flight >= max_concurrency:
+                yield completed.get()
+                in_flight -= 1
+            self.task_execute(task).add_done_callback(completed.put)
+            in_flight += 1
+
+        while in_flight > 0:
+            yield completed.get()
+            in_flight -= 1
+
+    async def task_execute_async(self, task: types.AgentTask):
+        """
+        Performing a task using active skills in the running event loop.
+        Async skills and handlers are awaited, synchronous ones are run in the agent thread pool
+        :param task:
+        :return: The value passed to the task on_complete method, as TaskFuture.result() of task_execute.
+        An error of the task is raised after the exception handlers.
+        After halt the task is not accepted and CancelledError is raised
+        """
+        handle = ex.TaskFuture(task)
+        with self._in_flight_condition:
+            if not self.is_accepting:
+                raise futures.CancelledError(f'Agent {self.agent_name} is halted, the task is not accepted')
+            self._in_flight.add(handle)
+        handle.add_done_callback(self._release_task)
+
+        handle.set_running()
+        try:
+            value = await self._execute_task_async(task, handle)
+        except BaseException as e:
+            handle.set_exception(e)
+            raise
+        handle.set_result(value)
+        return value
 
     def application_build(self):
         if self.is_builded:
@@ -232,56 +357,298 @@ class Agent:
         # Build tasks
         context.build_tasks(self.ctx)
 
+        # Resolve injection plans for the hot path
+        context.compile_executables(self.ctx)
+
+        # Workers of the process pool build their own components for CPU-bound skills
+        process_skills = process.find_process_skills(self.ctx)
+        if len(process_skills) > 0:
+            builders = process.find_component_builders(self.ctx, process_skills)
+            self._process_pool.configure(self.agent_name, builders, process_skills)
+
+        # Components are read without locks by the task threads
+        self.ctx.components.freeze()
+        self.ctx.components_builders.freeze()
+
         self.is_builded = True
 
     def application_run(self, interval: int = 1):
         """
         Implementation of the main loop of the application. As long as the active flag is set,
-        the application is executed, launching the corresponding annotated methods as needed at
-        a given interval in separate threads
-        :param interval: wait between iterations
+        the application is executed, launching the corresponding annotated methods in separate threads.
+        The main thread sleeps until the nearest loop deadline, so loops are started without polling delay.
+        Continuous loops are run by their own workers
+        :param interval: Not used, loops are started at their own deadlines. Kept for compatibility
         :return:
         """
         if not self.is_builded:
             self.application_build()
+
+        scheduled = [loop for loop in self.ctx.loops if not loop.continuous]
+        self._scheduler = sc.LoopScheduler(scheduled, self._dispatch_loop)
+        # halt() may be called before the scheduler is set
+        if not self.is_enabled:
+            return
+
+        self._loop_workers = [
+            sc.ContinuousLoopWorker(loop, self._run_loop) for loop in self.ctx.loops if loop.continuous
+        ]
+        for worker in self._loop_workers:
+            worker.start()
+        try:
+            self._scheduler.run()
+        finally:
+            for worker in self._loop_workers:
+                worker.stop()
+
+    async def application_run_async(self, interval: int = 1):
+        """
+        The main loop of the application in the running event loop.
+        Every loop method is scheduled by its own event loop task, synchronous ones are run in the agent thread pool
+        :param interval: How often the active flag is checked
+        :return:
+        """
+        if not self.is_builded:
+            self.application_build()
+
+        schedules = [
+            asyncio.ensure_future(
+                self._run_continuous_loop_async(loop) if loop.continuous else self._schedule_loop_async(loop)
+            )
+            for loop in self.ctx.loops
+        ]
+        try:
+            while self.is_enabled:
+                await asyncio.sleep(interval)
+        finally:
+            for schedule in schedules:
+                schedule.cancel()
+            await asyncio.gather(*schedules, return_exceptions=True)
+
+    def loop_metrics(self) -> dict:
+        """
+        Scheduling metrics of the loop methods: number of runs, missed ticks and lag between
+        the deadline and the actual start of the run
+        :return: dict {loop name: metrics}
+        """
+        return {loop.executable.name: loop.metrics() for loop in self.ctx.loops}
+
+    def _dispatch_loop(self, loop):
+        try:
+            self._thread_pool.execute(
+                target=self._execute_loop,
+                args=(loop,),
+                on_drop=lambda _loop=loop: self._release_loop(_loop)
+            )
+        except OverflowError:
+            # The pool is saturated, the tick is missed
+            loop.missed_ticks += 1
+            self._release_loop(loop)
+
+    async def _schedule_loop_async(self, loop):
+        loop.scheduled_at = sc.first_deadline(loop, time.monotonic())
+        while self.is_enabled:
+            await asyncio.sleep(max(0.0, loop.scheduled_at - time.monotonic()))
+            if not self.is_enabled:
+                return
+            loop.is_executing = True
+            await self._execute_loop_async(loop)
+            loop.scheduled_at = sc.next_deadline(loop, time.monotonic())
+
+    async def _run_continuous_loop_async(self, loop):
+        backoff = 0.0
         while self.is_enabled:
-            cur_ms = utils.current_sec()
-            for loop in self.ctx.loops:
-                if loop.fixed_interval_sec is not None and cur_ms - loop.last_loop_at > loop.fixed_interval_sec and not loop.is_executing:
-                    loop.is_executing = True
-                    self._thread_pool.execute(
-                        target=self._execute_loop,
-                        args=(loop,)
-                    )
-            time.sleep(interval)
+            loop.scheduled_at = time.monotonic()
+            loop.is_executing = True
+            try:
+                await ex.execute_plan_async(loop.executable, self._thread_pool)
+                backoff = 0.0
+            except Exception:
+                _log.exception(f'Unhandled error in loop {loop.executable.name}')
+                loop.errors += 1
+                backoff = sc.next_error_backoff(loop, backoff)
+            finally:
+                loop.is_executing = False
+            # Yield to the event loop between runs of a method that doesn't await
+            await asyncio.sleep(backoff)
 
     def _execute_loop(self, loop):
-        ex.execute_executable(loop.executable, self.ctx.components)
-        loop.is_executing = False
+        try:
+            self._run_loop(loop)
+        except Exception:
+            _log.exception(f'Unhandled error in loop {loop.executable.name}')
+            loop.errors += 1
+        finally:
+            self._release_loop(loop)
+
+    @staticmethod
+    def _run_loop(loop):
+        loop.record_start(time.monotonic())
+        ex.complete_awaitable(loop.executable.plan())
+
+    async def _execute_loop_async(self, loop):
+        loop.record_start(time.monotonic())
+        try:
+            await ex.execute_plan_async(loop.executable, self._thread_pool)
+        except Exception:
+            _log.exception(f'Unhandled error in loop {loop.executable.name}')
+            loop.errors += 1
+        finally:
+            self._release_loop(loop)
+
+    def _release_loop(self, loop):
         loop.last_loop_at = utils.current_sec()
+        if self._scheduler is not None:
+            self._scheduler.complete(loop)
+        else:
+            loop.is_executing = False
+
+    def _execute_task(self, task: types.AgentTask, handle: ex.TaskFuture = None):
+        if handle is not None and not handle.set_running():
+            return
 
-    def _execute_task(self, task: types.AgentTask):
         task_type = type(task)
+        try:
+            task_container, skills = self._get_task_plan(task_type)
+            value: types.AgentValue = ex.complete_awaitable(task_container.executable_forward.plan(args=(task,)))
+            for skill in skills:
+                if handle is not None and handle.cancel_requested:
+                    raise futures.CancelledError(f'Task {task_type.__name__} is cancelled')
+                if skill.executor == ex.__executor_process__:
+                    value = self._process_pool.submit(skill.name, value).result()
+                else:
+                    value = ex.complete_awaitable(skill.plan(value))
+
+            ex.complete_awaitable(task_container.executable_on_complete.plan(value, args=(task,)))
+            if handle is not None:
+                handle.set_result(value)
+        except futures.CancelledError as e:
+            if handle is not None:
+                handle.set_exception(e)
+        except BaseException as e:
+            error_type = type(e)
+            try:
+                handlers = self.ctx.get_exception_handlers(error_type)
+                for handler in handlers:
+                    ex.complete_awaitable(handler.plan(e))
+            finally:
+                if handle is not None:
+                    handle.set_exception(e)
+
+    def _get_task_plan(self, task_type: type) -> tuple:
         task_container = self.ctx.get_task_container(task_type)
-        skill_names = task_container.skill_graph.get_active_nodes()
-        skills = self.ctx.find_executable_skills(skill_names)
+        if task_container is None:
+            raise ValueError(f'Task {task_type.__name__} is not registered in agent {self.agent_name}')
+        return task_container, self.ctx.get_task_skills(task_container)
+
+    async def _execute_task_async(self, task: types.AgentTask, handle: ex.TaskFuture = None):
+        task_type = type(task)
+        pool = self._thread_pool
 
         try:
-            forward_executable = ex.Executable(task.forward)
-            on_complete_executable = ex.Executable(task.on_complete)
-            value: types.AgentValue = ex.execute_executable(forward_executable, self.ctx.components)
+            task_container, skills = self._get_task_plan(task_type)
+            value: types.AgentValue = await ex.execute_plan_async(
+                task_container.executable_forward, pool, args=(task,)
+            )
             for skill in skills:
-                value = ex.execute_executable(skill, self.ctx.components, {'value': value})
-
-            ex.execute_executable(on_complete_executable, self.ctx.components, {'value': value})
+                if handle is not None and handle.cancel_requested:
+                    raise futures.CancelledError(f'Task {task_type.__name__} is cancelled')
+                if skill.executor == ex.__executor_process__:
+                    value = await asyncio.wrap_future(self._process_pool.submit(skill.name, value))
+                else:
+                    value = await ex.execute_plan_async(skill, pool, value)
+
+            await ex.execute_plan_async(task_container.executable_on_complete, pool, value, args=(task,))
+            return value
+        except (asyncio.CancelledError, futures.CancelledError):
+            raise
         except BaseException as e:
             error_type = type(e)
             handlers = self.ctx.get_exception_handlers(error_type)
             for handler in handlers:
-                ex.execute_executable(handler, self.ctx.components, {'exception': e})
-        finally:
-            # TODO: Is it necessary to process the completion separately?
-            pass
+                await ex.execute_plan_async(handler, pool, e)
+            raise
 
-    def halt(self):
+    def halt(self, drain_timeout_sec: float = __default_drain_timeout_sec__) -> dict:
+        """
+        Graceful shutdown of the application:
+        new tasks are not accepted and loops are stopped, queued and running tasks are given
+        `drain_timeout_sec` to complete, remaining tasks are cancelled cooperatively (before their next skill),
+        then close() of the built components is called and the process pool is shut down.
+
+        Blocks the caller up to the drain timeout, so it must not be called from a task skill.
+        In the running event loop use halt_async, the blocked loop would not complete its tasks.
+        Repeated calls return the report of the first one
+        :param drain_timeout_sec: Time given to queued and running tasks
+        :return: dict report with the numbers of completed and abandoned tasks
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self._halt(drain_timeout_sec)
+        raise RuntimeError(f'Agent {self.agent_name} halt is called in the running event loop. Use halt_async')
+
+    async def halt_async(self, drain_timeout_sec: float = __default_drain_timeout_sec__) -> dict:
+        """
+        Graceful shutdown of the application in the running event loop, as halt.
+        The drain is waited for in a thread of the loop executor, so the tasks of the loop are completed
+        :param drain_timeout_sec: Time given to queued and running tasks
+        :return: dict report with the numbers of completed and abandoned tasks
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self._halt, drain_timeout_sec)
+
+    def _halt(self, drain_timeout_sec: float) -> dict:
+        with self._in_flight_condition:
+            if self._halt_report is not None or not self.is_accepting:
+                return self._halt_report
+            self.is_accepting = False
+            pending = set(self._in_flight)
+
+        started_at = time.monotonic()
         self.is_enabled = False
+        if self._scheduler is not None:
+            self._scheduler.stop()
+        for worker in self._loop_workers:
+            worker.stop()
+
+        drained = self._wait_in_flight(started_at + drain_timeout_sec)
+        if not drained:
+            with self._in_flight_condition:
+                stragglers = list(self._in_flight)
+            for handle in stragglers:
+                handle.cancel()
+            self._wait_in_flight(time.monotonic() + __default_cancel_grace_sec__)
+
+        completed = len([handle for handle in pending if handle.done() and not handle.cancelled()])
+        closed = context.close_components(self.ctx)
+        self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+        report = {
+            'completed': completed,
+            'abandoned': len(pending) - completed,
+            'closed_components': closed,
+            'elapsed_sec': time.monotonic() - started_at,
+        }
+        _log.info(f'Agent {self.agent_name} halted: {report}')
+        with self._in_flight_condition:
+            self._halt_report = report
+        return report
+
+    def _release_task(self, handle: ex.TaskFuture):
+        with self._in_flight_condition:
+            self._in_flight.discard(handle)
+            self._in_flight_condition.notify_all()
+
+    def _wait_in_flight(self, deadline: float) -> bool:
+        """
+        Wait until all accepted tasks are completed
+        :param deadline: monotonic time
+        :return: True if there are no tasks left
+        """
+        with self._in_flight_condition:
+            while len(self._in_flight) > 0:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return False
+                self._in_flight_condition.wait(timeout)
+        return True
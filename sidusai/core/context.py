@@ -1,10 +1,18 @@
 import inspect
+import logging
+import time
+
+from concurrent import futures
 
 import sidusai.core.execute as ex
 import sidusai.core.graph as graph
+import sidusai.core.scheduler as sc
 import sidusai.core.types as types
 
 
+_log = logging.getLogger(__name__)
+
+
 class AgentContext:
     """
     Default application context
@@ -34,6 +42,12 @@ class AgentContext:
         # Application singletons
         self.components = types.NamedTypedContainer()
 
+        # Build time of the components in seconds by component name
+        self.components_build_times = {}
+
+        # Build components on first use, unless the builder sets it explicitly
+        self.lazy_components = False
+
         #############################################################
         # Agent context
         #############################################################
@@ -56,32 +70,63 @@ class AgentContext:
 
         self.exception_handlers = []
 
+        #############################################################
+        # Indexes
+        #############################################################
+
+        # Skill name by skill handler
+        self._skill_names_by_handler = {}
+
+        # Task container by task type
+        self._tasks_by_type = {}
+
+        # Exception handlers by exception type. Filled on the first error of the type
+        self._exception_handlers_by_type = {}
+
     def get_skill_by_handler(self, handler) -> ex.Executable | None:
-        for name, skill in self.skills.items():
-            if skill.handler == handler:
-                return skill
-        return None
+        try:
+            name = self._skill_names_by_handler.get(handler)
+        except TypeError:
+            # Unhashable handler
+            return next((skill for skill in self.skills.values() if skill.handler == handler), None)
+        return self.skills[name] if name is not None else None
 
     def get_task_container(self, task_type: str | type) -> types.TaskContainer:
-        _task = None
-        for _name, _container in self.tasks.items():
-            if _name == task_type or _container.task_type == task_type:
-                _task = _container
-                break
-        return _task
+        try:
+            _task = self.tasks.get(task_type)
+            return _task if _task is not None else self._tasks_by_type.get(task_type)
+        except TypeError:
+            return None
 
     def get_exception_handlers(self, error_type: type) -> list:
+        try:
+            return self._exception_handlers_by_type[error_type]
+        except KeyError:
+            pass
+
         res = []
         for err in self.exception_handlers:
-            if len(err.error_types) == 0 or error_type in err.error_types:
+            if len(err.error_types) == 0 or any(issubclass(error_type, t) for t in err.error_types):
                 res.append(err.executable)
-                continue
 
-            for _err_type in err.error_types:
-                if issubclass(error_type, _err_type):
-                    res.append(err.executable)
+        # The list is shared between the calls and must not be changed
+        res = tuple(res)
+        self._exception_handlers_by_type[error_type] = res
         return res
 
+    def index_skill_handler(self, handler, skill_name: str):
+        """
+        Index the skill handler to find the skill by handler
+        :param handler:
+        :param skill_name:
+        :return:
+        """
+        try:
+            self._skill_names_by_handler.setdefault(handler, skill_name)
+        except TypeError:
+            # Unhashable handlers are found by the full scan
+            pass
+
     def build_task(self, task_type: str | type):
         _task = self.get_task_container(task_type)
         if _task is None:
@@ -92,18 +137,37 @@ class AgentContext:
     def find_executable_skills(self, skill_names: list) -> list:
         return [self.skills[s] for s in skill_names]
 
+    def get_task_skills(self, task_container: types.TaskContainer) -> tuple:
+        """
+        Get the skills pipeline of the task. The pipeline is resolved from the skill graph once
+        and is resolved again only after the graph weights have been changed.
+        :param task_container:
+        :return: tuple of skill executables
+        """
+        _graph = task_container.skill_graph
+        _pipeline = task_container.skill_pipeline
+        if _pipeline is not None and _pipeline[0] == _graph.version:
+            return _pipeline[1]
+
+        _version = _graph.version
+        _skills = tuple(self.find_executable_skills(_graph.get_active_nodes()))
+        task_container.skill_pipeline = (_version, _skills)
+        return _skills
+
     #############################################################
     # Configuration context
     #############################################################
 
-    def add_component_builder(self, builder, name: str = None):
+    def add_component_builder(self, builder, name: str = None, lazy: bool = None):
         """
         Add component builder method (or add component class) to context
         :param name:
         :param builder:
+        :param lazy: Build the component on first use. None to use the context default
         :return:
         """
         executable = ex.Executable(handler=builder)
+        executable.lazy = lazy
         if executable.return_param is None:
             raise ValueError(f'The factory method of the service must explicitly specify the returned class type.')
         _name = name if name is not None else executable.default_name
@@ -113,17 +177,28 @@ class AgentContext:
 
         self.components_builders.put(executable, key=_name)
 
-    def add_agent_skill(self, skill, skill_name: str = None) -> ex.Executable:
+    def add_agent_skill(self, skill, skill_name: str = None, executor: str = None) -> ex.Executable:
         """
         Method for adding a skill to the agent context.
         All agent skills will be initialized after the components are initialized.
         Components can be injected either into the class constructor or into the method parameters.
         :param skill: Function/Method/Class
         :param skill_name: User's skill name
+        :param executor: 'thread' (default) or 'process' for CPU-bound skills
         :return:
         """
         executable = ex.Executable(skill, name=skill_name)
 
+        if executor is not None:
+            if executor not in ex.__executors__:
+                raise ValueError(f'Unknown skill executor \'{executor}\'. Use one of {ex.__executors__}')
+            if executor == ex.__executor_process__ and inspect.isclass(skill):
+                raise SyntaxError(
+                    f'Skill {executable.name} can not be executed in the process pool. '
+                    f'Use a function or a method of a picklable object'
+                )
+            executable.executor = executor
+
         if executable.name in self.skills.keys():
             raise ValueError(
                 f'Skill {executable.name} already exist. '
@@ -131,6 +206,7 @@ class AgentContext:
             )
 
         self.skills[executable.name] = executable
+        self.index_skill_handler(skill, executable.name)
         return executable
 
     def add_task_class(self, handler, task_name: str, available_skills_names: [str]):
@@ -152,7 +228,9 @@ class AgentContext:
         if available_skills_names is None or len(available_skills_names) == 0:
             raise ValueError(f'Task {name} have not skills')
 
-        self.tasks[name] = types.TaskContainer(handler, task_name, available_skills_names)
+        container = types.TaskContainer(handler, task_name, available_skills_names)
+        self.tasks[name] = container
+        self._tasks_by_type.setdefault(handler, container)
 
     def add_post_processor(self, handler, order: int = 0):
         """
@@ -179,22 +257,45 @@ class AgentContext:
         executable = ex.Executable(handler, order)
         self.configurations.append(executable)
 
-    def add_loop_method(self, handler, fixed_interval_sec: int = None, order: int = 0):
+    def add_loop_method(self, handler, fixed_interval_sec: float = None, order: int = 0, cron: str = None,
+                        missed_tick_policy: str = sc.__missed_delay__, continuous: bool = False,
+                        error_backoff_sec: float = 1.0):
         """
 
         :param order:
         :param handler:
-        :param fixed_interval_sec:
+        :param fixed_interval_sec: Interval between runs, fractions of a second are allowed
+        :param cron: Five-field cron expression, e.g. '*/5 * * * *'
+        :param missed_tick_policy: 'delay', 'skip' or 'catch_up'
+        :param continuous: Re-invoke the method by a dedicated worker as soon as the previous run is completed
+        :param error_backoff_sec: Delay of a continuous loop after an error, doubled on consecutive errors
         :return:
         """
         if not callable(handler):
             raise ValueError(f'Loop method must be callable. {handler} is not a callable.')
 
-        if fixed_interval_sec is None:
+        if continuous:
+            if fixed_interval_sec is not None or cron is not None:
+                raise SyntaxError(f'Continuous loop can not have cron or fixed interval')
+            if error_backoff_sec <= 0:
+                raise ValueError(f'Error backoff must be greater than zero. Current backoff {error_backoff_sec}')
+        elif (fixed_interval_sec is None) == (cron is None):
             raise SyntaxError(f'Please use cron OR fixed interval')
 
+        if fixed_interval_sec is not None and fixed_interval_sec <= 0:
+            raise ValueError(
+                f'Loop interval must be greater than zero. Current interval {fixed_interval_sec}. '
+                f'Use a continuous loop to re-invoke the method without delay'
+            )
+
+        if missed_tick_policy not in sc.__missed_policies__:
+            raise ValueError(f'Invalid missed tick policy {missed_tick_policy}. Use one of {sc.__missed_policies__}')
+
         executable = ex.Executable(handler, order)
-        container = types.LoopContainer(executable, fixed_interval_sec)
+        cron = sc.CronExpression(cron) if cron is not None else None
+        container = types.LoopContainer(
+            executable, fixed_interval_sec, cron, missed_tick_policy, continuous, error_backoff_sec
+        )
         self.loops.append(container)
 
     def add_exception_handler(self, handler, error_types: list = None, order: int = 0):
@@ -204,6 +305,7 @@ class AgentContext:
         executable = ex.Executable(handler, order)
         container = types.ExceptionHandlerContainer(executable, error_types)
         self.exception_handlers.append(container)
+        self._exception_handlers_by_type.clear()
 
 
 #############################################################
@@ -238,17 +340,162 @@ def build_component_in_context(context: AgentContext, _type: type):
     return component
 
 
-def build_components(context: AgentContext):
+def build_components(context: AgentContext, max_workers: int = None):
     """
-    Build components in context
+    Build components in context.
+    Dependencies of the components are taken from the parameter annotations of their builders.
+    Components that don't depend on each other are built concurrently (network handshakes overlap),
+    every component is built after all its dependencies.
     :param context:
+    :param max_workers: Max components built at the same time. 1 to build one by one
     :return:
     """
+    dependencies = build_component_dependencies(context)
+    validate_component_dependencies(dependencies)
+
+    remaining = {name: len(deps) for name, deps in dependencies.items()}
+    dependents = {name: [] for name in dependencies}
+    for name, deps in dependencies.items():
+        for dep in deps:
+            dependents[dep].append(name)
+
+    with futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='component_builder') as executor:
+        def _submit(_name):
+            _type = context.components_builders[_name].return_param
+            return executor.submit(_build_component_timed, context, _name, _type)
+
+        running = {_submit(name): name for name, count in remaining.items() if count == 0}
+        while len(running) > 0:
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                # Raise the builder error
+                future.result()
+                for dependent in dependents[name]:
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        running[_submit(dependent)] = dependent
+
+
+def build_component_dependencies(context: AgentContext) -> dict:
+    """
+    Form the dependency graph of the components that are not built yet
+    :param context:
+    :return: dict {component name: [names of components it depends on]}
+    """
+    dependencies = {}
     for _name, _type, _executable in context.components_builders:
         if _name in context.components or _type in context.components:
             # If this component already building
             continue
-        _ = build_component_in_context(context, _type)
+
+        deps = []
+        for k, v in _executable.parameters.items():
+            _dep_key = k if v == any else v
+            if _dep_key not in context.components_builders or _dep_key in context.components:
+                continue
+            _dep_name = _dep_key if isinstance(_dep_key, str) \
+                else context.components_builders.get_name_from_type(_dep_key)
+            if _dep_name not in deps:
+                deps.append(_dep_name)
+        dependencies[_name] = deps
+    return dependencies
+
+
+def validate_component_dependencies(dependencies: dict):
+    """
+    Check that the components don't depend on each other in a cycle
+    :param dependencies: dict {component name: [names of components it depends on]}
+    :return:
+    """
+    visited = set()
+
+    def _visit(name, path):
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            raise ValueError(f'Cyclic dependency of components: {" -> ".join(cycle)}')
+        if name in visited:
+            return
+        path.append(name)
+        for dep in dependencies.get(name, []):
+            _visit(dep, path)
+        path.pop()
+        visited.add(name)
+
+    for _name in dependencies:
+        _visit(_name, [])
+
+
+def is_lazy_component(context: AgentContext, builder: ex.Executable) -> bool:
+    return builder.lazy if builder.lazy is not None else context.lazy_components
+
+
+def validate_component_builder(context: AgentContext, builder: ex.Executable):
+    """
+    Check that all builder parameters can be injected
+    :param context:
+    :param builder:
+    :return:
+    """
+    for k, v in builder.parameters.items():
+        _key = k if v == any else v
+        if _key not in context.components_builders and _key not in context.components:
+            raise ValueError(f'Builder for component \'{_key}\' is not found.')
+
+
+def _build_component_timed(context: AgentContext, name: str, _type: type):
+    builder = context.components_builders[name]
+    if is_lazy_component(context, builder):
+        validate_component_builder(context, builder)
+        component = types.LazyComponent(lambda: _execute_builder_timed(context, name, builder))
+        context.components.put(component, name, _type)
+        return component
+
+    started_at = time.perf_counter()
+    component = build_component_in_context(context, _type)
+    _record_build_time(context, name, time.perf_counter() - started_at)
+    return component
+
+
+def _execute_builder_timed(context: AgentContext, name: str, builder: ex.Executable):
+    started_at = time.perf_counter()
+    component = ex.execute_executable(builder, context.components)
+    if component is None:
+        raise ValueError(f'Builder of component {name} returned None')
+    _record_build_time(context, name, time.perf_counter() - started_at)
+    return component
+
+
+def _record_build_time(context: AgentContext, name: str, elapsed: float):
+    context.components_build_times[name] = elapsed
+    _log.debug(f'Component {name} is built in {elapsed * 1000:.1f} ms')
+
+
+def close_components(context: AgentContext) -> int:
+    """
+    Call close() of the built components in the reverse order of the build,
+    so a component is closed before the components it depends on.
+    Lazy components that were never injected are not built to be closed.
+    An error of one component is logged and doesn't stop closing of the others.
+    :param context:
+    :return: Number of closed components
+    """
+    closed = 0
+    for name, _, component in reversed(list(context.components)):
+        if isinstance(component, types.LazyComponent):
+            if not component.is_built:
+                continue
+            component = component.get()
+
+        close = getattr(component, 'close', None)
+        if not callable(close):
+            continue
+        try:
+            ex.complete_awaitable(close())
+            closed += 1
+        except Exception:
+            _log.exception(f'Failed to close component {name}')
+    return closed
 
 
 def build_skills(context: AgentContext):
@@ -267,7 +514,10 @@ def build_skills(context: AgentContext):
                 f'Specify in it additional arguments that should be injected from the context'
             )
 
-        context.skills[skill_name] = ex.Executable(handler)
+        executable = ex.Executable(handler)
+        executable.executor = skill_class.executor
+        context.skills[skill_name] = executable
+        context.index_skill_handler(handler, skill_name)
 
 
 def validate_skills(context: AgentContext):
@@ -285,7 +535,8 @@ def validate_skills(context: AgentContext):
                 f'The data type must be inherited from the base data class sai.AgentValue'
             )
 
-        parameters = [k for k, v in skill.parameters.items() if issubclass(v, types.AgentValue)]
+        # Components injected by name are annotated with `any`
+        parameters = [k for k, v in skill.parameters.items() if inspect.isclass(v) and issubclass(v, types.AgentValue)]
         if len(parameters) != 1:
             raise SyntaxError(
                 f'The agent\'s skill works on the principle of transforming objects. '
@@ -293,9 +544,32 @@ def validate_skills(context: AgentContext):
                 f'accept the object inherited from sai.AgentValue in a single copy.'
             )
 
+        # A component without a default value is required, the skill would get None on every call
+        optional = find_optional_parameters(skill.handler)
+        for k, v in skill.parameters.items():
+            if k in parameters or k in optional:
+                continue
+            _key = k if v == any else v
+            if _key not in context.components_builders and _key not in context.components:
+                raise ValueError(f'Component \'{_key}\' of skill {skill_name} is not found. '
+                                 f'Register its builder or give the parameter a default value')
+
     # skill is correct and can be use
 
 
+def find_optional_parameters(handler) -> set:
+    """
+    Names of the handler parameters with a default value
+    :param handler:
+    :return:
+    """
+    try:
+        signature = inspect.signature(handler)
+    except (TypeError, ValueError):
+        return set()
+    return {k for k, v in signature.parameters.items() if v.default is not inspect.Parameter.empty}
+
+
 def build_tasks(context: AgentContext):
     """
 
@@ -306,7 +580,36 @@ def build_tasks(context: AgentContext):
         if not isinstance(task_container, types.TaskContainer):
             raise SyntaxError('Unexpected data type for task wrapper')
         task_container.executable_init = ex.Executable(task_container.task_type)
+        task_container.executable_forward = ex.Executable(task_container.task_type.forward)
+        task_container.executable_on_complete = ex.Executable(task_container.task_type.on_complete)
         task_container.skill_graph = build_skill_graph(task_container, context)
+        task_container.skill_pipeline = None
+        _ = context.get_task_skills(task_container)
+
+
+def compile_executables(context: AgentContext):
+    """
+    Resolve injection plans of skills, tasks, loops and exception handlers.
+    Components must be built before, plans keep the resolved component objects.
+    :param context:
+    :return:
+    """
+    for skill_name, skill in context.skills.items():
+        skill.compile(context.components, flow_name='value', flow_type=types.AgentValue)
+
+    for task_name, task_container in context.tasks.items():
+        task_container.executable_init.compile(context.components)
+        # Task methods are compiled as functions of the task class, the task object is passed as self
+        task_container.executable_forward.compile(context.components, positional_count=1)
+        task_container.executable_on_complete.compile(
+            context.components, flow_name='value', flow_type=types.AgentValue, positional_count=1
+        )
+
+    for loop in context.loops:
+        loop.executable.compile(context.components)
+
+    for err in context.exception_handlers:
+        err.executable.compile(context.components, flow_name='exception', flow_type=BaseException)
 
 
 def build_skill_graph(task_container: types.TaskContainer, context: AgentContext) -> graph.AgentSkillGraph:
@@ -1,13 +1,34 @@
+import asyncio
+import collections
+import functools
 import inspect
+import logging
+import queue
 import threading as th
+import time
+
+from concurrent import futures
 
 from typing import Hashable
 
-from sidusai.core.types import NamedTypedContainer
+from sidusai.core.types import LazyComponent, NamedTypedContainer
 from sidusai.core.utils import camel_to_snake
 
 __return__ = 'return'
 
+# Skill executors
+__executor_thread__ = 'thread'
+__executor_process__ = 'process'
+__executors__ = [__executor_thread__, __executor_process__]
+
+# Thread pool overflow policies
+__overflow_block__ = 'block'
+__overflow_reject__ = 'reject'
+__overflow_shed_oldest__ = 'shed_oldest'
+__overflow_policies__ = [__overflow_block__, __overflow_reject__, __overflow_shed_oldest__]
+
+_log = logging.getLogger(__name__)
+
 
 def build_handler_name(handler):
     """
@@ -57,11 +78,72 @@ class Executable(Hashable):
         self.default_name = build_handler_name(handler)
         self.order = order
         self.name = name if name is not None else self.default_name
+        self.is_coroutine = is_coroutine_handler(handler)
+        # Where the skill is executed: agent thread pool or process pool
+        self.executor = __executor_thread__
+        # Component builders only: build the component on first use. None to use the context default
+        self.lazy = None
+
+        # Resolved injection plan. Filled by compile method when the context is built
+        self.plan = None
+
+    def compile(self, container: NamedTypedContainer, flow_name: str = None, flow_type: type = None,
+                positional_count: int = 0):
+        """
+        Resolve the injection plan of the executable object against the container.
+        The flowing value is put in the parameter with the name `flow_name` or,
+        if there is no such parameter, in the single parameter inherited from `flow_type`.
+        :param container: Components container
+        :param flow_name: Parameter name of the flowing value
+        :param flow_type: Base type of the flowing value
+        :param positional_count: Count of positional arguments passed before the injected ones (self of the method)
+        :return: ExecutablePlan
+        """
+        kwargs = build_parameters(self, container, resolve_lazy=False)
+        slot = find_flow_parameter(self, flow_name, flow_type)
+        if slot is not None:
+            kwargs.pop(slot)
+
+        # Check once that the handler accepts the resolved arguments. The call will raise TypeError otherwise
+        _bind_args = {k: None for k in kwargs}
+        if slot is not None:
+            _bind_args[slot] = None
+        inspect.signature(self.handler).bind(*[None] * positional_count, **_bind_args)
+
+        lazy_kwargs = {k: v for k, v in kwargs.items() if isinstance(v, LazyComponent)}
+        kwargs = {k: v for k, v in kwargs.items() if k not in lazy_kwargs}
+
+        self.plan = ExecutablePlan(self.handler, kwargs, slot, lazy_kwargs)
+        return self.plan
 
     def __hash__(self):
         return hash(self)
 
 
+class ExecutablePlan:
+    """
+    Precompiled call of an executable object. Components are resolved in advance,
+    so the call is a plain keyword call with the flowing value put in its slot.
+    Lazy components are resolved on call.
+    """
+
+    __slots__ = ('handler', 'kwargs', 'flow_name', 'lazy_kwargs')
+
+    def __init__(self, handler, kwargs: dict, flow_name: str | None, lazy_kwargs: dict = None):
+        self.handler = handler
+        self.kwargs = kwargs
+        self.flow_name = flow_name
+        self.lazy_kwargs = lazy_kwargs if lazy_kwargs is not None and len(lazy_kwargs) > 0 else None
+
+    def __call__(self, flow_value=None, args: tuple = ()):
+        kwargs = self.kwargs
+        if self.lazy_kwargs is not None:
+            kwargs = {**kwargs, **{k: v.get() for k, v in self.lazy_kwargs.items()}}
+        if self.flow_name is None:
+            return self.handler(*args, **kwargs)
+        return self.handler(*args, **kwargs, **{self.flow_name: flow_value})
+
+
 class ExecutableContainer(NamedTypedContainer):
     """
     Container containing indexed executable methods
@@ -74,34 +156,468 @@ class ExecutableContainer(NamedTypedContainer):
         raise TypeError('This container must be contains only Executable objects')
 
 
+class TaskFuture:
+    """
+    Handle of a task submitted to the agent. It is used to wait for the task result,
+    cancel the task and get the timing of its execution.
+
+    A task that is already running is cancelled cooperatively: the rest of its skills are not executed.
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self._future = futures.Future()
+        self._cancel_requested = False
+
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.completed_at = None
+
+    def result(self, timeout: float = None):
+        """
+        Wait for the final task value
+        :param timeout: seconds to wait, None to wait without limit
+        :return: The value passed to the task on_complete method
+        """
+        return self._future.result(timeout)
+
+    def exception(self, timeout: float = None):
+        return self._future.exception(timeout)
+
+    def cancel(self) -> bool:
+        """
+        Cancel the task. A queued task will not be started, a running task will stop before the next skill
+        :return: False if the task is already completed
+        """
+        if self._future.cancel():
+            self.completed_at = time.monotonic()
+            return True
+        if self._future.done():
+            return False
+        self._cancel_requested = True
+        return True
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_requested or self._future.cancelled()
+
+    def cancelled(self) -> bool:
+        return self._future.cancelled() or isinstance(self._exception_or_none(), futures.CancelledError)
+
+    def running(self) -> bool:
+        return self._future.running()
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def add_done_callback(self, fn):
+        """
+        Add callback called with this handle when the task is completed
+        :param fn:
+        :return:
+        """
+        self._future.add_done_callback(lambda _: fn(self))
+
+    @property
+    def wait_time(self) -> float | None:
+        """
+        Seconds in the queue before the start
+        """
+        return self.started_at - self.submitted_at if self.started_at is not None else None
+
+    @property
+    def run_time(self) -> float | None:
+        """
+        Seconds of the task execution
+        """
+        if self.started_at is None or self.completed_at is None:
+            return None
+        return self.completed_at - self.started_at
+
+    @property
+    def latency(self) -> float | None:
+        """
+        Seconds from the submission to the completion
+        """
+        return self.completed_at - self.submitted_at if self.completed_at is not None else None
+
+    def set_running(self) -> bool:
+        """
+        Mark the task as started. Used by the executing side
+        :return: False if the task was cancelled and must not be executed
+        """
+        if not self._future.set_running_or_notify_cancel():
+            return False
+        self.started_at = time.monotonic()
+        return True
+
+    def set_result(self, value):
+        self.completed_at = time.monotonic()
+        self._future.set_result(value)
+
+    def set_exception(self, exception: BaseException):
+        self.completed_at = time.monotonic()
+        self._future.set_exception(exception)
+
+    def _exception_or_none(self):
+        if not self._future.done() or self._future.cancelled():
+            return None
+        return self._future.exception()
+
+
 class ThreadPool:
     """
     An auxiliary wrapper used to manage threads in an application.
 
-    todo: Add batches and locks
+    The pool keeps at most `pool_max_size` reusable workers that take jobs from a bounded queue.
+    Workers are started on demand and leave the pool after `keep_alive_sec` seconds without work,
+    so an idle agent does not hold threads. When the queue is full, the `overflow_policy` decides
+    what happens to the submitted job:
+
+    - `block` - the caller waits until a slot in the queue is released
+    - `reject` - the job is not accepted and OverflowError is raised
+    - `shed_oldest` - the oldest queued job is dropped to make room for the new one
     """
 
-    def __init__(self, pool_max_size: int = 16):
-        self._pool_max_size = pool_max_size
+    def __init__(self, pool_max_size: int = 16, queue_max_size: int = 1024,
+                 overflow_policy: str = __overflow_block__, keep_alive_sec: float = 2.0):
+        if pool_max_size is None or pool_max_size < 1:
+            raise ValueError('Thread pool size must be greater than zero')
+
+        if queue_max_size is None or queue_max_size < 1:
+            raise ValueError('Thread pool queue size must be greater than zero')
 
-    def execute(self, target=None, args=()):
-        thread = th.Thread(target=target, args=args)
+        if overflow_policy not in __overflow_policies__:
+            raise ValueError(f'Unknown overflow policy \'{overflow_policy}\'. Use one of {__overflow_policies__}')
+
+        self._pool_max_size = pool_max_size
+        self._queue_max_size = queue_max_size
+        self._overflow_policy = overflow_policy
+        self._keep_alive_sec = keep_alive_sec
+
+        self._queue = collections.deque()
+        self._lock = th.Lock()
+        self._not_empty = th.Condition(self._lock)
+        self._not_full = th.Condition(self._lock)
+
+        self._workers = 0
+        self._idle_workers = 0
+        self._active_workers = 0
+
+        self._submitted_count = 0
+        self._completed_count = 0
+        self._failed_count = 0
+        self._rejected_count = 0
+        self._shed_count = 0
+
+    @property
+    def pool_max_size(self) -> int:
+        return self._pool_max_size
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def active_workers(self) -> int:
+        return self._active_workers
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the pool counters
+        :return: dict with queue and worker counters
+        """
+        with self._lock:
+            return {
+                'queue_depth': len(self._queue),
+                'queue_max_size': self._queue_max_size,
+                'workers': self._workers,
+                'active_workers': self._active_workers,
+                'pool_max_size': self._pool_max_size,
+                'submitted': self._submitted_count,
+                'completed': self._completed_count,
+                'failed': self._failed_count,
+                'rejected': self._rejected_count,
+                'shed': self._shed_count,
+            }
+
+    def execute(self, target=None, args=(), kwargs: dict = None, on_drop=None, block: bool = True):
+        """
+        Put a job to the pool queue. The job will be executed by the first free worker
+        :param target: callable object
+        :param args: positional arguments of target
+        :param kwargs: keyword arguments of target
+        :param on_drop: optional callback, called without arguments if the job is shed from the queue
+        :param block: Wait for a free slot of the full queue under the block policy.
+        If False, queue.Full is raised instead of waiting
+        :return:
+        """
+        if not callable(target):
+            raise ValueError(f'Thread pool target {target} must be callable')
+
+        job = (target, args, kwargs if kwargs is not None else {}, on_drop)
+        shed_on_drop = None
+        with self._lock:
+            if len(self._queue) >= self._queue_max_size:
+                shed_on_drop = self._apply_overflow_policy(block)
+
+            self._queue.append(job)
+            self._submitted_count += 1
+
+            if len(self._queue) > self._idle_workers and self._workers < self._pool_max_size:
+                self._start_worker()
+            self._not_empty.notify()
+
+        # The callback may submit to the pool again, so it is called without the pool lock
+        if shed_on_drop is not None:
+            shed_on_drop()
+
+    def submit(self, target, *args, **kwargs) -> futures.Future:
+        """
+        Put a job to the pool queue and get the future of its result.
+        The future is cancelled if the job is shed from the queue
+        :param target: callable object
+        :return: concurrent.futures.Future
+        """
+        future, job = build_future_job(target, args, kwargs)
+        self.execute(target=job, on_drop=future.cancel)
+        return future
+
+    def _apply_overflow_policy(self, block: bool = True):
+        """
+        Release a queue slot according to the overflow policy. Must be called under the pool lock
+        :param block: Wait for a free slot under the block policy
+        :return: on_drop callback of the shed job, to be called after the pool lock is released
+        """
+        if self._overflow_policy == __overflow_reject__:
+            self._rejected_count += 1
+            raise OverflowError(f'Thread pool queue is full ({self._queue_max_size} jobs). Job is rejected')
+
+        if self._overflow_policy == __overflow_shed_oldest__:
+            _, _, _, on_drop = self._queue.popleft()
+            self._shed_count += 1
+            return on_drop
+
+        if not block:
+            raise queue.Full(f'Thread pool queue is full ({self._queue_max_size} jobs)')
+
+        while len(self._queue) >= self._queue_max_size:
+            self._not_full.wait()
+        return None
+
+    def _start_worker(self):
+        thread = th.Thread(target=self._worker_loop, daemon=False)
+        self._workers += 1
         thread.start()
 
+    def _worker_loop(self):
+        while True:
+            with self._lock:
+                while len(self._queue) == 0:
+                    self._idle_workers += 1
+                    notified = self._not_empty.wait(self._keep_alive_sec)
+                    self._idle_workers -= 1
+                    if not notified and len(self._queue) == 0:
+                        self._workers -= 1
+                        return
+
+                target, args, kwargs, _ = self._queue.popleft()
+                self._active_workers += 1
+                self._not_full.notify()
+
+            failed = False
+            try:
+                target(*args, **kwargs)
+            except BaseException:
+                failed = True
+                _log.exception(f'Unhandled error in thread pool job {target}')
+            finally:
+                with self._lock:
+                    self._active_workers -= 1
+                    self._completed_count += 1
+                    if failed:
+                        self._failed_count += 1
+
+
+class KeySerialExecutor:
+    """
+    Executes jobs sharing a key (user id, chat id) strictly one by one in submission order,
+    while jobs of different keys are executed in parallel in the thread pool.
+
+    Every key with queued or running jobs has a mailbox. The mailbox is drained by one pool worker
+    and is removed as soon as it is empty, so idle keys don't take memory.
+    """
 
-def build_parameters(executable: Executable, container: NamedTypedContainer):
+    def __init__(self, thread_pool: ThreadPool):
+        self._thread_pool = thread_pool
+        self._lock = th.Lock()
+        self._mailboxes = {}
+
+    def __len__(self):
+        return len(self._mailboxes)
+
+    def __contains__(self, key):
+        return key in self._mailboxes
+
+    def execute(self, key, target, args=(), kwargs: dict = None, on_drop=None):
+        """
+        Put a job to the mailbox of the key
+        :param key: hashable key of the serialized jobs
+        :param target: callable object
+        :param args: positional arguments of target
+        :param kwargs: keyword arguments of target
+        :param on_drop: optional callback, called without arguments if the job is shed by the thread pool
+        :return:
+        """
+        if not callable(target):
+            raise ValueError(f'Job target {target} must be callable')
+
+        job = (target, args, kwargs if kwargs is not None else {}, on_drop)
+        with self._lock:
+            mailbox = self._mailboxes.get(key)
+            if mailbox is not None:
+                # The mailbox is drained by a worker already
+                mailbox.append(job)
+                return
+            self._mailboxes[key] = collections.deque([job])
+
+        try:
+            self._thread_pool.execute(target=self._drain, args=(key,), on_drop=lambda: self._drop(key))
+        except BaseException:
+            self._drop(key)
+            raise
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                mailbox = self._mailboxes[key]
+                target, args, kwargs, _ = mailbox[0]
+
+            try:
+                target(*args, **kwargs)
+            except BaseException:
+                _log.exception(f'Unhandled error in job {target} of key {key}')
+
+            with self._lock:
+                mailbox.popleft()
+                if len(mailbox) == 0:
+                    del self._mailboxes[key]
+                    return
+
+    def _drop(self, key):
+        """
+        Remove the mailbox whose drain job was not accepted by the thread pool
+        :param key:
+        :return:
+        """
+        with self._lock:
+            mailbox = self._mailboxes.pop(key, None)
+        if mailbox is None:
+            return
+        for _, _, _, on_drop in mailbox:
+            if on_drop is not None:
+                on_drop()
+
+
+def is_coroutine_handler(handler) -> bool:
+    """
+    Check that the handler (function, method or callable object) is declared with async def
+    :param handler:
+    :return:
+    """
+    if inspect.iscoroutinefunction(handler):
+        return True
+
+    if not inspect.isclass(handler) and not inspect.isfunction(handler) and not inspect.ismethod(handler):
+        return inspect.iscoroutinefunction(getattr(handler, '__call__', None))
+
+    return False
+
+
+def complete_awaitable(result):
+    """
+    Complete the result of an async handler called from synchronous code.
+    The awaitable is run in a new event loop of the current thread
+    :param result: handler result
+    :return: awaited result or the result itself
+    """
+    if inspect.isawaitable(result):
+        return asyncio.run(_await(result))
+    return result
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def build_future_job(target, args: tuple, kwargs: dict) -> tuple:
+    """
+    Wrap the call into a pool job that completes a future
+    :param target: callable object
+    :param args: positional arguments of target
+    :param kwargs: keyword arguments of target
+    :return: pair (concurrent.futures.Future, job)
+    """
+    future = futures.Future()
+
+    def _run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(target(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    return future, _run
+
+
+async def execute_plan_async(executable: Executable, thread_pool: ThreadPool, flow_value=None, args: tuple = ()):
+    """
+    Execute the compiled plan in the running event loop. Async handlers are awaited,
+    synchronous handlers are run in the thread pool so they don't block the loop
+    :param executable: Executable object with compiled plan
+    :param thread_pool: Pool for synchronous handlers
+    :param flow_value: Flowing value
+    :param args: Positional arguments
+    :return: handler result
+    """
+    if executable.is_coroutine:
+        return await executable.plan(flow_value, args)
+
+    future, job = build_future_job(executable.plan, (flow_value, args), {})
+    try:
+        thread_pool.execute(target=job, on_drop=future.cancel, block=False)
+    except queue.Full:
+        # The full queue is waited for in a thread of the loop executor, the event loop goes on
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(thread_pool.execute, target=job, on_drop=future.cancel)
+        )
+
+    result = await asyncio.wrap_future(future)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def build_parameters(executable: Executable, container: NamedTypedContainer, resolve_lazy: bool = True):
     """
     Build  method arguments for executable object
     :param executable:
     :param container:
+    :param resolve_lazy: Build lazy components. If False, LazyComponent holders are put to the arguments
     :return:
     """
+    _get = container.__getitem__ if resolve_lazy else container.peek
     args = {}
     for k, v in executable.parameters.items():
         if v == any:
-            args[k] = container[k] if k in container else None
+            args[k] = _get(k) if k in container else None
         else:
-            args[k] = container[v] if v in container else None
+            args[k] = _get(v) if v in container else None
 
     return args
 
@@ -125,6 +641,24 @@ def update_parameters_from_dict(args: dict, executable: Executable, container: d
                 args[k] = typed_container[v]
 
 
+def find_flow_parameter(executable: Executable, flow_name: str = None, flow_type: type = None) -> str | None:
+    """
+    Find the parameter name that takes the flowing value (agent value or exception)
+    :param executable:
+    :param flow_name: Preferred parameter name
+    :param flow_type: Base type of the flowing value
+    :return: Parameter name or None
+    """
+    if flow_name is not None and flow_name in executable.parameters:
+        return flow_name
+
+    if flow_type is None:
+        return None
+
+    _params = [k for k, v in executable.parameters.items() if inspect.isclass(v) and issubclass(v, flow_type)]
+    return _params[0] if len(_params) == 1 else None
+
+
 def execute_executable(executable: Executable, container: NamedTypedContainer, additional_container: dict = None):
     """
     Execute an executable object by generating method arguments from the container
@@ -1,4 +1,5 @@
-import networkx as nx
+import heapq
+import itertools
 
 __separator__ = '__$'
 __in__ = 'in'
@@ -8,6 +9,10 @@ __out__ = 'out'
 class AgentSkillGraph:
     """
     Skill graph formation container
+
+    The graph is complete: every pair of skill vertices is connected. Only the explicitly weighted
+    edges are stored, every other pair of vertices has the implicit default weight.
+    The `in` and `out` vertices are not connected to each other.
     """
 
     def __init__(self,
@@ -17,30 +22,123 @@ class AgentSkillGraph:
                  weight_for_used_nodes: int = 1
                  ):
         self.depth = max_skill_contains(available_skill_names)
+        self.default_weight = weight_for_not_use_nodes
 
-        nodes = build_repeatable_nodes_names(full_skill_names, self.depth)
-        edges = build_edges(nodes, weight=weight_for_not_use_nodes)
-
-        update_edges_at_skill(available_skill_names, edges, weight=weight_for_used_nodes)
+        # Vertices in the order of their adjacency. The order defines the choice between equal paths
+        self.nodes = [__in__] + build_repeatable_nodes_names(full_skill_names, self.depth) + [__out__]
+        self.node_indexes = {node: index for index, node in enumerate(self.nodes)}
 
-        self.graph = nx.Graph()
-        self.graph.add_weighted_edges_from(edges)
+        # Explicitly weighted edges {from: {to: weight}}, stored in both directions
+        self.edges = {}
+        update_edges_at_skill(available_skill_names, self, weight=weight_for_used_nodes)
 
-        # TODO: Print graph to console
-        #   use nx.write_network_text(self.graph)
+        # Incremented on every weight change. Used to invalidate cached skill pipelines
+        self.version = 0
 
     def get_active_nodes(self):
         """
         :return: Get a list of available skills from the graph
         """
-        _path = list(nx.dijkstra_path(self.graph, __in__, __out__))
+        _path = self.shortest_path(__in__, __out__)
         return [v.split(__separator__)[0] if __separator__ in v else v for v in _path if v not in [__in__, __out__]]
 
     def get_skill_weight(self, from_skill_name: str, to_skill_name: str):
-        return self.graph[from_skill_name][to_skill_name]['weight']
+        self._validate_edge(from_skill_name, to_skill_name)
+        _edges = self.edges.get(from_skill_name)
+        if _edges is not None and to_skill_name in _edges:
+            return _edges[to_skill_name]
+        return self.default_weight
 
     def set_skill_weight(self, from_skill_name: str, to_skill_name: str, weight):
-        self.graph[from_skill_name][to_skill_name]['weight'] = weight
+        self._validate_edge(from_skill_name, to_skill_name)
+        self._put_edge(from_skill_name, to_skill_name, weight)
+        self.version += 1
+
+    def has_edge(self, from_skill_name: str, to_skill_name: str) -> bool:
+        if from_skill_name not in self.node_indexes or to_skill_name not in self.node_indexes:
+            return False
+        if from_skill_name == to_skill_name:
+            return False
+        return {from_skill_name, to_skill_name} != {__in__, __out__}
+
+    def shortest_path(self, source: str, target: str) -> list:
+        """
+        Dijkstra's algorithm over the implicit complete graph.
+
+        A vertex reached by a default edge can't be improved by a default edge of a vertex settled later,
+        so every vertex is relaxed by a default edge only once. Neighbors are visited in the vertex order,
+        so equal paths are resolved in the same way as on the materialized complete graph.
+        :param source:
+        :param target:
+        :return: List of vertices
+        """
+        for node in [source, target]:
+            if node not in self.node_indexes:
+                raise KeyError(f'Vertex {node} is not in the graph')
+
+        counter = itertools.count()
+        fringe = [(0, next(counter), source)]
+        dist = {}
+        seen = {source: 0}
+        pred = {source: None}
+        # Vertices that have not been relaxed by a default edge yet
+        not_relaxed = dict.fromkeys(self.nodes)
+
+        while fringe:
+            d, _, v = heapq.heappop(fringe)
+            if v in dist:
+                continue
+            dist[v] = d
+            not_relaxed.pop(v, None)
+            if v == target:
+                break
+
+            for u, cost in self._neighbors(v, not_relaxed):
+                if u in dist:
+                    continue
+                vu_dist = d + cost
+                if u not in seen or vu_dist < seen[u]:
+                    seen[u] = vu_dist
+                    pred[u] = v
+                    heapq.heappush(fringe, (vu_dist, next(counter), u))
+
+        if target not in dist:
+            raise ValueError(f'No path between {source} and {target}')
+
+        path = []
+        node = target
+        while node is not None:
+            path.append(node)
+            node = pred[node]
+        path.reverse()
+        return path
+
+    def _neighbors(self, node: str, not_relaxed: dict) -> list:
+        """
+        Weighted neighbors of the vertex worth relaxing, in the vertex order
+        :param node:
+        :param not_relaxed: Vertices without default edge relaxation. Relaxed vertices are removed from it
+        :return: list of pairs (vertex, weight)
+        """
+        explicit = self.edges.get(node, {})
+        neighbors = list(explicit.items())
+
+        # Every vertex is relaxed by a default edge once, so only the relaxed vertices are collected
+        relaxed = [u for u in not_relaxed if u not in explicit and self.has_edge(node, u)]
+        for u in relaxed:
+            del not_relaxed[u]
+        neighbors.extend((u, self.default_weight) for u in relaxed)
+
+        neighbors.sort(key=lambda pair: self.node_indexes[pair[0]])
+        return neighbors
+
+    def _put_edge(self, from_skill_name: str, to_skill_name: str, weight):
+        self.edges.setdefault(from_skill_name, {})[to_skill_name] = weight
+        self.edges.setdefault(to_skill_name, {})[from_skill_name] = weight
+
+    def _validate_edge(self, from_skill_name: str, to_skill_name: str):
+        if not self.has_edge(from_skill_name, to_skill_name):
+            raise KeyError(f'Edge {from_skill_name} - {to_skill_name} is not in the graph')
 
 
 def max_skill_contains(skills: list) -> int:
@@ -53,15 +151,6 @@ def max_skill_contains(skills: list) -> int:
     return max(_s)
 
 
-def build_edges(nodes: list, weight: int = 100):
-    edges = []
-    build_node_with_weight(__in__, nodes, edges, weight)
-    for i, _node in enumerate(nodes):
-        build_node_with_weight(_node, nodes, edges, weight)
-    build_node_with_weight(__out__, nodes, edges, weight)
-    return edges
-
-
 def build_repeatable_nodes_names(nodes: [str], depth: int):
     """
     We set the number of vertices, taking into account the repetition of the use of skills
@@ -76,22 +165,6 @@ def build_repeatable_nodes_names(nodes: [str], depth: int):
     return _nodes
 
 
-def build_node_with_weight(from_node, to_nodes, edges, weight: int = 100):
-    """
-    Generate weighted edges from a vertex to a specified list of vertices
-    :param from_node:
-    :param to_nodes:
-    :param edges: Current list of weighted edges
-    :param weight:
-    :return:
-    """
-    for _node_next in to_nodes:
-        if from_node == _node_next:
-            continue
-        _edge = (from_node, _node_next, weight)
-        edges.append(_edge)
-
-
 def build_skill_names_at_index(skills: list):
     """
     Forming a list of vertices with a repeat inclusion index
@@ -107,19 +180,17 @@ def build_skill_names_at_index(skills: list):
     return _available_nodes
 
 
-def update_edges_at_skill(skills: list, edges, weight: int = 1):
+def update_edges_at_skill(skills: list, skill_graph: AgentSkillGraph, weight: int = 1):
     """
-    Updating edge weights for skill list
+    Updating edge weights for skill list. Edges to vertices missing in the graph are skipped
     :param skills:
-    :param edges:
+    :param skill_graph:
     :param weight:
     :return:
     """
     prev = __in__
     _available_nodes = build_skill_names_at_index(skills)
     for skill in _available_nodes:
-        for index, edge in enumerate(edges):
-            _in, _out, _weight = edge
-            if (_in == prev and _out == skill) or (_in == skill and _out == prev):
-                edges[index] = (_in, _out, weight)
+        if skill_graph.has_edge(prev, skill):
+            skill_graph._put_edge(prev, skill, weight)
         prev = skill
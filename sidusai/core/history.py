@@ -0,0 +1,327 @@
+import collections.abc
+import sys
+
+# Roles of the messages that can be pinned at the beginning of the history
+__system_role__ = 'system'
+__min_capacity__ = 8
+
+
+class ChatMessage:
+    """
+    Compact record of a chat message. It is read as the {'role', 'content'} dict
+    (`message['content']`, `message.get('role')`, `'content' in message`), so the history code
+    works with both. Role strings are interned, all messages of a role share one string.
+    """
+
+    __slots__ = ('role', 'content', 'tokens', 'summary')
+
+    def __init__(self, role: str, content: str, tokens: int = None, summary: bool = None):
+        self.role = sys.intern(role)
+        self.content = content
+        # Cached estimated tokens of the message
+        self.tokens = tokens
+        # The message is a summary of the earlier messages
+        self.summary = summary
+
+    @staticmethod
+    def from_dict(message: dict) -> 'ChatMessage':
+        if isinstance(message, ChatMessage):
+            return message
+        return ChatMessage(message['role'], message['content'], message.get('tokens'), message.get('summary'))
+
+    def to_dict(self) -> dict:
+        """
+        Message of the provider payload
+        :return: {'role', 'content'} dict
+        """
+        return {'role': self.role, 'content': self.content}
+
+    def get(self, key: str, default=None):
+        if key not in ChatMessage.__slots__:
+            return default
+        value = getattr(self, key)
+        return value if value is not None else default
+
+    def __getitem__(self, key: str):
+        if key not in ChatMessage.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in ChatMessage.__slots__:
+            raise KeyError(f'Chat message has no field \'{key}\'. Use one of {ChatMessage.__slots__}')
+        setattr(self, key, sys.intern(value) if key == 'role' else value)
+
+    def __contains__(self, key: str):
+        return key in ChatMessage.__slots__ and getattr(self, key) is not None
+
+    def __eq__(self, other):
+        # Equal to the record or the {'role', 'content'} dict of the same message, as the dicts are
+        if isinstance(other, ChatMessage):
+            return self.role == other.role and self.content == other.content
+        if isinstance(other, collections.abc.Mapping):
+            return self.role == other.get('role') and self.content == other.get('content')
+        return NotImplemented
+
+    # Messages are mutable as the dicts are
+    __hash__ = None
+
+    def __repr__(self):
+        return f'ChatMessage({self.role!r}, {self.content!r})'
+
+
+class ChatHistory(collections.abc.MutableSequence):
+    """
+    History of a chat: the pinned system prompt and a ring buffer of the conversation.
+
+    Leading system messages are kept in a separate prefix, the rest of the messages are stored in a ring
+    of slots. Appending a message and dropping the oldest messages after the prefix move the ends
+    of the ring, nothing is copied, so both cost O(1) per message. The ring grows by doubling
+    and never shrinks, a trimmed history reuses the released slots.
+
+    The history is a mutable sequence of ChatMessage (collections.abc.MutableSequence): besides len(), indexes,
+    iteration, `append`, `insert`, `pop`, `remove` and `+=` it supports slices with step 1 (read as lists),
+    `del history[a:b]` and `history[a:b] = messages`. It is equal to a sequence of the same messages,
+    `history + messages` is a new history. Added dicts are converted to records.
+    A change in the middle of the ring moves the messages between the change and the closest end.
+    """
+
+    __slots__ = ('_pinned', '_slots', '_head', '_size')
+
+    def __init__(self, messages=None):
+        """
+        :param messages: Initial ChatMessage or {'role', 'content'} messages
+        """
+        self._pinned = []
+        self._slots = [None] * __min_capacity__
+        self._head = 0
+        self._size = 0
+        if messages is not None:
+            self.extend(messages)
+
+    @property
+    def pinned(self) -> int:
+        """
+        Number of the pinned system messages
+        """
+        return len(self._pinned)
+
+    def append(self, message):
+        if type(message) is not ChatMessage:
+            message = ChatMessage.from_dict(message)
+        size = self._size
+        if size == 0 and message.role == __system_role__ and not message.summary:
+            self._pinned.append(message)
+            return
+
+        slots = self._slots
+        if size == len(slots):
+            self._grow(size + 1)
+            slots = self._slots
+        slots[(self._head + size) % len(slots)] = message
+        self._size = size + 1
+
+    def drop_oldest(self, count: int = 1):
+        """
+        Drop the oldest messages after the pinned prefix
+        :param count: Max dropped messages
+        :return:
+        """
+        count = min(count, self._size)
+        slots = self._slots
+        capacity = len(slots)
+        head = self._head
+        for i in range(count):
+            slots[(head + i) % capacity] = None
+        self._head = (head + count) % capacity
+        self._size -= count
+
+    def insert(self, index: int, message):
+        message = ChatMessage.from_dict(message)
+        length = len(self)
+        if index < 0:
+            index = max(0, index + length)
+        index = min(index, length)
+
+        pinned = len(self._pinned)
+        # A leading system message becomes a part of the pinned prefix
+        is_pinned = message.role == __system_role__ and not message.summary
+        if index < pinned or (index == pinned and is_pinned):
+            self._rebuild(index, index, [message])
+        elif index == length:
+            self.append(message)
+        else:
+            self._insert(index - pinned, [message])
+
+    def extend(self, messages):
+        if messages is self:
+            messages = list(messages)
+        for message in messages:
+            self.append(message)
+
+    def clear(self):
+        self._pinned = []
+        self._slots = [None] * __min_capacity__
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return len(self._pinned) + self._size
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._get(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self)))]
+        return self._get(self._normalize(index))
+
+    def __setitem__(self, index, value):
+        if not isinstance(index, slice):
+            index = self._normalize(index)
+            value = ChatMessage.from_dict(value)
+            if index < len(self._pinned):
+                self._rebuild(index, index + 1, [value])
+            else:
+                self._slots[(self._head + index - len(self._pinned)) % len(self._slots)] = value
+            return
+
+        start, stop = self._slice_bounds(index)
+        new = [ChatMessage.from_dict(message) for message in value]
+        if start < len(self._pinned):
+            self._rebuild(start, stop, new)
+            return
+        self._delete(start - len(self._pinned), stop - start)
+        self._insert(start - len(self._pinned), new)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop = self._slice_bounds(index)
+        else:
+            start = self._normalize(index)
+            stop = start + 1
+
+        pinned = len(self._pinned)
+        if start == pinned:
+            # The oldest messages of the conversation, the usual trim
+            self.drop_oldest(stop - start)
+        elif start < pinned:
+            self._rebuild(start, stop, [])
+        else:
+            self._delete(start - pinned, stop - start)
+
+    def __eq__(self, other):
+        if isinstance(other, (str, bytes)) or not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __add__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        result = ChatHistory(self)
+        result.extend(other)
+        return result
+
+    def __radd__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        result = ChatHistory(other)
+        result.extend(self)
+        return result
+
+    def __repr__(self):
+        return f'ChatHistory({list(self)!r})'
+
+    def _get(self, index: int) -> ChatMessage:
+        pinned = len(self._pinned)
+        if index < pinned:
+            return self._pinned[index]
+        return self._slots[(self._head + index - pinned) % len(self._slots)]
+
+    def _normalize(self, index: int) -> int:
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError('Chat history index out of range')
+        return index
+
+    def _slice_bounds(self, index: slice) -> tuple:
+        start, stop, step = index.indices(len(self._pinned) + self._size)
+        if step != 1:
+            raise ValueError('Chat history supports slices with step 1 only')
+        return start, max(start, stop)
+
+    def _delete(self, offset: int, count: int):
+        # The messages on the shorter side of the deleted run are moved to close the gap
+        if count <= 0:
+            return
+        capacity = len(self._slots)
+        tail = self._size - offset - count
+        if offset <= tail:
+            for i in range(offset - 1, -1, -1):
+                self._slots[(self._head + i + count) % capacity] = self._slots[(self._head + i) % capacity]
+            for i in range(count):
+                self._slots[(self._head + i) % capacity] = None
+            self._head = (self._head + count) % capacity
+        else:
+            for i in range(offset, offset + tail):
+                self._slots[(self._head + i) % capacity] = self._slots[(self._head + i + count) % capacity]
+            for i in range(offset + tail, self._size):
+                self._slots[(self._head + i) % capacity] = None
+        self._size -= count
+
+    def _insert(self, offset: int, messages: list):
+        # The messages on the shorter side of the offset are moved to make room for the run
+        count = len(messages)
+        if count == 0:
+            return
+        if self._size + count > len(self._slots):
+            self._grow(self._size + count)
+        capacity = len(self._slots)
+        if offset <= self._size - offset:
+            self._head = (self._head - count) % capacity
+            for i in range(offset):
+                self._slots[(self._head + i) % capacity] = self._slots[(self._head + i + count) % capacity]
+        else:
+            for i in range(self._size - 1, offset - 1, -1):
+                self._slots[(self._head + i + count) % capacity] = self._slots[(self._head + i) % capacity]
+        for i, message in enumerate(messages):
+            self._slots[(self._head + offset + i) % capacity] = message
+        self._size += count
+
+    def _grow(self, min_capacity: int):
+        capacity = len(self._slots)
+        while capacity < min_capacity:
+            capacity *= 2
+        messages = [self._slots[(self._head + i) % len(self._slots)] for i in range(self._size)]
+        self._slots = messages + [None] * (capacity - self._size)
+        self._head = 0
+
+    def _rebuild(self, start: int, stop: int, new: list):
+        # A change of the pinned prefix, the history is built again
+        messages = list(self)
+        messages[start:stop] = new
+        self.clear()
+        self.extend(messages)
+
+
+#################################################################
+# Utility methods
+#################################################################
+
+def encode_json(obj):
+    """
+    `default` of json.dumps for the history types. Messages are encoded one by one
+    as {'role', 'content'} dicts, the history is encoded as a list of them
+    :param obj:
+    :return:
+    """
+    if isinstance(obj, ChatMessage):
+        return obj.to_dict()
+    if isinstance(obj, ChatHistory):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
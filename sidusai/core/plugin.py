@@ -1,7 +1,11 @@
+import threading
+
 from sidusai.core.agent import Agent
 from sidusai.core.types import AgentTask, AgentValue
 
 import sidusai.core.execute as ex
+import sidusai.core.history as history
+import sidusai.core.tokens as tokens
 
 
 class AgentPlugin:
@@ -69,19 +73,40 @@ class ChatAgentValue(AgentValue):
 
     Most often, such an agent is transformed by adding a new element to the array
     describing the user's or agent's message. The logic can be overridden by the user.
-    """
+    By default the messages are stored in ChatHistory, a plain list of message dicts is supported as well.
 
-    messages: list = []
+    With a token budget the oldest messages after the system prompt are dropped when an appended message
+    exceeds it. Tokens of every message are estimated once and cached in the message.
+
+    The history can be shared with other threads, e.g. with the background compaction. All changes
+    of the messages and the snapshots of the requests are made under the lock of the value.
+    The lock is not pickled, a copy of the value sent to a process skill gets its own lock.
+    """
 
-    def __init__(self, messages):
+    def __init__(self, messages: history.ChatHistory | list = None, token_budget: int = None):
+        """
+        :param messages: ChatHistory or list of {'role', 'content'} messages. None for a new ChatHistory
+        :param token_budget: Max estimated tokens of the messages, None for no limit.
+        The newest message is always kept
+        """
         super().__init__()
-        self.messages = messages
+        self.messages = messages if messages is not None else history.ChatHistory()
+        self.token_budget = token_budget
+        # Messages counted in the running total of tokens
+        self._counted_messages = 0
+        self._counted_tokens = 0
+        # Optional callable(str) receiving parts of the assistant message from streaming clients
+        self.on_token = None
+        # Token usage of the last completion as reported by the provider
+        self.usage = None
+        self._lock = threading.RLock()
 
     def last_content(self) -> str | None:
-        if len(self.messages) > 0:
-            message = self.messages[-1:][0]
-            return message['content'] if 'content' in message else None
-        return None
+        with self._lock:
+            if len(self.messages) > 0:
+                message = self.messages[-1]
+                return message['content'] if 'content' in message else None
+            return None
 
     def append_user(self, content: str):
         self._append('user', content)
@@ -92,8 +117,90 @@ class ChatAgentValue(AgentValue):
     def append_system(self, content: str):
         self._append('system', content)
 
+    def snapshot_messages(self) -> list:
+        """
+        Messages of a request. The messages are read in one step, so a concurrent change of the history
+        is either fully included or not at all. The message records are not copied
+        :return: list of the messages
+        """
+        with self._lock:
+            return list(self.messages)
+
+    def total_tokens(self) -> int:
+        """
+        Estimated tokens of the messages. Only the messages appended since the previous call are counted
+        :return:
+        """
+        with self._lock:
+            return self._total_tokens()
+
+    def trim_to_budget(self):
+        """
+        Drop the oldest messages after the system prompt until the messages fit the token budget.
+        The list is changed in place, so the owners of the list see the trimmed history
+        :return:
+        """
+        with self._lock:
+            self._trim_to_budget()
+
+    def replace_messages(self, old: list, new: list) -> bool:
+        """
+        Replace a run of the messages, e.g. the old messages by their summary. The messages are compared
+        by identity, nothing is changed if the run is not in the history anymore
+        :param old: Consecutive messages of the history
+        :param new: Messages to put in their place
+        :return: True if the messages are replaced
+        """
+        with self._lock:
+            index = find_message_run(self.messages, old)
+            if index is None:
+                return False
+
+            self.messages[index:index + len(old)] = new
+            self._counted_messages = 0
+            self._counted_tokens = 0
+            return True
+
     def _append(self, role: str, content: str):
-        self.messages.append({'role': role, 'content': content})
+        message = {'role': role, 'content': content}
+        tokens.count_message_tokens(message)
+        with self._lock:
+            self.messages.append(message)
+            self._trim_to_budget()
+
+    def _total_tokens(self) -> int:
+        if len(self.messages) < self._counted_messages:
+            # The messages were trimmed outside the value
+            self._counted_messages = 0
+            self._counted_tokens = 0
+
+        for index in range(self._counted_messages, len(self.messages)):
+            self._counted_tokens += tokens.count_message_tokens(self.messages[index])
+        self._counted_messages = len(self.messages)
+        return self._counted_tokens
+
+    def _trim_to_budget(self):
+        if self.token_budget is None:
+            return
+
+        total = self._total_tokens()
+        if total <= self.token_budget:
+            return
+
+        pinned = tokens.count_pinned_messages(self.messages)
+        cut, dropped = tokens.find_token_cut(self.messages, pinned, total, self.token_budget)
+        del self.messages[pinned:cut]
+        self._counted_messages = len(self.messages)
+        self._counted_tokens = total - dropped
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
 
 
 class CompletedAgentTask(AgentTask):
@@ -121,8 +228,9 @@ class CompletedAgentTask(AgentTask):
         return self.value
 
     def on_complete(self, value: AgentValue, *args, **kwargs) -> None:
+        # The result of an async handler is returned to be awaited by the agent
         if self.handler is not None:
-            ex.execute_executable(self.handler, self.ctx.components, {'value': value})
+            return ex.execute_executable(self.handler, self.ctx.components, {'value': value})
 
     @staticmethod
     def _build_executable_handler(handler) -> ex.Executable | None:
@@ -137,6 +245,27 @@ class CompletedAgentTask(AgentTask):
 # Utility methods
 #################################################################
 
+def find_message_run(messages: list, run: list) -> int | None:
+    """
+    Find the consecutive messages in the history by identity
+    :param messages:
+    :param run:
+    :return: Index of the first message of the run, None if it is not found
+    """
+    if len(run) == 0:
+        return None
+
+    first = run[0]
+    for index, message in enumerate(messages):
+        if message is not first:
+            continue
+        if index + len(run) <= len(messages) \
+                and all(messages[index + offset] is run[offset] for offset in range(1, len(run))):
+            return index
+        return None
+    return None
+
+
 def build_and_register_task_skill_names(task_skills: [], agent: Agent):
     """
     An additional method used in the plugins that allows you to apply a skill group to the agent context
@@ -0,0 +1,161 @@
+import multiprocessing as mp
+import threading as th
+
+from concurrent import futures
+
+import sidusai.core.context as context
+import sidusai.core.execute as ex
+import sidusai.core.types as types
+
+# Start method of the worker processes. Fork of the multithreaded agent process can copy locks held
+# by other threads (thread pool, scheduler, pollers), so the workers are started from a clean interpreter
+__default_start_method__ = 'spawn'
+
+# Context of the worker process. It is created by the pool initializer
+_worker_context: context.AgentContext | None = None
+
+
+class ProcessPool:
+    """
+    Managed pool of processes for CPU-bound skills.
+
+    Only the agent value is sent to the worker process on every call. Skills and the builders of
+    the components they use are sent once, when the worker process starts. Every worker process builds
+    its own singleton components, so the builders and skills must be picklable (module-level functions
+    or methods of picklable objects). The value returned by the skill is a copy of the worker object.
+
+    Workers are started with the `spawn` method by default: they import the modules of the skills
+    and builders, so the main module of the application must be guarded by `if __name__ == '__main__'`.
+    """
+
+    def __init__(self, pool_max_size: int = None, start_method: str = __default_start_method__):
+        """
+        :param pool_max_size: Max worker processes, the number of CPUs by default
+        :param start_method: 'spawn' (default) or 'forkserver'. 'fork' is unsafe in the multithreaded agent
+        """
+        start_method = start_method if start_method is not None else __default_start_method__
+        if start_method not in mp.get_all_start_methods():
+            raise ValueError(f'Unknown start method \'{start_method}\'. Use one of {mp.get_all_start_methods()}')
+
+        self._pool_max_size = pool_max_size
+        self._start_method = start_method
+
+        self._lock = th.Lock()
+        self._executor = None
+
+        self._agent_name = None
+        self._builders = []
+        self._skills = []
+
+    @property
+    def is_configured(self) -> bool:
+        return len(self._skills) > 0
+
+    def configure(self, agent_name: str, builders: list, skills: list):
+        """
+        Set the content of worker processes. Must be called before the first submit
+        :param agent_name: Agent name of the worker context
+        :param builders: list of pairs (component name, builder)
+        :param skills: list of pairs (skill name, skill handler)
+        :return:
+        """
+        if self._executor is not None:
+            raise EnvironmentError('Process pool already started.')
+        self._agent_name = agent_name
+        self._builders = builders
+        self._skills = skills
+
+    def submit(self, skill_name: str, value: types.AgentValue) -> futures.Future:
+        """
+        Execute the skill in a worker process
+        :param skill_name: Name of the configured skill
+        :param value: Agent value, it is pickled to the worker process
+        :return: concurrent.futures.Future of the transformed value
+        """
+        return self._get_executor().submit(_execute_worker_skill, skill_name, value)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def _get_executor(self) -> futures.ProcessPoolExecutor:
+        if self._executor is not None:
+            return self._executor
+
+        with self._lock:
+            if self._executor is None:
+                if not self.is_configured:
+                    raise EnvironmentError('Process pool is not configured. Build the application first.')
+                self._executor = futures.ProcessPoolExecutor(
+                    max_workers=self._pool_max_size,
+                    mp_context=mp.get_context(self._start_method),
+                    initializer=_init_worker,
+                    initargs=(self._agent_name, self._builders, self._skills)
+                )
+        return self._executor
+
+
+#############################################################
+# Utility methods
+#############################################################
+
+def find_process_skills(ctx: context.AgentContext) -> list:
+    """
+    Skills of the context executed in the process pool
+    :param ctx:
+    :return: list of pairs (skill name, skill handler)
+    """
+    return [(name, skill.handler) for name, skill in ctx.skills.items() if skill.executor == ex.__executor_process__]
+
+
+def find_component_builders(ctx: context.AgentContext, skills: list) -> list:
+    """
+    Builders of the components injected into the skills, including the components they depend on.
+    Components are resolved by type and, for the parameters without annotation, by name
+    :param ctx:
+    :param skills: list of pairs (skill name, skill handler)
+    :return: list of pairs (component name, builder) in the order of dependencies
+    """
+    builders = {}
+
+    def _append(key):
+        builder = ctx.components_builders[key]
+        if builder is None:
+            return
+        name = key if isinstance(key, str) else ctx.components_builders.get_name_from_type(key)
+        if name in builders:
+            return
+        for _param_name, _param_type in builder.parameters.items():
+            _append(_param_name if _param_type == any else _param_type)
+        builders[name] = builder.handler
+
+    for skill_name, _ in skills:
+        for _param_name, _type in ctx.skills[skill_name].parameters.items():
+            if _type == any:
+                _append(_param_name)
+            elif isinstance(_type, type) and not issubclass(_type, types.AgentValue):
+                _append(_type)
+
+    return list(builders.items())
+
+
+def _init_worker(agent_name: str, builders: list, skills: list):
+    global _worker_context
+
+    ctx = context.AgentContext(agent_name)
+    for name, builder in builders:
+        ctx.add_component_builder(builder, name=name)
+    context.build_components(ctx)
+
+    for name, handler in skills:
+        skill = ctx.add_agent_skill(handler, skill_name=name)
+        skill.compile(ctx.components, flow_name='value', flow_type=types.AgentValue)
+
+    _worker_context = ctx
+
+
+def _execute_worker_skill(skill_name: str, value: types.AgentValue):
+    skill = _worker_context.skills[skill_name]
+    return ex.complete_awaitable(skill.plan(value))
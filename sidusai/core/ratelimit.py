@@ -0,0 +1,135 @@
+import asyncio
+import threading as th
+import time
+
+
+class RateLimitPermit:
+    """
+    Permission to send one request. Keeps the estimated tokens to reconcile them with the actual usage
+    """
+
+    def __init__(self, tokens: int, wait_sec: float):
+        self.tokens = tokens
+        self.wait_sec = wait_sec
+        self.is_reconciled = False
+
+
+class RateLimiter:
+    """
+    Shared limiter of the requests per minute and the tokens per minute of an API.
+
+    Both budgets are token buckets refilled continuously, a full bucket allows a burst of one minute budget.
+    A request reserves its share of both buckets on arrival and waits until the buckets are refilled
+    up to its reservation, so callers are queued in the order of arrival instead of failing.
+    The tokens of a request are estimated before the call and reconciled with the actual usage after it:
+    unused tokens are returned to the bucket, extra tokens are taken from the next requests.
+    The limiter is safe to use from many threads and coroutines.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        """
+        :param requests_per_minute: None for no limit
+        :param tokens_per_minute: None for no limit
+        """
+        for limit in [requests_per_minute, tokens_per_minute]:
+            if limit is not None and limit <= 0:
+                raise ValueError(f'Rate limit must be greater than zero. Current limit {limit}')
+
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+        self._lock = th.Lock()
+        self._updated_at = time.monotonic()
+        self._requests = requests_per_minute if requests_per_minute is not None else 0.0
+        self._tokens = tokens_per_minute if tokens_per_minute is not None else 0.0
+
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait_sec = 0.0
+        self.max_wait_sec = 0.0
+        self.last_wait_sec = 0.0
+        self.estimated_tokens = 0
+        self.used_tokens = 0
+
+    def acquire(self, tokens: int = 0) -> RateLimitPermit:
+        """
+        Wait for the budget of one request
+        :param tokens: Estimated tokens of the request
+        :return: Permit to reconcile the tokens after the call
+        """
+        permit = self._reserve(tokens)
+        if permit.wait_sec > 0:
+            time.sleep(permit.wait_sec)
+        return permit
+
+    async def acquire_async(self, tokens: int = 0) -> RateLimitPermit:
+        """
+        Wait for the budget of one request without blocking the event loop
+        :param tokens: Estimated tokens of the request
+        :return: Permit to reconcile the tokens after the call
+        """
+        permit = self._reserve(tokens)
+        if permit.wait_sec > 0:
+            await asyncio.sleep(permit.wait_sec)
+        return permit
+
+    def reconcile(self, permit: RateLimitPermit, used_tokens: int):
+        """
+        Correct the token budget by the actual usage of the request
+        :param permit:
+        :param used_tokens: Prompt and completion tokens of the response
+        :return:
+        """
+        if permit.is_reconciled:
+            return
+        permit.is_reconciled = True
+
+        with self._lock:
+            self.used_tokens += used_tokens
+            if self.tokens_per_minute is None:
+                return
+            self._refill(time.monotonic())
+            self._tokens = min(self.tokens_per_minute, self._tokens + permit.tokens - used_tokens)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'acquired': self.acquired,
+                'waited': self.waited,
+                'total_wait_sec': self.total_wait_sec,
+                'max_wait_sec': self.max_wait_sec,
+                'last_wait_sec': self.last_wait_sec,
+                'avg_wait_sec': self.total_wait_sec / self.acquired if self.acquired > 0 else 0.0,
+                'estimated_tokens': self.estimated_tokens,
+                'used_tokens': self.used_tokens,
+            }
+
+    def _reserve(self, tokens: int) -> RateLimitPermit:
+        with self._lock:
+            self._refill(time.monotonic())
+
+            wait_sec = 0.0
+            if self.requests_per_minute is not None:
+                self._requests -= 1
+                wait_sec = max(wait_sec, -self._requests * 60 / self.requests_per_minute)
+            if self.tokens_per_minute is not None:
+                self._tokens -= tokens
+                wait_sec = max(wait_sec, -self._tokens * 60 / self.tokens_per_minute)
+
+            self.acquired += 1
+            self.estimated_tokens += tokens
+            self.last_wait_sec = wait_sec
+            if wait_sec > 0:
+                self.waited += 1
+                self.total_wait_sec += wait_sec
+                self.max_wait_sec = max(self.max_wait_sec, wait_sec)
+            return RateLimitPermit(tokens, wait_sec)
+
+    def _refill(self, now: float):
+        elapsed_min = (now - self._updated_at) / 60
+        self._updated_at = now
+        if self.requests_per_minute is not None:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed_min * self.requests_per_minute)
+        if self.tokens_per_minute is not None:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed_min * self.tokens_per_minute)
+
@@ -0,0 +1,322 @@
+import datetime
+import heapq
+import itertools
+import logging
+import threading as th
+import time
+
+# Missed tick policies
+#   delay - the next run is the interval after the end of the previous run
+#   skip - runs keep the fixed rate, ticks missed while the loop was running are skipped
+#   catch_up - runs keep the fixed rate, missed ticks are run one after another
+__missed_delay__ = 'delay'
+__missed_skip__ = 'skip'
+__missed_catch_up__ = 'catch_up'
+__missed_policies__ = [__missed_delay__, __missed_skip__, __missed_catch_up__]
+
+# Cron field ranges: minute, hour, day of month, month, day of week (0 or 7 is Sunday)
+__cron_fields__ = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+__cron_search_days__ = 366 * 5
+
+# Upper bound of the error backoff of continuous loops
+__max_error_backoff_sec__ = 60
+
+_log = logging.getLogger(__name__)
+
+
+class CronExpression:
+    """
+    Standard five-field cron expression: minute, hour, day of month, month, day of week.
+    Fields support `*`, values, ranges `a-b`, steps `*/n` and `a-b/n`, and lists `a,b`.
+    If both day fields are restricted, a day matching either of them is used.
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression \'{expression}\' must contain 5 fields')
+
+        self.expression = expression
+        values = [parse_cron_field(field, low, high) for field, (low, high) in zip(fields, __cron_fields__)]
+        self.minutes, self.hours, self.days, self.months, week_days = values
+        self.week_days = {d % 7 for d in week_days}
+
+        self._any_day = fields[2] == '*'
+        self._any_week_day = fields[4] == '*'
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """
+        The first moment of the schedule strictly after the given one
+        :param moment: datetime
+        :return: datetime
+        """
+        moment = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=__cron_search_days__)
+
+        while moment < limit:
+            if moment.month not in self.months:
+                month = moment.month % 12 + 1
+                year = moment.year + (1 if month == 1 else 0)
+                moment = moment.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+
+            if not self._match_day(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+                continue
+
+            if moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+
+            if moment.minute not in self.minutes:
+                moment = moment + datetime.timedelta(minutes=1)
+                continue
+
+            return moment
+
+        raise ValueError(f'Cron expression \'{self.expression}\' has no dates')
+
+    def _match_day(self, moment: datetime.datetime) -> bool:
+        day_match = moment.day in self.days
+        # isoweekday: Monday is 1, Sunday is 7
+        week_day_match = moment.isoweekday() % 7 in self.week_days
+
+        if self._any_day and self._any_week_day:
+            return True
+        if self._any_day:
+            return week_day_match
+        if self._any_week_day:
+            return day_match
+        return day_match or week_day_match
+
+
+class LoopScheduler:
+    """
+    Timer scheduler of the application loops on the monotonic clock.
+
+    Deadlines of the loops are kept in a heap, the scheduler thread sleeps until the nearest deadline
+    and wakes up earlier only when a loop run is completed or the scheduler is stopped.
+    A loop is never run concurrently with itself: its next deadline is set when the run is completed.
+    """
+
+    def __init__(self, loops: list, dispatch):
+        """
+        :param loops: list of LoopContainer
+        :param dispatch: callable(loop) starting the loop run. The run must call complete(loop) at the end
+        """
+        self._dispatch = dispatch
+        self._condition = th.Condition()
+        self._counter = itertools.count()
+        self._heap = []
+        self._is_stopped = False
+
+        now = time.monotonic()
+        for loop in loops:
+            loop.scheduled_at = first_deadline(loop, now)
+            self._push(loop)
+
+    def run(self):
+        """
+        Dispatch the loops until the scheduler is stopped
+        :return:
+        """
+        while True:
+            with self._condition:
+                loop = self._wait_next()
+                if loop is None:
+                    return
+                loop.is_executing = True
+            self._dispatch(loop)
+
+    def stop(self):
+        with self._condition:
+            self._is_stopped = True
+            self._condition.notify_all()
+
+    def complete(self, loop):
+        """
+        Schedule the next run of the loop after the previous one is completed
+        :param loop:
+        :return:
+        """
+        with self._condition:
+            loop.is_executing = False
+            loop.scheduled_at = next_deadline(loop, time.monotonic())
+            self._push(loop)
+            self._condition.notify_all()
+
+    def _wait_next(self):
+        while not self._is_stopped:
+            if len(self._heap) == 0:
+                self._condition.wait()
+                continue
+
+            deadline, _, loop = self._heap[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+
+            heapq.heappop(self._heap)
+            return loop
+        return None
+
+    def _push(self, loop):
+        heapq.heappush(self._heap, (loop.scheduled_at, next(self._counter), loop))
+
+
+class ContinuousLoopWorker:
+    """
+    Dedicated thread of a continuous loop. The loop method is re-invoked as soon as the previous run
+    is completed, so blocking methods (long polls) are not delayed by the scheduler.
+    After an error the next run is delayed, the delay doubles on every consecutive error.
+
+    The thread is a daemon: a blocked run doesn't delay the exit of the process after stop()
+    """
+
+    def __init__(self, loop, run):
+        """
+        :param loop: LoopContainer
+        :param run: callable(loop) executing the loop method
+        """
+        self._loop = loop
+        self._run = run
+        self._stop_event = th.Event()
+        self._thread = None
+
+    @property
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._thread = th.Thread(target=self._work, name=f'loop-{self._loop.executable.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _work(self):
+        loop = self._loop
+        backoff = 0.0
+        while not self._stop_event.is_set():
+            loop.scheduled_at = time.monotonic()
+            loop.is_executing = True
+            try:
+                self._run(loop)
+                backoff = 0.0
+            except Exception:
+                _log.exception(f'Unhandled error in loop {loop.executable.name}')
+                loop.errors += 1
+                backoff = next_error_backoff(loop, backoff)
+            finally:
+                loop.is_executing = False
+
+            if backoff > 0:
+                self._stop_event.wait(backoff)
+
+
+#############################################################
+# Utility methods
+#############################################################
+
+def parse_cron_field(field: str, low: int, high: int) -> set:
+    """
+    Parse a cron field to the set of values
+    :param field: field expression
+    :param low: min field value
+    :param high: max field value
+    :return:
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, _step = part.split('/', 1)
+            step = int(_step)
+            if step < 1:
+                raise ValueError(f'Invalid cron step in \'{field}\'')
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            _start, _end = part.split('-', 1)
+            start, end = int(_start), int(_end)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+
+        if start < low or end > high or start > end:
+            raise ValueError(f'Cron field \'{field}\' is out of range {low}-{high}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def monotonic_from_datetime(moment: datetime.datetime, now: float) -> float:
+    """
+    Convert a wall clock moment to the monotonic clock
+    :param moment: datetime
+    :param now: current monotonic time
+    :return:
+    """
+    return now + (moment - datetime.datetime.now()).total_seconds()
+
+
+def first_deadline(loop, now: float) -> float:
+    if loop.cron is not None:
+        return monotonic_from_datetime(loop.cron.next_after(datetime.datetime.now()), now)
+    return now + loop.fixed_interval_sec
+
+
+def next_deadline(loop, now: float) -> float:
+    """
+    Deadline of the next loop run by the missed tick policy. Skipped ticks are counted in the loop metrics
+    :param loop: LoopContainer with the deadline of the completed run in scheduled_at
+    :param now: current monotonic time
+    :return:
+    """
+    if loop.cron is not None:
+        return _next_cron_deadline(loop, now)
+
+    interval = loop.fixed_interval_sec
+    if loop.missed_tick_policy == __missed_delay__ or interval <= 0:
+        return now + interval
+
+    deadline = loop.scheduled_at + interval
+    if loop.missed_tick_policy == __missed_catch_up__ or deadline > now:
+        return deadline
+
+    missed = int((now - deadline) // interval) + 1
+    loop.missed_ticks += missed
+    return deadline + missed * interval
+
+
+def _next_cron_deadline(loop, now: float) -> float:
+    wall_now = datetime.datetime.now()
+    if loop.missed_tick_policy == __missed_delay__:
+        return monotonic_from_datetime(loop.cron.next_after(wall_now), now)
+
+    scheduled = wall_now - datetime.timedelta(seconds=now - loop.scheduled_at)
+    moment = loop.cron.next_after(scheduled)
+    if loop.missed_tick_policy == __missed_catch_up__:
+        return monotonic_from_datetime(moment, now)
+
+    while moment <= wall_now:
+        loop.missed_ticks += 1
+        moment = loop.cron.next_after(moment)
+    return monotonic_from_datetime(moment, now)
+
+
+def next_error_backoff(loop, backoff: float) -> float:
+    """
+    Delay of the continuous loop after an error
+    :param loop: LoopContainer
+    :param backoff: Delay after the previous error, 0 if the previous run succeeded
+    :return:
+    """
+    if backoff <= 0:
+        return loop.error_backoff_sec
+    return min(backoff * 2, max(__max_error_backoff_sec__, loop.error_backoff_sec))
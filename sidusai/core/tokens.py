@@ -0,0 +1,78 @@
+import math
+
+# Average number of characters per token of the estimation
+__chars_per_token__ = 4
+# Tokens of the role and the separators of a chat message
+__message_overhead_tokens__ = 4
+# Key of the cached token count in the message dict. It is not sent to the providers
+__tokens_key__ = 'tokens'
+
+
+def estimate_tokens(text: str | None) -> int:
+    """
+    Rough number of tokens of the text by a local estimate, without a provider tokenizer
+    :param text:
+    :return:
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / __chars_per_token__)
+
+
+def count_message_tokens(message: dict) -> int:
+    """
+    Estimated tokens of the chat message. The count is cached in the message,
+    so every message is estimated once
+    :param message: {'role', 'content'} message
+    :return:
+    """
+    tokens = message.get(__tokens_key__)
+    if tokens is None:
+        tokens = estimate_tokens(message.get('content')) + __message_overhead_tokens__
+        message[__tokens_key__] = tokens
+    return tokens
+
+
+def estimate_chat_tokens(messages: list, max_completion_tokens: int = None) -> int:
+    """
+    Estimated tokens of a chat request: the prompt and the max completion
+    :param messages: list of {'role', 'content'} messages
+    :param max_completion_tokens: max tokens of the answer
+    :return:
+    """
+    tokens = sum(count_message_tokens(message) for message in messages)
+    return tokens + (max_completion_tokens if max_completion_tokens is not None else 0)
+
+
+def count_pinned_messages(messages: list) -> int:
+    """
+    Number of the leading system messages, they are kept when the history is trimmed
+    :param messages:
+    :return:
+    """
+    pinned = 0
+    while pinned < len(messages) and messages[pinned].get('role') == 'system':
+        pinned += 1
+    return pinned
+
+
+def find_token_cut(messages: list, start: int, total_tokens: int, target_tokens: int) -> tuple:
+    """
+    Find the oldest messages to drop, so the rest of the history fits the target.
+    The newest message is always kept and the kept history starts from a user message
+    :param messages:
+    :param start: Index of the first message that can be dropped
+    :param total_tokens: Tokens of all messages
+    :param target_tokens: Max tokens after the drop
+    :return: pair (index of the first kept message, dropped tokens)
+    """
+    cut = start
+    dropped = 0
+    last = len(messages) - 1
+    while cut < last and total_tokens - dropped > target_tokens:
+        dropped += count_message_tokens(messages[cut])
+        cut += 1
+    while start < cut < last and messages[cut].get('role') == 'assistant':
+        dropped += count_message_tokens(messages[cut])
+        cut += 1
+    return cut, dropped
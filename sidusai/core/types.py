@@ -1,6 +1,8 @@
 #############################################################
 # Classes - environments
 #############################################################
+import threading
+
 import sidusai.core.utils as utils
 
 
@@ -54,7 +56,11 @@ class TaskContainer:
         self.available_skill_names = available_skill_name
 
         self.skill_graph = None
+        # Resolved skills of the task as a pair (graph version, tuple of skill executables)
+        self.skill_pipeline = None
         self.executable_init = None
+        self.executable_forward = None
+        self.executable_on_complete = None
 
 
 class LoopContainer:
@@ -62,13 +68,46 @@ class LoopContainer:
     Container of reproducible methods in the main loop of the application
     """
 
-    def __init__(self, executable, fixed_interval_sec: int | None):
+    def __init__(self, executable, fixed_interval_sec: float | None, cron=None, missed_tick_policy: str = 'delay',
+                 continuous: bool = False, error_backoff_sec: float = 1.0):
         self.order = executable.order
         self.fixed_interval_sec = fixed_interval_sec
+        self.cron = cron
+        self.missed_tick_policy = missed_tick_policy
+        # Continuous loops are re-invoked by a dedicated worker as soon as the previous run is completed
+        self.continuous = continuous
+        self.error_backoff_sec = error_backoff_sec
         self.executable = executable
 
         self.last_loop_at = utils.current_sec()
         self.is_executing = False
+        # Monotonic deadline of the next run, set by the scheduler
+        self.scheduled_at = None
+
+        # Scheduling metrics. Lag is the delay between the deadline and the actual start of the run
+        self.runs = 0
+        self.missed_ticks = 0
+        self.last_lag_sec = 0.0
+        self.max_lag_sec = 0.0
+        self.total_lag_sec = 0.0
+        self.errors = 0
+
+    def record_start(self, now: float):
+        lag = max(0.0, now - self.scheduled_at)
+        self.runs += 1
+        self.last_lag_sec = lag
+        self.max_lag_sec = max(self.max_lag_sec, lag)
+        self.total_lag_sec += lag
+
+    def metrics(self) -> dict:
+        return {
+            'runs': self.runs,
+            'missed_ticks': self.missed_ticks,
+            'errors': self.errors,
+            'last_lag_sec': self.last_lag_sec,
+            'max_lag_sec': self.max_lag_sec,
+            'avg_lag_sec': self.total_lag_sec / self.runs if self.runs > 0 else 0.0,
+        }
 
 
 class ExceptionHandlerContainer:
@@ -81,10 +120,38 @@ class ExceptionHandlerContainer:
         self.executable = executable
 
 
+class LazyComponent:
+    """
+    Holder of a component created on first use.
+    The factory is called exactly once, concurrent first uses wait for the single build.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._component = None
+        self.is_built = False
+
+    def get(self):
+        if self.is_built:
+            return self._component
+
+        with self._lock:
+            if not self.is_built:
+                self._component = self._factory()
+                self.is_built = True
+        return self._component
+
+
 class NamedTypedContainer:
     """
     A container that provides access to content by name or by object type.
     Don't use primitive data types for storage in container
+
+    Lookups by type are cached, including lookups resolved by a registered subclass.
+    After freeze the container is read-only and can be read without locks from many threads.
+
+    A stored LazyComponent is resolved to its component on access by item.
     """
 
     def __init__(self):
@@ -93,6 +160,25 @@ class NamedTypedContainer:
         self.types = {}
         self.names = {}
 
+        # Name of the object at the container position
+        self._index_names = []
+        # Resolved index (or None) of the requested type
+        self._resolved_types = {}
+
+        self._lock = threading.Lock()
+        self._frozen = False
+
+    @property
+    def is_frozen(self) -> bool:
+        return self._frozen
+
+    def freeze(self):
+        """
+        Make the container read-only
+        :return:
+        """
+        self._frozen = True
+
     def put(self, obj, key, _type: type = None):
         """
         Put object to container
@@ -101,6 +187,9 @@ class NamedTypedContainer:
         :param key: custom object name
         :return:
         """
+        if self._frozen:
+            raise EnvironmentError(f'Container is frozen. Object {key} can not be put after the build.')
+
         if key is None:
             raise ValueError('Key in container can not be None')
 
@@ -110,28 +199,40 @@ class NamedTypedContainer:
         if _type is None:
             _type = self._get_type_from_object(obj)
 
-        _index_type = self._get_index(_type)
-        _index_key = self._get_index(key)
+        with self._lock:
+            _index_type = self._get_index(_type)
+            _index_key = self._get_index(key)
 
-        if _index_key != _index_type and _index_type is not None and _index_key is not None:
-            raise ValueError('An object of this type is already registered under a different name.')
+            if _index_key != _index_type and _index_type is not None and _index_key is not None:
+                raise ValueError('An object of this type is already registered under a different name.')
 
-        if _index_key is not None and _index_type is None:
-            raise ValueError('Another object with the same name is already registered.')
+            if _index_key is not None and _index_type is None:
+                raise ValueError('Another object with the same name is already registered.')
 
-        if _index_key is None and _index_type is not None:
-            raise ValueError('An object of this type is already registered under a different name.')
+            if _index_key is None and _index_type is not None:
+                raise ValueError('An object of this type is already registered under a different name.')
 
-        if _index_type is None:
-            self.container.append(obj)
-        else:
-            self.container[_index_type] = obj
-        _index = len(self.container) - 1 if _index_type is None else _index_type
+            if _index_type is None:
+                self.container.append(obj)
+                self._index_names.append(key)
+            else:
+                self.container[_index_type] = obj
+            _index = len(self.container) - 1 if _index_type is None else _index_type
 
-        self.types[_type] = _index
-        self.names[key] = _index
+            self.types[_type] = _index
+            self.names[key] = _index
+            self._update_resolved_types(_type, _index)
 
     def __getitem__(self, item):
+        _obj = self.peek(item)
+        return _obj.get() if isinstance(_obj, LazyComponent) else _obj
+
+    def peek(self, item):
+        """
+        Get the stored object by name or type without building a lazy component
+        :param item: name or type
+        :return: object, LazyComponent or None
+        """
         _index = self._get_index(item)
         return self.container[_index] if _index is not None else None
 
@@ -146,7 +247,7 @@ class NamedTypedContainer:
     def __iter__(self):
         for _type, _index in self.types.items():
             _obj = self.container[_index]
-            _name = self.get_name_from_type(_type)
+            _name = self._index_names[_index]
             yield _name, _type, _obj
 
     def __contains__(self, item):
@@ -155,10 +256,9 @@ class NamedTypedContainer:
 
     def get_name_from_type(self, _type):
         _index = self._get_index(_type)
-        _names = [k for k, v in self.names.items() if v == _index]
-        if len(_names) != 1:
+        if _index is None:
             raise ValueError('A collision occurred. The object has multiple names or the name was not found.')
-        return _names[0]
+        return self._index_names[_index]
 
     def _get_index(self, key):
         """
@@ -166,17 +266,41 @@ class NamedTypedContainer:
         :param key: name or type
         :return:
         """
-        if isinstance(key, str) and key in self.names.keys():
-            return self.names[key]
+        if isinstance(key, str):
+            return self.names.get(key)
         if isinstance(key, type):
-            if key in self.types.keys():
-                return self.types[key]
-            else:
-                # Find subclass
-                _types = [v for k, v in self.types.items() if issubclass(k, key)]
-                return _types[0] if len(_types) > 0 else None
+            try:
+                return self._resolved_types[key]
+            except KeyError:
+                pass
+
+            _index = self.types.get(key)
+            if _index is None:
+                # Find subclass. The first registered subclass is used
+                _types = [v for k, v in list(self.types.items()) if issubclass(k, key)]
+                _index = _types[0] if len(_types) > 0 else None
+            self._resolved_types[key] = _index
+            return _index
 
         return None
 
+    def _update_resolved_types(self, _type: type, _index: int):
+        """
+        Keep the lookup cache correct after put: the registered type is resolved exactly, and the types
+        from its MRO that had no registered subclass are resolved to it
+        :param _type:
+        :param _index:
+        :return:
+        """
+        if not isinstance(_type, type):
+            return
+        self._resolved_types[_type] = _index
+        for _base in _type.__mro__:
+            if _base in self._resolved_types and self._resolved_types[_base] is None:
+                self._resolved_types[_base] = _index
+        # Subclass checks of abstract classes are not reflected in MRO
+        for _key in [k for k, v in list(self._resolved_types.items()) if v is None]:
+            del self._resolved_types[_key]
+
     def _get_type_from_object(self, obj):
         return type(obj)
@@ -13,7 +13,15 @@ __deepseek_agent_name__ = 'ds_ai_agent_name'
 class DeepSeekPlugin(sai.AgentPlugin):
 
     def __init__(self, api_key, temperature: float = None, top_p: float = None,
-                 max_tokens: float = None, model_name: str = None):
+                 max_tokens: float = None, model_name: str = None, stream: bool = False,
+                 cache: components.DeepSeekCompletionCache = None, rate_limiter: sai.RateLimiter = None,
+                 compaction_threshold_messages: int = None,
+                 compaction_keep_messages: int = components.__default_compaction_keep_messages__,
+                 pool_max_size: int = components.__default_pool_max_size__,
+                 connect_timeout_sec: float = components.__default_connect_timeout_sec__,
+                 read_timeout_sec: float = components.__default_read_timeout_sec__,
+                 max_retries: int = components.__default_max_retries__,
+                 retry_backoff_sec: float = components.__default_retry_backoff_sec__):
         super().__init__()
 
         self.api_key = api_key
@@ -21,42 +29,104 @@ class DeepSeekPlugin(sai.AgentPlugin):
         self.top_p = top_p
         self.max_tokens = max_tokens
         self.model_name = model_name
+        self.stream = stream
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.compaction_threshold_messages = compaction_threshold_messages
+        self.compaction_keep_messages = compaction_keep_messages
+        self.pool_max_size = pool_max_size
+        self.connect_timeout_sec = connect_timeout_sec
+        self.read_timeout_sec = read_timeout_sec
+        self.max_retries = max_retries
+        self.retry_backoff_sec = retry_backoff_sec
 
     def apply_plugin(self, agent: sai.Agent):
         agent.add_component_builder(self._build_deep_seek_connection)
 
         agent.add_skill(skills.ds_chat_transform_skill)
 
+        # Add ds_chat_compaction_skill to the task skills to compact the chats
+        if self.compaction_threshold_messages is not None:
+            agent.add_component_builder(self._build_chat_compactor)
+
     def _build_deep_seek_connection(self) -> components.DeepSeekClientComponent:
         return components.DeepSeekClientComponent(
             api_key=self.api_key,
             temperature=self.temperature,
             top_p=self.top_p,
             max_tokens=self.max_tokens,
-            model_name=self.model_name
+            model_name=self.model_name,
+            stream=self.stream,
+            cache=self.cache,
+            rate_limiter=self.rate_limiter,
+            pool_max_size=self.pool_max_size,
+            connect_timeout_sec=self.connect_timeout_sec,
+            read_timeout_sec=self.read_timeout_sec,
+            max_retries=self.max_retries,
+            retry_backoff_sec=self.retry_backoff_sec
+        )
+
+    def _build_chat_compactor(self, client: components.DeepSeekClientComponent) -> components.DeepSeekChatCompactor:
+        return components.DeepSeekChatCompactor(
+            client=client,
+            threshold_messages=self.compaction_threshold_messages,
+            keep_messages=self.compaction_keep_messages
         )
 
 
 class DeepSeekChatTask(sai.CompletedAgentTask):
-    pass
+    """
+    The task of a message to the chat. The message is appended to the chat when the task starts,
+    the tasks of one chat are executed one by one, so the messages and the answers keep their order
+    """
+
+    def __init__(self, agent: sai.Agent, value=None, handler=None):
+        super().__init__(agent, value, handler)
+        self.message = None
+        self.on_token = None
+
+    def user_message(self, message: str, on_token=None):
+        self.message = message
+        self.on_token = on_token
+        return self
+
+    def forward(self, *args, **kwargs) -> sai.AgentValue:
+        if self.message is not None:
+            self.value.append_user(self.message)
+            self.value.on_token = self.on_token
+        return self.value
 
 
 class DeepSeekSingleChatAgent(sai.Agent):
 
     def __init__(self, api_key, system_prompt: str = None, prepare_task_skills: [] = None,
                  temperature: float = None, top_p: float = None,
-                 max_tokens: float = None, model_name: str = None):
+                 max_tokens: float = None, model_name: str = None, stream: bool = False,
+                 cache: components.DeepSeekCompletionCache = None, rate_limiter: sai.RateLimiter = None,
+                 pool_max_size: int = components.__default_pool_max_size__,
+                 connect_timeout_sec: float = components.__default_connect_timeout_sec__,
+                 read_timeout_sec: float = components.__default_read_timeout_sec__,
+                 max_retries: int = components.__default_max_retries__,
+                 retry_backoff_sec: float = components.__default_retry_backoff_sec__):
         super().__init__(__deepseek_agent_name__)
 
         self.system_prompt = system_prompt
-        self.chat = sai.ChatAgentValue([])
+        self.chat = sai.ChatAgentValue()
 
         ds_plugin = DeepSeekPlugin(
             api_key=api_key,
             temperature=temperature,
             top_p=top_p,
             max_tokens=max_tokens,
-            model_name=model_name
+            model_name=model_name,
+            stream=stream,
+            cache=cache,
+            rate_limiter=rate_limiter,
+            pool_max_size=pool_max_size,
+            connect_timeout_sec=connect_timeout_sec,
+            read_timeout_sec=read_timeout_sec,
+            max_retries=max_retries,
+            retry_backoff_sec=retry_backoff_sec
         )
 
         ds_plugin.apply_plugin(self)
@@ -69,10 +139,16 @@ class DeepSeekSingleChatAgent(sai.Agent):
         task_skill_names = _cp.build_and_register_task_skill_names(task_skills, self)
         self.task_registration(DeepSeekChatTask, skill_names=task_skill_names)
 
-    def send_to_chat(self, message: str, handler):
+    def send_to_chat(self, message: str, handler, on_token=None):
+        """
+        Send the user's message to the chat
+        :param message:
+        :param handler: Handler of the completed chat
+        :param on_token: callable(str) receiving parts of the answer in the streaming mode
+        :return: Handle of the task
+        """
         if message is None:
             raise ValueError('Message can not be None')
 
-        self.chat.append_user(message)
-        task = DeepSeekChatTask(self).data(self.chat).then(handler)
-        self.task_execute(task)
+        task = DeepSeekChatTask(self).data(self.chat).user_message(message, on_token).then(handler)
+        return self.task_execute(task, key=id(self.chat))
@@ -1,6 +1,22 @@
+import asyncio
+import collections
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+
 import requests
+import requests.adapters
 import json
+import logging
 
+import sidusai.core.execute as ex
+import sidusai.core.history as history
+import sidusai.core.ratelimit as ratelimit
+import sidusai.core.tokens as tokens
+import sidusai.core.utils as utils
 from sidusai.core.plugin import ChatAgentValue
 
 __default_utl__ = 'https://api.deepseek.com/chat/completions'
@@ -13,13 +29,54 @@ __default_top_p__ = 1
 __frequency_penalty__ = 0
 __presence_penalty__ = 0
 
+# Default connection params
+__default_pool_max_size__ = 10
+__default_async_pool_max_size__ = 100
+__default_connect_timeout_sec__ = 5
+__default_read_timeout_sec__ = 120
+__default_max_retries__ = 3
+__default_retry_backoff_sec__ = 0.5
+__max_retry_backoff_sec__ = 30
+__retry_status_codes__ = [429, 500, 502, 503, 504]
+
+# Default completion cache params
+__default_cache_max_size__ = 1024
+__default_cache_ttl_sec__ = 3600
+# Only near-deterministic requests are cached, answers of the default temperature are sampled
+__default_cache_max_temperature__ = 0.2
+# Payload keys that don't change the completion
+__cache_ignored_keys__ = ['stream', 'stream_options']
+
+# Default conversation compaction params
+__default_compaction_threshold_messages__ = 40
+__default_compaction_keep_messages__ = 10
+__default_compaction_queue_max_size__ = 256
+__default_compaction_prompt__ = ('Summarize the conversation below, so it can be continued without it. '
+                                 'Keep the facts about the user, names, numbers, decisions and open questions. '
+                                 'Answer with the summary only.')
+__compaction_summary_title__ = 'Summary of the earlier conversation:'
+# Key of the summary flag in the message dict. It is not sent to the providers
+__summary_key__ = 'summary'
+
+_log = logging.getLogger(__name__)
+
 
 class DeepSeekResponse:
 
-    def __init__(self, response: requests.Response):
-        obj = json.loads(response.text)
+    def __init__(self, response: requests.Response | None, obj: dict = None, status_code: int = 200,
+                 is_cached: bool = False):
+        """
+        :param response: None for a completion from the cache or the asyncio client
+        :param obj: Parsed response body. Streaming responses pass the completion aggregated from the chunks
+        :param status_code: Status of the response without the requests object
+        :param is_cached: The completion is taken from the cache, no request was sent
+        """
+        if obj is None:
+            obj = json.loads(response.text)
 
-        self.status_code = response.status_code
+        self.status_code = response.status_code if response is not None else status_code
+        self.completion = obj
+        self.is_cached = is_cached
         # Convert JSON to object
         self.id = obj['id'] if 'id' in obj else None
         self.object = obj['object'] if 'object' in obj else None
@@ -56,31 +113,70 @@ class DeepSeekResponse:
                 self.last_message = self.messages[message_len - 1]
 
 
-class DeepSeekClientComponent:
+class DeepSeekClientBase:
     """
-    A class-component that wraps data and connection information. It is used for
-    formation and subsequent use in the context of the application core.
+    Connection information and request formation shared by the blocking and asyncio clients
     """
 
     params: dict = {}
 
-    def __init__(self, api_key: str, model_name: str = None, **kwargs):
+    def __init__(self, api_key: str, model_name: str = None, url: str = __default_utl__,
+                 connect_timeout_sec: float = __default_connect_timeout_sec__,
+                 read_timeout_sec: float = __default_read_timeout_sec__,
+                 max_retries: int = __default_max_retries__,
+                 retry_backoff_sec: float = __default_retry_backoff_sec__,
+                 cache: 'DeepSeekCompletionCache' = None,
+                 rate_limiter: ratelimit.RateLimiter = None,
+                 **kwargs):
         self.api_key = api_key
 
         self.model_name = model_name if model_name is not None else __default_deepseek_model__
         self.params = kwargs
 
-    def request(self, chat: ChatAgentValue) -> DeepSeekResponse:
-        payload = json.dumps(self._build_payload(chat))
-        headers = self._build_headers()
+        self.url = url
+        self.connect_timeout_sec = connect_timeout_sec
+        self.read_timeout_sec = read_timeout_sec
+        self.max_retries = max_retries
+        self.retry_backoff_sec = retry_backoff_sec
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+
+    def _estimate_tokens(self, payload: dict) -> int:
+        return estimate_payload_tokens(payload) if self.rate_limiter is not None else 0
+
+    def _acquire(self, tokens: int) -> ratelimit.RateLimitPermit | None:
+        if self.rate_limiter is None:
+            return None
+        return self.rate_limiter.acquire(tokens)
 
-        response = requests.request('POST', __default_utl__, headers=headers, data=payload)
-        return DeepSeekResponse(response)
+    async def _acquire_async(self, tokens: int) -> ratelimit.RateLimitPermit | None:
+        if self.rate_limiter is None:
+            return None
+        return await self.rate_limiter.acquire_async(tokens)
+
+    def _reconcile(self, permit: ratelimit.RateLimitPermit | None, response: DeepSeekResponse | None):
+        """
+        Correct the budget by the usage of the response. A failed attempt or a response without usage
+        didn't produce a completion, its estimated tokens are returned to the limiter
+        """
+        if permit is None:
+            return
+        prompt_tokens = getattr(response, 'prompt_tokens', None)
+        completion_tokens = getattr(response, 'completion_tokens', None)
+        self.rate_limiter.reconcile(permit, (prompt_tokens or 0) + (completion_tokens or 0))
+
+    def _build_cache_key(self, payload: dict) -> str | None:
+        if self.cache is None or not self.cache.is_cacheable(payload):
+            return None
+        return build_payload_key(payload)
 
     def _build_payload(self, chat: ChatAgentValue):
         # TODO: Expand the configurability of the request
 
-        messages = [{'role': v['role'], 'content': v['content']} for v in chat.messages]
+        # The messages are read under the lock of the chat, so a concurrent compaction can't change them
+        # between the cache key and the sent body. Message records are encoded one by one when the payload is sent
+        messages = [v if isinstance(v, history.ChatMessage) else {'role': v['role'], 'content': v['content']}
+                    for v in chat.snapshot_messages()]
         default_payload = {
             "messages": messages,
             "model": self.model_name,
@@ -106,6 +202,778 @@ class DeepSeekClientComponent:
     def _build_headers(self):
         return {
             'Content-Type': 'application/json',
-            'Accept': 'application/json',
+            'Accept': 'application/json, text/event-stream',
             'Authorization': f'Bearer {self.api_key}'
         }
+
+
+class DeepSeekClientComponent(DeepSeekClientBase):
+    """
+    A class-component that wraps data and connection information. It is used for
+    formation and subsequent use in the context of the application core.
+
+    Requests share one session with a pool of keep-alive connections, so the TCP and TLS handshakes
+    are not repeated for every completion. The session is safe to use from the task threads.
+    Responses with status 429 or 5xx and failed connections are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, api_key: str, model_name: str = None, stream: bool = False, url: str = __default_utl__,
+                 pool_max_size: int = __default_pool_max_size__,
+                 connect_timeout_sec: float = __default_connect_timeout_sec__,
+                 read_timeout_sec: float = __default_read_timeout_sec__,
+                 max_retries: int = __default_max_retries__,
+                 retry_backoff_sec: float = __default_retry_backoff_sec__,
+                 cache: 'DeepSeekCompletionCache' = None,
+                 rate_limiter: ratelimit.RateLimiter = None,
+                 **kwargs):
+        """
+        :param api_key:
+        :param model_name:
+        :param stream: Use the streaming mode in the chat skill, parts of the answer are delivered as they are generated
+        :param url: Chat completions endpoint
+        :param pool_max_size: Max keep-alive connections, one per concurrent request
+        :param connect_timeout_sec:
+        :param read_timeout_sec: Max wait between bytes of the response
+        :param max_retries: Retries of a failed request, 0 to disable
+        :param retry_backoff_sec: Base of the exponential backoff between retries
+        :param cache: Optional cache of the completions of repeated requests
+        :param rate_limiter: Optional limiter of requests and tokens per minute, shared by the clients of one API.
+        Requests wait for the budget instead of failing with 429
+        :param kwargs: Text generation params of the payload
+        """
+        super().__init__(api_key, model_name, url, connect_timeout_sec, read_timeout_sec,
+                         max_retries, retry_backoff_sec, cache, rate_limiter, **kwargs)
+
+        self.stream = stream
+        self.timeout = (connect_timeout_sec, read_timeout_sec)
+        self.session = build_session(pool_max_size, self._build_headers())
+
+    def request(self, chat: ChatAgentValue) -> DeepSeekResponse:
+        payload = self._build_payload(chat)
+        key = self._build_cache_key(payload)
+        if key is not None:
+            completion = self.cache.get(key)
+            if completion is not None:
+                return DeepSeekResponse(None, completion, is_cached=True)
+
+        permit, response = None, None
+        try:
+            permit, raw_response = self._post(encode_payload(payload), self._estimate_tokens(payload))
+            response = DeepSeekResponse(raw_response)
+        finally:
+            self._reconcile(permit, response)
+        if key is not None and response.status_code == 200:
+            self.cache.put(key, response.completion)
+        return response
+
+    def request_stream(self, chat: ChatAgentValue, on_token=None) -> DeepSeekResponse:
+        """
+        Streaming request. Parts of the answer are passed to the callback as they are generated
+        :param chat:
+        :param on_token: callable(str) receiving parts of the assistant message
+        :return: Response with the complete message
+        """
+        stream = self.stream_chat(chat)
+        for token in stream:
+            if on_token is not None:
+                on_token(token)
+        return stream.response
+
+    def stream_chat(self, chat: ChatAgentValue) -> 'DeepSeekStream':
+        """
+        Streaming request. The result is an iterator of the parts of the answer,
+        the complete response is available in its `response` attribute after the iteration.
+        A completion from the cache is delivered as one part
+        :param chat:
+        :return:
+        """
+        payload = self._build_payload(chat)
+        payload['stream'] = True
+        # The last chunk of the stream contains the token usage
+        payload['stream_options'] = {'include_usage': True}
+
+        key = self._build_cache_key(payload)
+        if key is not None:
+            completion = self.cache.get(key)
+            if completion is not None:
+                return DeepSeekStream(None, completion=completion)
+
+        permit, response = self._post(encode_payload(payload), self._estimate_tokens(payload), stream=True)
+
+        def _on_complete(response: DeepSeekResponse | None):
+            self._reconcile(permit, response)
+            if key is not None and response is not None and response.status_code == 200:
+                self.cache.put(key, response.completion)
+
+        return DeepSeekStream(response, on_complete=_on_complete)
+
+    def close(self):
+        """
+        Close the pooled connections
+        :return:
+        """
+        self.session.close()
+
+    def _post(self, payload: str, tokens: int, **kwargs) -> tuple:
+        """
+        Send the payload with retries. Every attempt waits for its own permit of the rate limiter,
+        the permits of the failed attempts are reconciled here
+        :param payload: Encoded payload
+        :param tokens: Estimated tokens of the request
+        :return: (permit of the last attempt, response)
+        """
+        for attempt in range(self.max_retries + 1):
+            is_last = attempt == self.max_retries
+            permit = self._acquire(tokens)
+            try:
+                response = self.session.post(self.url, data=payload, timeout=self.timeout, **kwargs)
+            except requests.ConnectionError:
+                self._reconcile(permit, None)
+                if is_last:
+                    raise
+                delay = None
+            except BaseException:
+                self._reconcile(permit, None)
+                raise
+            else:
+                if is_last or response.status_code not in __retry_status_codes__:
+                    return permit, response
+                self._reconcile(permit, None)
+                delay = retry_after_sec(response)
+                response.close()
+
+            time.sleep(delay if delay is not None else retry_backoff(self.retry_backoff_sec, attempt))
+
+
+class DeepSeekStream:
+    """
+    Iterator of the parts of the assistant message from the server-sent event stream.
+    The chunks are aggregated to the completion, which is available as DeepSeekResponse
+    in the `response` attribute when the stream is exhausted.
+    A response with an error status is not streamed, it is parsed as a regular response.
+    """
+
+    def __init__(self, response: requests.Response | None, completion: dict = None, on_complete=None):
+        """
+        :param response: Streamed response, None for a completion from the cache
+        :param completion: Completion from the cache
+        :param on_complete: callable(DeepSeekResponse) receiving the response when the stream is finished,
+        None if the stream failed
+        """
+        self._response = response
+        self._on_complete = on_complete
+        self.response = None
+
+        self._cached = completion is not None
+        self._completion = completion if completion is not None else {'object': 'chat.completion', 'choices': []}
+
+    def __iter__(self):
+        if self._cached:
+            self.response = DeepSeekResponse(None, self._completion, is_cached=True)
+            message = self.response.last_message
+            if message is not None and message.get('content'):
+                yield message['content']
+            return
+
+        try:
+            if self._response.status_code != 200:
+                self.response = DeepSeekResponse(self._response)
+                return
+
+            for data in iter_sse_data(self._response.iter_lines(chunk_size=None)):
+                if data == '[DONE]':
+                    break
+                token = self._append_chunk(json.loads(data))
+                if token:
+                    yield token
+            self.response = DeepSeekResponse(self._response, self._completion)
+        finally:
+            self._response.close()
+            if self._on_complete is not None:
+                self._on_complete(self.response)
+
+    def _append_chunk(self, chunk: dict) -> str | None:
+        completion = self._completion
+        for key in ['id', 'created', 'model', 'system_fingerprint', 'usage']:
+            if chunk.get(key) is not None:
+                completion[key] = chunk[key]
+
+        token = None
+        choices = completion['choices']
+        for choice in chunk.get('choices') or []:
+            index = choice.get('index', 0)
+            while len(choices) <= index:
+                choices.append({'index': len(choices), 'message': {'role': 'assistant', 'content': ''}})
+
+            message = choices[index]['message']
+            delta = choice.get('delta') or {}
+            if delta.get('role') is not None:
+                message['role'] = delta['role']
+            if delta.get('reasoning_content'):
+                message['reasoning_content'] = message.get('reasoning_content', '') + delta['reasoning_content']
+            if delta.get('content'):
+                message['content'] += delta['content']
+                if index == 0:
+                    token = delta['content']
+            if choice.get('finish_reason') is not None:
+                choices[index]['finish_reason'] = choice['finish_reason']
+        return token
+
+
+class AsyncDeepSeekClientComponent(DeepSeekClientBase):
+    """
+    Asyncio variant of the client. Requests of all coroutines share one aiohttp session with a pool
+    of keep-alive connections, so thousands of chats in flight don't need a thread each.
+    Payloads, retries, the cache and the responses are the same as in DeepSeekClientComponent.
+
+    `max_concurrency` is a global cap of the requests in flight shared by all callers of the client.
+    The session is owned by the event loop of the client, which runs in a daemon thread started
+    by the first request. Requests awaited in any loop (the agent loop, a loop of `asyncio.run`
+    of a skill called from a task thread) are sent from it, so the session and the cap are shared
+    by all of them and the session is never used from a loop that does not own it.
+    Requires the aiohttp module.
+    """
+
+    def __init__(self, api_key: str, model_name: str = None, url: str = __default_utl__,
+                 pool_max_size: int = __default_async_pool_max_size__,
+                 max_concurrency: int = None,
+                 connect_timeout_sec: float = __default_connect_timeout_sec__,
+                 read_timeout_sec: float = __default_read_timeout_sec__,
+                 max_retries: int = __default_max_retries__,
+                 retry_backoff_sec: float = __default_retry_backoff_sec__,
+                 cache: 'DeepSeekCompletionCache' = None,
+                 rate_limiter: ratelimit.RateLimiter = None,
+                 **kwargs):
+        """
+        :param api_key:
+        :param model_name:
+        :param url: Chat completions endpoint
+        :param pool_max_size: Max open connections
+        :param max_concurrency: Max requests in flight, the pool size by default
+        :param connect_timeout_sec:
+        :param read_timeout_sec: Max wait between bytes of the response
+        :param max_retries: Retries of a failed request, 0 to disable
+        :param retry_backoff_sec: Base of the exponential backoff between retries
+        :param cache: Optional cache of the completions of repeated requests
+        :param rate_limiter: Optional limiter of requests and tokens per minute, shared by the clients of one API
+        :param kwargs: Text generation params of the payload
+        """
+        utils.validate_modules(['aiohttp'])
+        super().__init__(api_key, model_name, url, connect_timeout_sec, read_timeout_sec,
+                         max_retries, retry_backoff_sec, cache, rate_limiter, **kwargs)
+
+        self.pool_max_size = pool_max_size
+        self.max_concurrency = max_concurrency if max_concurrency is not None else pool_max_size
+        if self.max_concurrency < 1:
+            raise ValueError('Max concurrency must be greater than zero')
+
+        self._session = None
+        self._semaphore = None
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+
+    async def request(self, chat: ChatAgentValue) -> DeepSeekResponse:
+        payload = self._build_payload(chat)
+        key = self._build_cache_key(payload)
+        if key is not None:
+            completion = self.cache.get(key)
+            if completion is not None:
+                return DeepSeekResponse(None, completion, is_cached=True)
+
+        permit, status_code, completion = await self._run_in_loop(
+            self._post(encode_payload(payload), self._estimate_tokens(payload))
+        )
+        response = None
+        try:
+            response = DeepSeekResponse(None, completion, status_code)
+        finally:
+            self._reconcile(permit, response)
+        if key is not None and status_code == 200:
+            self.cache.put(key, completion)
+        return response
+
+    async def request_many(self, chats, return_exceptions: bool = False) -> list:
+        """
+        Send the chats concurrently. The number of requests in flight is limited by `max_concurrency`
+        :param chats: Iterable of chats
+        :param return_exceptions: Return the errors of the failed requests in place of their responses
+        instead of raising the first one
+        :return: list of DeepSeekResponse in the order of the chats
+        """
+        return await asyncio.gather(*[self.request(chat) for chat in chats], return_exceptions=return_exceptions)
+
+    async def close(self):
+        """
+        Close the pooled connections and stop the event loop of the client. It can be awaited in any loop,
+        the next request starts the loop again
+        :return:
+        """
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop, self._loop_thread = None, None
+        if loop is None:
+            return
+
+        try:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._close_session(), loop))
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            await asyncio.get_running_loop().run_in_executor(None, thread.join)
+
+    async def _run_in_loop(self, coroutine):
+        loop = self._prepare_loop()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    def _prepare_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=_run_loop, args=(self._loop,), name='AsyncDeepSeekClientLoop', daemon=True
+                )
+                self._loop_thread.start()
+            return self._loop
+
+    async def _close_session(self):
+        session, self._session = self._session, None
+        self._semaphore = None
+        if session is not None:
+            await session.close()
+
+    def _build_session(self):
+        import aiohttp
+
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_max_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout_sec, sock_read=self.read_timeout_sec),
+            headers=self._build_headers()
+        )
+
+    async def _post(self, payload: str, tokens: int) -> tuple:
+        """
+        Send the payload with retries in the loop of the client. Every attempt waits for its own permit
+        of the rate limiter, the permits of the failed attempts are reconciled here
+        :param payload: Encoded payload
+        :param tokens: Estimated tokens of the request
+        :return: (permit of the last attempt, status code, parsed body)
+        """
+        import aiohttp
+
+        if self._session is None:
+            self._session = self._build_session()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        for attempt in range(self.max_retries + 1):
+            is_last = attempt == self.max_retries
+            permit = await self._acquire_async(tokens)
+            try:
+                async with self._semaphore, self._session.post(self.url, data=payload) as response:
+                    if is_last or response.status not in __retry_status_codes__:
+                        return permit, response.status, json.loads(await response.text())
+                    delay = retry_after_sec(response)
+            except aiohttp.ClientConnectionError:
+                self._reconcile(permit, None)
+                if is_last:
+                    raise
+                delay = None
+            except BaseException:
+                self._reconcile(permit, None)
+                raise
+            else:
+                self._reconcile(permit, None)
+
+            await asyncio.sleep(delay if delay is not None else retry_backoff(self.retry_backoff_sec, attempt))
+
+
+class DeepSeekCompletionCache:
+    """
+    Cache of the completions by the canonical hash of the request payload (messages and generation params).
+
+    Recent completions are kept in memory, the least recently used are evicted when the cache is full.
+    The optional SQLite file keeps the completions between restarts and after they are evicted from memory.
+    Entries expire `ttl_sec` seconds after they are stored.
+    Requests with a temperature above `max_temperature` are not cached, their answers are expected to vary.
+    By default it is only near-deterministic requests: requests of the default temperature bypass the cache.
+    The cache is safe to use from the task threads.
+    """
+
+    def __init__(self, max_size: int = __default_cache_max_size__, ttl_sec: float = __default_cache_ttl_sec__,
+                 max_temperature: float = __default_cache_max_temperature__, db_path: str = None):
+        """
+        :param max_size: Max completions in memory
+        :param ttl_sec: Lifetime of the entry
+        :param max_temperature: Requests with a higher temperature bypass the cache
+        :param db_path: Path of the SQLite file of the disk tier, None to keep the cache in memory only
+        """
+        if max_size < 1:
+            raise ValueError('Cache size must be greater than zero')
+
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.max_temperature = max_temperature
+
+        # key -> (expires at on the monotonic clock, completion)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+        self._db = None
+        if db_path is not None:
+            if os.path.dirname(db_path) != '':
+                utils.make_dir_if_not_exist(db_path)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, created_at REAL, body TEXT)'
+            )
+            self._db.commit()
+
+    def is_cacheable(self, payload: dict) -> bool:
+        temperature = payload.get('temperature')
+        temperature = temperature if temperature is not None else __default_temperature__
+        if temperature > self.max_temperature:
+            with self._lock:
+                self.bypasses += 1
+            return False
+        return True
+
+    def get(self, key: str) -> dict | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            completion = self._get_from_disk(key) if self._db is not None else None
+            if completion is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.disk_hits += 1
+            self._put_to_memory(key, completion[1], completion[0] + self.ttl_sec - time.time())
+            return completion[1]
+
+    def put(self, key: str, completion: dict):
+        with self._lock:
+            self._put_to_memory(key, completion, self.ttl_sec)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO completions (key, created_at, body) VALUES (?, ?, ?)',
+                    (key, time.time(), json.dumps(completion))
+                )
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM completions')
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests_count = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'hit_ratio': self.hits / requests_count if requests_count > 0 else 0.0,
+            }
+
+    def _put_to_memory(self, key: str, completion: dict, ttl_sec: float):
+        self._entries[key] = (time.monotonic() + ttl_sec, completion)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_from_disk(self, key: str):
+        row = self._db.execute('SELECT created_at, body FROM completions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[0] + self.ttl_sec <= time.time():
+            self._db.execute('DELETE FROM completions WHERE key = ?', (key,))
+            self._db.commit()
+            return None
+        return row[0], json.loads(row[1])
+
+
+class DeepSeekChatCompactor:
+    """
+    Background compaction of long chats.
+
+    When a chat has more than `threshold_messages` messages, the older messages after the system prompt
+    are summarized by the model into one system message, the last `keep_messages` messages are kept as is.
+    The previous summary is summarized again with the newer messages, so a chat has one summary at most.
+    The summary is requested in the compactor thread, so the answer to the user is not delayed,
+    and is stored with ChatAgentValue.replace_messages: the summarized messages are swapped in one step,
+    and the summary is discarded if they were removed from the history in the meantime.
+    """
+
+    def __init__(self, client: DeepSeekClientComponent,
+                 threshold_messages: int = __default_compaction_threshold_messages__,
+                 keep_messages: int = __default_compaction_keep_messages__,
+                 prompt: str = __default_compaction_prompt__):
+        """
+        :param client: Client of the summary requests
+        :param threshold_messages: Chats with more messages are compacted
+        :param keep_messages: Newest messages kept as is
+        :param prompt: System prompt of the summary request
+        """
+        if keep_messages < 1 or threshold_messages <= keep_messages:
+            raise ValueError(
+                f'Compaction must keep at least one message and less than the threshold. '
+                f'Current keep {keep_messages}, threshold {threshold_messages}'
+            )
+
+        self.client = client
+        self.threshold_messages = threshold_messages
+        self.keep_messages = keep_messages
+        self.prompt = prompt
+
+        # One worker, so the summaries don't compete with the answers for the connections and the rate limit
+        self._pool = ex.ThreadPool(
+            pool_max_size=1, queue_max_size=__default_compaction_queue_max_size__,
+            overflow_policy=ex.__overflow_reject__
+        )
+        self._lock = threading.Lock()
+        # Ids of the message lists with a scheduled compaction
+        self._pending = set()
+        self.is_closed = False
+
+        self.scheduled = 0
+        self.compacted = 0
+        self.discarded = 0
+        self.failed = 0
+
+    def schedule(self, chat: ChatAgentValue) -> bool:
+        """
+        Schedule the compaction of the chat if it is longer than the threshold
+        :param chat:
+        :return: True if the compaction is scheduled
+        """
+        messages = chat.snapshot_messages()
+        if self.is_closed or len(messages) <= self.threshold_messages:
+            return False
+
+        block = find_compaction_block(messages, self.keep_messages)
+        if len(block) == 0:
+            return False
+
+        key = id(chat.messages)
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+
+        try:
+            self._pool.execute(self._compact, args=(chat, block, key))
+        except OverflowError:
+            with self._lock:
+                self._pending.discard(key)
+            return False
+
+        with self._lock:
+            self.scheduled += 1
+        return True
+
+    def summarize(self, messages: list) -> dict:
+        """
+        Request the summary of the messages
+        :param messages:
+        :return: System message with the summary
+        """
+        transcript = '\n\n'.join(f'{message["role"]}: {message["content"]}' for message in messages)
+
+        chat = ChatAgentValue([])
+        chat.append_system(self.prompt)
+        chat.append_user(transcript)
+        response = self.client.request(chat)
+
+        message = response.last_message
+        if response.status_code != 200 or message is None or not message.get('content'):
+            raise ValueError(f'Summary is not received. Response status {response.status_code}')
+
+        return {
+            'role': 'system',
+            'content': f'{__compaction_summary_title__}\n{message["content"]}',
+            __summary_key__: True
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'scheduled': self.scheduled,
+                'compacted': self.compacted,
+                'discarded': self.discarded,
+                'failed': self.failed,
+            }
+
+    def close(self):
+        """
+        Stop scheduling new compactions. Scheduled ones are completed by the worker
+        :return:
+        """
+        self.is_closed = True
+
+    def _compact(self, chat: ChatAgentValue, block: list, key: int):
+        try:
+            summary = self.summarize(block)
+            is_replaced = chat.replace_messages(block, [summary])
+            with self._lock:
+                if is_replaced:
+                    self.compacted += 1
+                else:
+                    self.discarded += 1
+        except Exception:
+            _log.exception('Failed to compact the chat')
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+def find_compaction_block(messages: list, keep_messages: int) -> list:
+    """
+    Messages to summarize: the messages after the system prompt (including the previous summary),
+    except the newest `keep_messages`. The kept history starts from a user message
+    :param messages:
+    :param keep_messages:
+    :return: Copy of the run of the messages, empty if there is nothing to compact
+    """
+    start = 0
+    while start < len(messages) and messages[start].get('role') == 'system' \
+            and not messages[start].get(__summary_key__):
+        start += 1
+
+    end = len(messages) - keep_messages
+    while start < end < len(messages) - 1 and messages[end].get('role') == 'assistant':
+        end += 1
+
+    # A single message, e.g. the previous summary, is not worth a request
+    if end - start < 2:
+        return []
+    return messages[start:end]
+
+
+def build_payload_key(payload: dict) -> str:
+    """
+    Canonical hash of the request payload. Keys are sorted, so the order of params doesn't matter,
+    stream params are skipped, so streamed and regular requests share the completions
+    :param payload:
+    :return: hex digest
+    """
+    canonical = {key: value for key, value in payload.items() if key not in __cache_ignored_keys__}
+    data = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False,
+                      default=history.encode_json)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def encode_payload(payload: dict) -> str:
+    """
+    JSON body of the request. The history view and the message records are encoded as the message dicts
+    :param payload:
+    :return:
+    """
+    return json.dumps(payload, default=history.encode_json)
+
+
+def estimate_payload_tokens(payload: dict) -> int:
+    """
+    Estimated tokens of the request: the prompt messages and the max tokens of the answer
+    :param payload:
+    :return:
+    """
+    return tokens.estimate_chat_tokens(payload['messages'], payload.get('max_tokens'))
+
+
+def iter_sse_data(lines):
+    """
+    Data of the server-sent events. Data lines of one event are joined by a line break,
+    comments and other fields are skipped
+    :param lines: Iterable of the stream lines (bytes or str)
+    :return: Generator of event data strings
+    """
+    data = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+
+        if line == '':
+            if len(data) > 0:
+                yield '\n'.join(data)
+                data = []
+            continue
+
+        if line.startswith('data:'):
+            value = line[5:]
+            data.append(value[1:] if value.startswith(' ') else value)
+
+    if len(data) > 0:
+        yield '\n'.join(data)
+
+
+def build_session(pool_max_size: int, headers: dict) -> requests.Session:
+    """
+    Session with a pool of keep-alive connections to the API host
+    :param pool_max_size: Max connections kept in the pool
+    :param headers: Headers of every request
+    :return:
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_max_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(headers)
+    return session
+
+
+def retry_backoff(base_sec: float, attempt: int) -> float:
+    """
+    Exponential backoff with full jitter, so the retries of concurrent requests are spread in time
+    :param base_sec:
+    :param attempt: Number of the failed attempt, starting from 0
+    :return: delay in seconds
+    """
+    return random.uniform(0, min(__max_retry_backoff_sec__, base_sec * 2 ** attempt))
+
+
+def retry_after_sec(response) -> float | None:
+    """
+    Delay requested by the server in the Retry-After header (in seconds)
+    :param response:
+    :return: delay or None if the header is missing or is not a number of seconds
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return min(__max_retry_backoff_sec__, max(0.0, float(value)))
+    except ValueError:
+        return None
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop):
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
@@ -1,11 +1,37 @@
 from sidusai.core.plugin import ChatAgentValue
-from sidusai.plugins.deepseek.components import DeepSeekClientComponent
+from sidusai.plugins.deepseek.components import AsyncDeepSeekClientComponent, DeepSeekChatCompactor, \
+    DeepSeekClientComponent, DeepSeekResponse
 
 
 def ds_chat_transform_skill(value: ChatAgentValue, client: DeepSeekClientComponent) -> ChatAgentValue:
-    # TODO: Add general response processing to generate a messages stream
+    if client.stream:
+        response = client.request_stream(value, on_token=value.on_token)
+    else:
+        response = client.request(value)
+    return _append_answer(value, response)
 
-    response = client.request(value)
+
+async def ds_chat_transform_skill_async(value: ChatAgentValue,
+                                        client: AsyncDeepSeekClientComponent) -> ChatAgentValue:
+    """
+    Chat skill of the asyncio client. It is awaited in the event loop by Agent.task_execute_async
+    """
+    response = await client.request(value)
+    return _append_answer(value, response)
+
+
+def ds_chat_compaction_skill(value: ChatAgentValue, compactor: DeepSeekChatCompactor) -> ChatAgentValue:
+    """
+    Schedule the background compaction of a long chat. The chat is passed on unchanged,
+    the summary replaces the older messages when it is received
+    """
+    compactor.schedule(value)
+    return value
+
+
+def _append_answer(value: ChatAgentValue, response: DeepSeekResponse) -> ChatAgentValue:
+    # The usage of a cached completion belongs to the request that stored it
+    value.usage = None if response.is_cached else response.completion.get('usage')
     if response.last_message is not None and 'content' in response.last_message:
         content = response.last_message['content']
         value.append_assistant(content)
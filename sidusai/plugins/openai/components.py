@@ -1,4 +1,5 @@
 import sidusai as sai
+import sidusai.core.tokens as tokens
 import openai as ai
 
 model_gpt_4o_mini = 'gpt-4o-mini'
@@ -14,21 +15,38 @@ __presence_penalty__ = 0
 
 class OpenAiConnector:
 
-    def __init__(self, api_key: str, model_name: str = None):
+    def __init__(self, api_key: str, model_name: str = None, rate_limiter: sai.RateLimiter = None):
+        """
+        :param api_key:
+        :param model_name:
+        :param rate_limiter: Optional limiter of requests and tokens per minute, shared by the clients of one API.
+        Requests wait for the budget instead of failing with 429
+        """
         self.api_key = api_key
         self.model_name = model_name if model_name is not None else __default_model_name__
+        self.rate_limiter = rate_limiter
 
         self.client = ai.OpenAI(api_key=self.api_key)
 
     def request(self, chat: sai.ChatAgentValue) -> ai.ChatCompletion:
         messages = [{'role': v['role'], 'content': v['content']} for v in chat.messages]
 
-        return self.client.chat.completions.create(
-            model=self.model_name,
-            messages=messages,
-            temperature=__default_temperature__,
-            max_tokens=__default_max_tokens__,
-            top_p=__default_top_p__,
-            frequency_penalty=__frequency_penalty__,
-            presence_penalty=__presence_penalty__,
-        )
+        permit, completion = None, None
+        if self.rate_limiter is not None:
+            permit = self.rate_limiter.acquire(tokens.estimate_chat_tokens(messages, __default_max_tokens__))
+        try:
+            completion = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=__default_temperature__,
+                max_tokens=__default_max_tokens__,
+                top_p=__default_top_p__,
+                frequency_penalty=__frequency_penalty__,
+                presence_penalty=__presence_penalty__,
+            )
+            return completion
+        finally:
+            if permit is not None:
+                # A failed request returns its estimated tokens to the limiter
+                usage = getattr(completion, 'usage', None)
+                self.rate_limiter.reconcile(permit, usage.total_tokens if usage is not None else 0)
@@ -14,7 +14,7 @@ __default_parse_mode__ = 'Markdown'
 
 # TODO: Move to agent constructor
 __default_tg_timeout__ = 30
-__default_tg_interval__ = 1
+__default_tg_error_backoff_sec__ = 1
 __default_message_store_limit__ = 100
 
 
@@ -22,16 +22,59 @@ class TelegramChatAgentValue(sai.ChatAgentValue):
     """
     A wrapper for a transformable chat, enhanced with additional chat management information.
     Includes a temporary progress message, as well as the user ID used to send the response.
+
+    The messages are the user's history in the cache. The history is changed and read for the requests
+    by the cache under its lock, so the answers, the trims and the background compaction don't race.
+    The cache is not pickled, a copy of the value sent to a process skill works with its own messages.
     """
 
-    def __init__(self, messages, user_id, removed_message):
+    def __init__(self, messages, user_id, removed_message, cache: components.TelegramChatInMemoryCache = None):
         super().__init__(messages)
         self.user_id = user_id
         self.removed_message = removed_message
+        self.cache = cache
+
+    def snapshot_messages(self) -> list:
+        messages = self.cache.snapshot(self.user_id) if self.cache is not None else None
+        return messages if messages is not None else super().snapshot_messages()
+
+    def total_tokens(self) -> int:
+        if self.cache is None:
+            return super().total_tokens()
+        return self.cache.total_tokens(self.user_id)
+
+    def replace_messages(self, old: list, new: list) -> bool:
+        if self.cache is None:
+            return super().replace_messages(old, new)
+        return self.cache.replace_messages(self.user_id, old, new)
+
+    def _append(self, role: str, content: str):
+        # The message is trimmed to the limits of the cache with the history
+        if self.cache is None:
+            return super()._append(role, content)
+        self.messages = self.cache.put(self.user_id, {'role': role, 'content': content})
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['cache'] = None
+        return state
 
 
 class TelegramUserRequestTransformTask(sai.CompletedAgentTask):
-    pass
+    """
+    The task of the user's request. If the task data is a TelegramRequest, the request is added to
+    the user's chat history when the task starts, so the history of the user is changed only by
+    the task being executed.
+    """
+
+    def __init__(self, agent: sai.Agent, value=None, handler=None):
+        super().__init__(agent, value, handler)
+        self.agent = agent
+
+    def forward(self, *args, **kwargs) -> sai.AgentValue:
+        if isinstance(self.value, TelegramRequest):
+            return self.agent.prepare_chat(self.value)
+        return self.value
 
 
 class TelegramRequest:
@@ -62,7 +105,8 @@ class TelegramAiAgent(sai.Agent):
     """
 
     def __init__(self, bot_api_key: str, system_prompt: str, plugins: [sai.AgentPlugin],
-                 prepare_task_skills: [] = None):
+                 prepare_task_skills: [] = None, token_budget: int = None,
+                 cache: components.TelegramChatInMemoryCache = None):
         super().__init__(__default_tg_agent_name__)
 
         self.api_key = bot_api_key
@@ -77,31 +121,54 @@ class TelegramAiAgent(sai.Agent):
 
         skill_names = _cp.build_and_register_task_skill_names(task_skills, self)
 
-        self.add_loop_method(self._tg_pooling_loop, __default_tg_interval__)
+        # Long poll is re-invoked as soon as it returns, without waiting for the scheduler
+        self.add_loop_method(
+            self._tg_pooling_loop, continuous=True, error_backoff_sec=__default_tg_error_backoff_sec__
+        )
         self.task_registration(TelegramUserRequestTransformTask, skill_names=skill_names)
 
-        # TODO: Move to wrapper to solve thread race problem
-        self.cache = components.TelegramChatInMemoryCache(__default_message_store_limit__)
+        # The history is limited by messages and, when the token budget is set, by the estimated tokens.
+        # Pass a configured cache to limit the memory of the users
+        self.cache = cache if cache is not None \
+            else components.TelegramChatInMemoryCache(__default_message_store_limit__, token_budget=token_budget)
+        # As a component the cache is closed on halt, the evicted histories are written to its file
+        self.add_component_builder(self._build_chat_cache)
 
     def send_answer(self, tg_request: TelegramRequest):
+        """
+        Queue the user's request. Requests of the same user are answered one by one in the order
+        they were sent, requests of different users are answered in parallel
+        :param tg_request:
+        :return: Handle of the task
+        """
+        task = TelegramUserRequestTransformTask(self).data(tg_request).then(self._on_complete_task)
+        # Every request holds its own lock until it is done or cancelled, so the history is not evicted
+        # while a request of the user is queued or answered
+        self.cache.lock(tg_request.user_id)
+        try:
+            handle = self.task_execute(task, key=tg_request.user_id)
+        except BaseException:
+            self.cache.unlock(tg_request.user_id)
+            raise
+        handle.add_done_callback(lambda _: self.cache.unlock(tg_request.user_id))
+        return handle
+
+    def prepare_chat(self, tg_request: TelegramRequest) -> TelegramChatAgentValue:
+        """
+        Add the user's request to the chat history and notify the user that the request is processing
+        :param tg_request:
+        :return: Chat value of the user
+        """
         user_id = tg_request.user_id
-        lock = self.cache.is_locking(user_id)
-        if lock:
-            self.bot.send_message(user_id, 'You have already sent a request. Expect a response')
-            return
-
         self._set_prompt_if_cache_not_exist(user_id)
         self.cache.put_user(user_id, tg_request.text)
         chat_messages = self.cache[user_id]
 
         removed = self.bot.send_message(user_id, 'processing...')
-        chat = TelegramChatAgentValue(chat_messages, user_id, removed)
-        task = TelegramUserRequestTransformTask(self).data(chat).then(self._on_complete_task)
-        self.cache.lock(user_id)
-        self.task_execute(task)
+        return TelegramChatAgentValue(chat_messages, user_id, removed, self.cache)
 
     def _on_complete_task(self, chat: TelegramChatAgentValue):
-        self.cache.unlock(chat.user_id)
+        self.cache.record_usage(chat.user_id, chat.usage)
         if chat.removed_message is not None:
             self.bot.delete_message(chat.removed_message.chat.id, chat.removed_message.id)
 
@@ -114,6 +181,9 @@ class TelegramAiAgent(sai.Agent):
         if chat_messages is None:
             self.cache.put_system(user_id=user_id, content=self.system_prompt)
 
+    def _build_chat_cache(self) -> components.TelegramChatInMemoryCache:
+        return self.cache
+
     def _tg_pooling_loop(self):
         offset = self.bot.last_update_id + 1
         res = self.bot.get_updates(offset=offset, timeout=__default_tg_timeout__)
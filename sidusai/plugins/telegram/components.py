@@ -1,29 +1,122 @@
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import sidusai.core.history as history
+import sidusai.core.plugin as _cp
+import sidusai.core.tokens as tokens
+import sidusai.core.utils as utils
+
 __default_message_store_limit__ = 100
 
+# Approximate memory of the structures of a message and of a user, the text of the messages comes on top
+__message_overhead_bytes__ = 120
+__user_overhead_bytes__ = 600
+
+_log = logging.getLogger(__name__)
+
 
 class TelegramChatInMemoryCache:
     """
     A sample of the implementation of caching messages bot processed.
     Information for the user is stored by his ID. The number of messages
-    stored in RAM is limited by the specified value
+    stored in RAM is limited by the specified value. The messages of a user are stored in ChatHistory,
+    so a new message and a trim don't copy the history
+
+    When the limit is exceeded, the oldest messages after the system prompt are dropped in one block.
+    Between the trims the beginning of the history stays the same, so the provider's prompt prefix cache
+    covers the whole previous conversation instead of the system prompt alone.
+
+    With a token budget the history is trimmed by the estimated tokens in the same way. Tokens of every
+    message are estimated once and a running total is kept by user, so a new message costs O(1).
+
+    The number of users in memory and the approximate bytes of their histories can be limited. When a limit
+    is exceeded or a user is idle longer than `ttl_sec`, the least recently used histories are evicted.
+    Evicted histories are spilled to the SQLite file, if it is set, and are loaded back on the next access
+    of the user, otherwise they are dropped. Locked users (whose requests are queued or being answered)
+    are not evicted. The file is written outside the lock of the cache, one thread at a time in the order
+    of the evictions, an evicted history is loaded back from memory until it is written.
+    The file is read outside the lock as well, the read is repeated if a history was written in the meantime.
     """
 
-    def __init__(self, message_store_limit: int | None = None):
+    def __init__(self, message_store_limit: int | None = None, trim_block_size: int | None = None,
+                 token_budget: int | None = None, trim_block_tokens: int | None = None,
+                 max_users: int | None = None, max_bytes: int | None = None, ttl_sec: float | None = None,
+                 spill_path: str | None = None):
+        """
+        :param message_store_limit: Max messages of the user
+        :param trim_block_size: Messages dropped at once when the limit is exceeded.
+        Half of the limit by default, 1 to drop the oldest message on every new one
+        :param token_budget: Max estimated tokens of the user's messages
+        :param trim_block_tokens: Min tokens dropped at once when the budget is exceeded. Half of the budget by default
+        :param max_users: Max users in memory
+        :param max_bytes: Max approximate bytes of the histories in memory
+        :param ttl_sec: Histories of the users idle for longer are evicted
+        :param spill_path: Path of the SQLite file of the evicted histories, None to drop them
+        """
+        for limit in [max_users, max_bytes, ttl_sec]:
+            if limit is not None and limit <= 0:
+                raise ValueError(f'Cache limit must be greater than zero. Current limit {limit}')
+
         self.message_store_limit = message_store_limit
+        self.trim_block_size = trim_block_size
+        self.token_budget = token_budget
+        self.trim_block_tokens = trim_block_tokens
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
 
-        self.cache = {}
+        # Histories in the order of the last access, the least recently used first
+        self.cache = collections.OrderedDict()
+        # Requests of the user holding the lock
         self.locks = {}
+        # Guards the histories changed outside the user's task, e.g. by the background compaction
+        self._lock = threading.Lock()
+        # Prompt cache usage by user: [requests, hit tokens, miss tokens]
+        self.usage = {}
+        # Running tokens by user: [counted messages, tokens]
+        self.tokens = {}
+        # Last access by user on the monotonic clock
+        self._accessed = {}
+        # Approximate bytes by user: [counted messages, bytes]
+        self._bytes = {}
+        self.total_bytes = 0
+
+        self.evictions = 0
+        self.reloads = 0
+        self.spill = TelegramChatSpillStore(spill_path) if spill_path is not None else None
+        # Evicted histories that are not written yet: user_id -> (messages, usage)
+        self._spilling = {}
+        # Writes (user_id, (messages, usage)) and deletes (user_id, None) of the file in the order of the changes
+        self._spill_queue = collections.deque()
+        self._is_flushing = False
+        # Histories written to the file. A history read from the file before a write can be outdated
+        self._spill_writes = 0
 
     def lock(self, user_id):
-        self.locks[user_id] = True
+        """
+        Keep the user's history in memory until the matching unlock. Every request of the user takes its own lock
+        :param user_id:
+        :return:
+        """
+        with self._lock:
+            self.locks[user_id] = self.locks.get(user_id, 0) + 1
 
     def unlock(self, user_id):
-        self.locks[user_id] = False
+        with self._lock:
+            count = self.locks.get(user_id, 0) - 1
+            if count > 0:
+                self.locks[user_id] = count
+            else:
+                # Only the locked users are kept, so the locks don't grow with the users
+                self.locks.pop(user_id, None)
 
     def is_locking(self, user_id):
-        if user_id not in self.locks:
-            self.unlock(user_id)
-        return self.locks[user_id]
+        return self.locks.get(user_id, 0) > 0
 
     def put_system(self, user_id, content: str):
         self.put(user_id, {'role': 'system', 'content': content})
@@ -35,34 +128,472 @@ class TelegramChatInMemoryCache:
         self.put(user_id, {'role': 'assistant', 'content': content})
 
     def put(self, user_id, message: dict):
+        """
+        Append the message to the user's history and trim it to the limits
+        :param user_id:
+        :param message: {'role', 'content'} message
+        :return: The user's history
+        """
         if 'role' not in message or 'content' not in message:
             raise ValueError('Message dict can be contain \'role\' and \'content\' keys')
-        messages = []
-        if user_id in self.cache:
-            messages = self.cache[user_id]
+        while True:
+            spilled = self._read_spill(user_id)
+            with self._lock:
+                if self._is_outdated(user_id, spilled):
+                    continue
+                messages = self._put(user_id, message, spilled)
+                break
+        self._flush_spill()
+        return messages
+
+    def snapshot(self, user_id) -> list | None:
+        """
+        Messages of the user's request, read in one step with the changes of the history
+        :param user_id:
+        :return: list of the messages, None if the user is not in memory
+        """
+        with self._lock:
+            messages = self.cache.get(user_id)
+            return list(messages) if messages is not None else None
+
+    def replace_messages(self, user_id, old: list, new: list) -> bool:
+        """
+        Replace a run of the user's messages in one step, e.g. the old messages by their summary.
+        Nothing is changed if the messages were trimmed from the history in the meantime
+        :param user_id:
+        :param old: Consecutive messages of the history, compared by identity
+        :param new: Messages to put in their place
+        :return: True if the messages are replaced
+        """
+        with self._lock:
+            messages = self.cache.get(user_id)
+            if messages is None:
+                return False
+
+            index = _cp.find_message_run(messages, old)
+            if index is None:
+                return False
+
+            messages[index:index + len(old)] = new
+            self.tokens.pop(user_id, None)
+            self._reset_bytes(user_id)
+            return True
+
+    def stats(self) -> dict:
+        """
+        Memory statistics of the cache
+        :return: dict with the users and bytes in memory, evictions, reloads and spilled users
+        """
+        spilled_users = len(self.spill) if self.spill is not None else 0
+        with self._lock:
+            return {
+                'users': len(self.cache),
+                'locked_users': len(self.locks),
+                'bytes': self.total_bytes,
+                'evictions': self.evictions,
+                'reloads': self.reloads,
+                'spilled_users': spilled_users + len(self._spilling),
+            }
+
+    def close(self):
+        """
+        Write the evicted histories and close the file. The histories in memory are not spilled
+        :return:
+        """
+        if self.spill is not None:
+            self._flush_spill()
+            self.spill.close()
+
+    def _put(self, user_id, message: dict, spilled: tuple | None):
+        messages = self._load(user_id, spilled)
+        if messages is None:
+            messages = history.ChatHistory()
 
         messages.append(message)
         if self.message_store_limit is not None and 0 < self.message_store_limit < len(messages):
-            # Saving system or first only messages at the beginning of the context
-            s_index = 0
-            for index, msg in enumerate(messages):
-                if 'role' in msg and msg['role'] == 'system':
-                    s_index = index
-                    continue
-                break
-            if s_index + 1 >= self.message_store_limit:
-                s_index = self.message_store_limit - 2
-            messages = messages[:s_index + 1] + messages[(-self.message_store_limit + s_index + 1):]
+            block_size = self.trim_block_size
+            if block_size is None:
+                block_size = max(1, self.message_store_limit // 2)
+            messages = trim_messages(messages, self.message_store_limit, block_size)
+            self._reset_bytes(user_id)
+
+        if self.token_budget is not None:
+            messages = self._trim_to_budget(user_id, messages)
 
         self.cache[user_id] = messages
+        self._touch(user_id, messages)
+        self._evict(user_id)
+        return messages
+
+    def _read_spill(self, user_id) -> tuple | None:
+        """
+        Read the evicted history of the user from the file without the lock of the cache
+        :param user_id:
+        :return: pair (writes of the file before the read, (messages, usage) or None),
+        None if the history is in memory
+        """
+        if self.spill is None:
+            return None
+        with self._lock:
+            if user_id in self.cache or user_id in self._spilling:
+                return None
+            writes = self._spill_writes
+        return writes, self.spill.get(user_id)
+
+    def _is_outdated(self, user_id, spilled: tuple | None) -> bool:
+        # Must be called under the lock. A history in memory is newer than the file
+        if self.spill is None or user_id in self.cache or user_id in self._spilling:
+            return False
+        return spilled is None or spilled[0] != self._spill_writes
+
+    def _load(self, user_id, spilled: tuple | None = None):
+        """
+        Get the user's history, an evicted one is taken back to memory. Must be called under the lock
+        :param user_id:
+        :param spilled: The read of the file by _read_spill, checked by _is_outdated
+        :return: The user's history or None
+        """
+        messages = self.cache.get(user_id)
+        if messages is None and self.spill is not None:
+            # A history that is not written yet is taken back, the queued write is skipped
+            entry = self._spilling.pop(user_id, None)
+            if entry is None and spilled is not None:
+                entry = spilled[1]
+                if entry is not None:
+                    # The memory keeps the only copy, the row is deleted outside the lock
+                    self._spill_queue.append((user_id, None))
+            if entry is not None:
+                messages, usage = entry
+                if usage is not None:
+                    self.usage[user_id] = usage
+                self.cache[user_id] = messages
+                self.reloads += 1
+        return messages
+
+    def _touch(self, user_id, messages):
+        self.cache.move_to_end(user_id)
+        self._accessed[user_id] = time.monotonic()
+
+        counted = self._bytes.get(user_id)
+        if counted is None:
+            counted = [0, __user_overhead_bytes__]
+            self._bytes[user_id] = counted
+            self.total_bytes += counted[1]
+
+        for index in range(counted[0], len(messages)):
+            size = estimate_message_bytes(messages[index])
+            counted[1] += size
+            self.total_bytes += size
+        counted[0] = len(messages)
+
+    def _reset_bytes(self, user_id):
+        # The history is changed not only at the end, it is measured again on the next access
+        counted = self._bytes.pop(user_id, None)
+        if counted is not None:
+            self.total_bytes -= counted[1]
+
+    def _evict(self, keep_user_id):
+        expired_at = time.monotonic() - self.ttl_sec if self.ttl_sec is not None else None
+        users = len(self.cache)
+        total_bytes = self.total_bytes
+
+        evicted = []
+        for user_id in self.cache:
+            is_over = (self.max_users is not None and users > self.max_users) \
+                      or (self.max_bytes is not None and total_bytes > self.max_bytes)
+            is_expired = expired_at is not None and self._accessed[user_id] < expired_at
+            if not is_over and not is_expired:
+                # The next users are accessed later
+                break
+            if user_id == keep_user_id or self.locks.get(user_id):
+                continue
+
+            evicted.append(user_id)
+            users -= 1
+            total_bytes -= self._bytes[user_id][1] if user_id in self._bytes else 0
+
+        for user_id in evicted:
+            self._spill_user(user_id)
+
+    def _spill_user(self, user_id):
+        messages = self.cache.pop(user_id)
+        usage = self.usage.pop(user_id, None)
+        self._accessed.pop(user_id, None)
+        self.tokens.pop(user_id, None)
+        self._reset_bytes(user_id)
+
+        if self.spill is not None:
+            entry = (messages, usage)
+            self._spilling[user_id] = entry
+            self._spill_queue.append((user_id, entry))
+        self.evictions += 1
+
+    def _flush_spill(self):
+        # Writes the queued changes of the file. The thread that finds the queue empty stops the flush
+        # under the lock of the cache, so a change queued in the meantime is never left behind
+        if self.spill is None:
+            return
+        with self._lock:
+            if self._is_flushing or len(self._spill_queue) == 0:
+                return
+            self._is_flushing = True
+
+        is_flushing = True
+        try:
+            while is_flushing:
+                with self._lock:
+                    if len(self._spill_queue) == 0:
+                        self._is_flushing = is_flushing = False
+                        continue
+                    user_id, entry = self._spill_queue.popleft()
+                    if entry is not None and self._spilling.get(user_id) is not entry:
+                        # Loaded back before it was written
+                        continue
+                    # The messages are copied, so the history loaded back can be changed while it is written
+                    messages = list(entry[0]) if entry is not None else None
+                try:
+                    self._write_spill(user_id, entry, messages)
+                except Exception:
+                    # The history stays in memory and is loaded back from there
+                    _log.exception(f'Failed to write the evicted history of user {user_id}')
+        finally:
+            if is_flushing:
+                with self._lock:
+                    self._is_flushing = False
+
+    def _write_spill(self, user_id, entry: tuple | None, messages: list | None):
+        if entry is None:
+            self.spill.delete(user_id)
+            return
+
+        self.spill.put(user_id, messages, entry[1])
+        with self._lock:
+            self._spill_writes += 1
+            is_loaded = self._spilling.get(user_id) is not entry
+            if not is_loaded:
+                del self._spilling[user_id]
+        if is_loaded:
+            # Loaded back while it was written, the next eviction is queued after this delete
+            self.spill.delete(user_id)
+
+    def total_tokens(self, user_id) -> int:
+        """
+        Estimated tokens of the user's messages. Messages appended since the previous count
+        (the answers are appended by the chat value) are counted on the call
+        :param user_id:
+        :return:
+        """
+        with self._lock:
+            messages = self.cache.get(user_id)
+            if messages is None:
+                return 0
+            return self._count_tokens(user_id, messages)
+
+    def _count_tokens(self, user_id, messages: list) -> int:
+        counted = self.tokens.get(user_id)
+        if counted is None or len(messages) < counted[0]:
+            # The history was replaced or trimmed outside the cache
+            counted = [0, 0]
+            self.tokens[user_id] = counted
+
+        for index in range(counted[0], len(messages)):
+            counted[1] += tokens.count_message_tokens(messages[index])
+        counted[0] = len(messages)
+        return counted[1]
+
+    def _trim_to_budget(self, user_id, messages: list) -> list:
+        total = self._count_tokens(user_id, messages)
+        if total <= self.token_budget:
+            return messages
+
+        block_tokens = self.trim_block_tokens
+        if block_tokens is None:
+            block_tokens = max(1, self.token_budget // 2)
+        target = max(0, self.token_budget - block_tokens)
+
+        pinned = tokens.count_pinned_messages(messages)
+        cut, dropped = tokens.find_token_cut(messages, pinned, total, target)
+        del messages[pinned:cut]
+        self.tokens[user_id] = [len(messages), total - dropped]
+        self._reset_bytes(user_id)
+        return messages
+
+    def record_usage(self, user_id, usage: dict | None):
+        """
+        Count the prompt cache tokens of the completion of the user's chat
+        :param user_id:
+        :param usage: Usage of the completion with `prompt_cache_hit_tokens` and `prompt_cache_miss_tokens`
+        :return:
+        """
+        if usage is None:
+            return
+        with self._lock:
+            counters = self.usage.setdefault(user_id, [0, 0, 0])
+            counters[0] += 1
+            counters[1] += usage.get('prompt_cache_hit_tokens') or 0
+            counters[2] += usage.get('prompt_cache_miss_tokens') or 0
+
+    def cache_stats(self, user_id) -> dict:
+        """
+        Prompt cache statistics of the user's chat
+        :param user_id:
+        :return: dict with the requests, hit and miss tokens and the hit ratio
+        """
+        requests, hit_tokens, miss_tokens = self.usage.get(user_id, [0, 0, 0])
+        prompt_tokens = hit_tokens + miss_tokens
+        return {
+            'requests': requests,
+            'prompt_cache_hit_tokens': hit_tokens,
+            'prompt_cache_miss_tokens': miss_tokens,
+            'hit_ratio': hit_tokens / prompt_tokens if prompt_tokens > 0 else 0.0,
+        }
 
     def __getitem__(self, item):
-        if item in self.cache:
-            return self.cache[item]
-        return None
+        while True:
+            spilled = self._read_spill(item)
+            with self._lock:
+                if self._is_outdated(item, spilled):
+                    continue
+                messages = self._load(item, spilled)
+                if messages is not None:
+                    self._touch(item, messages)
+                    self._evict(item)
+                break
+        self._flush_spill()
+        return messages
 
     def __setitem__(self, key, value):
-        if type(value) != list:
+        if not isinstance(value, (list, history.ChatHistory)):
             raise ValueError('Invalid cached value')
 
-        self.cache[key] = value
+        with self._lock:
+            if self.spill is not None:
+                self._spilling.pop(key, None)
+                self._spill_queue.append((key, None))
+            self.cache[key] = value
+            self.tokens.pop(key, None)
+            self._reset_bytes(key)
+            self._touch(key, value)
+            self._evict(key)
+        self._flush_spill()
+
+
+class TelegramChatSpillStore:
+    """
+    SQLite store of the chat histories evicted from memory. A history is removed from the store
+    when it is loaded back, so the memory keeps the only actual copy. The store is safe to use from many threads
+    """
+
+    def __init__(self, db_path: str):
+        """
+        :param db_path: Path of the SQLite file
+        """
+        if os.path.dirname(db_path) != '':
+            utils.make_dir_if_not_exist(db_path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS chats (user_id PRIMARY KEY, spilled_at REAL, body TEXT)')
+        self._db.commit()
+
+    def put(self, user_id, messages, usage: list | None = None):
+        """
+        Store the user's history
+        :param user_id:
+        :param messages: ChatHistory or list of message dicts
+        :param usage: Prompt cache usage of the user
+        :return:
+        """
+        body = json.dumps({
+            'messages': [[m['role'], m['content'], m.get('tokens'), m.get('summary')] for m in messages],
+            'usage': usage
+        }, ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO chats (user_id, spilled_at, body) VALUES (?, ?, ?)',
+                (user_id, time.time(), body)
+            )
+            self._db.commit()
+
+    def get(self, user_id) -> tuple | None:
+        """
+        Load the user's history
+        :param user_id:
+        :return: pair (ChatHistory, usage), None if the user is not stored
+        """
+        with self._lock:
+            row = self._db.execute('SELECT body FROM chats WHERE user_id = ?', (user_id,)).fetchone()
+        return self._decode(row[0]) if row is not None else None
+
+    def pop(self, user_id) -> tuple | None:
+        """
+        Load and remove the user's history
+        :param user_id:
+        :return: pair (ChatHistory, usage), None if the user is not stored
+        """
+        with self._lock:
+            row = self._db.execute('SELECT body FROM chats WHERE user_id = ?', (user_id,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('DELETE FROM chats WHERE user_id = ?', (user_id,))
+            self._db.commit()
+        return self._decode(row[0])
+
+    def delete(self, user_id):
+        with self._lock:
+            self._db.execute('DELETE FROM chats WHERE user_id = ?', (user_id,))
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM chats').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _decode(data: str) -> tuple:
+        body = json.loads(data)
+        messages = history.ChatHistory(
+            history.ChatMessage(role, content, tokens_count, summary)
+            for role, content, tokens_count, summary in body['messages']
+        )
+        return messages, body['usage']
+
+
+def estimate_message_bytes(message) -> int:
+    """
+    Approximate memory of the message: the structures and the text
+    :param message:
+    :return:
+    """
+    content = message.get('content')
+    return __message_overhead_bytes__ + (len(content) if content else 0)
+
+
+def trim_messages(messages: history.ChatHistory | list, limit: int, block_size: int) -> history.ChatHistory | list:
+    """
+    Drop a block of the oldest messages in place, so the history has `limit - block_size` messages.
+    Leading system messages (or the first message) are kept. The kept history starts from a user message,
+    so the answer is not separated from its question.
+    :param messages:
+    :param limit: Max messages
+    :param block_size: Min dropped messages
+    :return: The trimmed messages
+    """
+    if len(messages) <= limit:
+        return messages
+
+    # Saving system or first only messages at the beginning of the context
+    pinned = 1
+    while pinned < len(messages) and messages[pinned].get('role') == 'system' \
+            and messages[pinned - 1].get('role') == 'system':
+        pinned += 1
+    pinned = min(pinned, limit - 1)
+
+    target = max(pinned + 1, limit - block_size)
+    cut = len(messages) - (target - pinned)
+    while cut < len(messages) - 1 and messages[cut].get('role') == 'assistant':
+        cut += 1
+    del messages[pinned:cut]
+    return messages
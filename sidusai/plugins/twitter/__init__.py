@@ -46,7 +46,7 @@ class TwitterAget(sai.Agent):
         self.chat.append_user(message)
 
         task = TwitterPrepareTweetTask(self).data(self.chat).then(handler)
-        self.task_execute(task)
+        return self.task_execute(task)
 
     def _build_twitter_client(self) -> components.TwitterClient:
         return components.TwitterClient(
@@ -0,0 +1,18 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def wait_for():
+    """
+    Poll the predicate until it is true, the test fails after the timeout
+    """
+
+    def _wait_for(predicate, timeout: float = 5):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+
+    return _wait_for
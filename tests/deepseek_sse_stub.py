@@ -0,0 +1,134 @@
+"""
+Local stub of the DeepSeek chat completions endpoint.
+
+Answers with a fixed text split into tokens, one token every `token_delay_sec` seconds. A request with
+`"stream": true` is answered with a server-sent event stream of completion chunks, the last chunk
+contains the token usage when `stream_options.include_usage` is set. Other requests are answered
+with a regular completion after the whole text has been "generated".
+
+It is used by the streaming tests and by the streaming benchmark. Use the server to try the client by hand:
+
+    with SSEStubServer() as server:
+        client = DeepSeekClientComponent('key', url=server.url, stream=True)
+"""
+import http.server
+import json
+import threading
+import time
+
+__default_answer__ = 'The quick brown fox jumps over the lazy dog. ' * 8
+
+
+class SSEStubServer:
+
+    def __init__(self, answer: str = __default_answer__, token_delay_sec: float = 0.01, port: int = 0):
+        self.tokens = [word + ' ' for word in answer.split()]
+        self.token_delay_sec = token_delay_sec
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', port), self._build_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}/chat/completions'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _build_handler(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if payload.get('stream'):
+                    self._stream(payload)
+                else:
+                    self._complete(payload)
+
+            def _complete(self, payload: dict):
+                time.sleep(stub.token_delay_sec * len(stub.tokens))
+                body = json.dumps({
+                    'id': 'stub',
+                    'object': 'chat.completion',
+                    'model': payload.get('model'),
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': ''.join(stub.tokens)},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': stub.usage(payload)
+                }).encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, payload: dict):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                self._send_event(': keep-alive\n\n')
+                self._send_chunk(payload, {'role': 'assistant', 'content': ''})
+                for token in stub.tokens:
+                    time.sleep(stub.token_delay_sec)
+                    self._send_chunk(payload, {'content': token})
+                self._send_chunk(payload, {}, finish_reason='stop')
+
+                stream_options = payload.get('stream_options') or {}
+                if stream_options.get('include_usage'):
+                    usage = {'id': 'stub', 'object': 'chat.completion.chunk', 'choices': [],
+                             'usage': stub.usage(payload)}
+                    self._send_event(f'data: {json.dumps(usage)}\n\n')
+
+                self._send_event('data: [DONE]\n\n')
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _send_chunk(self, payload: dict, delta: dict, finish_reason: str = None):
+                chunk = {
+                    'id': 'stub',
+                    'object': 'chat.completion.chunk',
+                    'model': payload.get('model'),
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                    'usage': None
+                }
+                self._send_event(f'data: {json.dumps(chunk)}\n\n')
+
+            def _send_event(self, event: str):
+                data = event.encode('utf-8')
+                self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def usage(self, payload: dict) -> dict:
+        prompt_tokens = sum(len(m['content'].split()) for m in payload['messages'])
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(self.tokens),
+            'total_tokens': prompt_tokens + len(self.tokens),
+            'prompt_cache_hit_tokens': 0,
+            'prompt_cache_miss_tokens': prompt_tokens
+        }
@@ -0,0 +1,166 @@
+import asyncio
+import queue
+import threading
+
+import pytest
+
+import sidusai as sai
+import sidusai.core.execute as ex
+import sidusai.core.plugin as _cp
+from sidusai.core.types import NamedTypedContainer
+
+
+class NumberValue(sai.AgentValue):
+
+    def __init__(self, number: int):
+        super().__init__()
+        self.number = number
+
+
+class NumberTask(sai.CompletedAgentTask):
+    pass
+
+
+def build_agent(*skills) -> sai.Agent:
+    agent = sai.Agent('test_async_execution', thread_pool=ex.ThreadPool(pool_max_size=2))
+    names = _cp.build_and_register_task_skill_names(list(skills), agent)
+    agent.task_registration(NumberTask, skill_names=names)
+    agent.application_build()
+    return agent
+
+
+def increment(value: NumberValue) -> NumberValue:
+    value.number += 1
+    return value
+
+
+async def double(value: NumberValue) -> NumberValue:
+    await asyncio.sleep(0)
+    value.number *= 2
+    return value
+
+
+def fail(value: NumberValue) -> NumberValue:
+    raise RuntimeError('skill failed')
+
+
+def test_task_execute_async_runs_sync_and_async_skills():
+    agent = build_agent(increment, double)
+    try:
+        value = asyncio.run(agent.task_execute_async(NumberTask(agent).data(NumberValue(1))))
+        assert value.number == 4
+    finally:
+        agent.halt(1)
+
+
+def test_task_execute_async_raises_the_skill_error():
+    agent = build_agent(fail)
+    try:
+        with pytest.raises(RuntimeError, match='skill failed'):
+            asyncio.run(agent.task_execute_async(NumberTask(agent).data(NumberValue(1))))
+    finally:
+        agent.halt(1)
+
+
+def test_task_execute_async_raises_for_unregistered_task():
+    class UnknownTask(sai.CompletedAgentTask):
+        pass
+
+    agent = build_agent(increment)
+    try:
+        with pytest.raises(ValueError, match='not registered'):
+            asyncio.run(agent.task_execute_async(UnknownTask(agent).data(NumberValue(1))))
+    finally:
+        report = agent.halt(1)
+    assert report['abandoned'] == 0
+
+
+def test_complete_awaitable():
+    async def answer():
+        return 42
+
+    assert ex.complete_awaitable(answer()) == 42
+    assert ex.complete_awaitable(42) == 42
+
+
+def test_execute_does_not_block_when_asked():
+    pool = ex.ThreadPool(pool_max_size=1, queue_max_size=1)
+    release = threading.Event()
+    started = threading.Event()
+    try:
+        pool.execute(target=lambda: (started.set(), release.wait(5)))
+        assert started.wait(5)
+        pool.execute(target=lambda: None)
+        with pytest.raises(queue.Full):
+            pool.execute(target=lambda: None, block=False)
+    finally:
+        release.set()
+
+
+def test_full_queue_does_not_block_the_event_loop():
+    pool = ex.ThreadPool(pool_max_size=1, queue_max_size=1)
+    release = threading.Event()
+    started = threading.Event()
+    pool.execute(target=lambda: (started.set(), release.wait(5)))
+    assert started.wait(5)
+    pool.execute(target=lambda: None)
+
+    executable = ex.Executable(lambda: 42)
+    executable.compile(NamedTypedContainer())
+
+    async def main():
+        ticks = []
+
+        async def heartbeat():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+
+        beat = asyncio.create_task(heartbeat())
+        execution = asyncio.create_task(ex.execute_plan_async(executable, pool))
+        await asyncio.sleep(0.1)
+        # The loop goes on while the plan waits for a free queue slot
+        assert not execution.done() and len(ticks) > 3
+
+        release.set()
+        result = await asyncio.wait_for(execution, 5)
+        beat.cancel()
+        return result
+
+    try:
+        assert asyncio.run(main()) == 42
+    finally:
+        release.set()
+
+
+def test_halt_async_completes_tasks_of_the_loop():
+    async def slow(value: NumberValue) -> NumberValue:
+        await asyncio.sleep(0.1)
+        value.number += 1
+        return value
+
+    agent = build_agent(slow)
+
+    async def main():
+        task = asyncio.create_task(agent.task_execute_async(NumberTask(agent).data(NumberValue(1))))
+        await asyncio.sleep(0.01)
+        report = await agent.halt_async(5)
+        return report, await task
+
+    report, value = asyncio.run(main())
+    assert value.number == 2
+    assert report['completed'] == 1 and report['abandoned'] == 0
+    assert report['elapsed_sec'] < 5
+
+
+def test_halt_is_refused_in_the_running_loop():
+    agent = build_agent(increment)
+
+    async def main():
+        with pytest.raises(RuntimeError, match='halt_async'):
+            agent.halt(1)
+
+    try:
+        asyncio.run(main())
+    finally:
+        agent.halt(1)
@@ -0,0 +1,64 @@
+import pickle
+import threading
+
+import pytest
+
+pytest.importorskip('requests')
+
+import sidusai as sai
+import sidusai.plugins.deepseek as deepseek
+import sidusai.plugins.deepseek.components as components
+
+
+def build_chat(messages: int) -> sai.ChatAgentValue:
+    chat = sai.ChatAgentValue([])
+    chat.append_system('system')
+    for i in range(messages):
+        chat.append_user(f'user {i}')
+        chat.append_assistant(f'assistant {i}')
+    return chat
+
+
+def test_replace_messages_while_appending_keeps_order():
+    chat = build_chat(10)
+    is_done = threading.Event()
+
+    def compact():
+        while not is_done.is_set():
+            block = components.find_compaction_block(chat.snapshot_messages(), 4)
+            if len(block) > 0:
+                chat.replace_messages(block, [{'role': 'system', 'content': 'summary', 'summary': True}])
+
+    compactor = threading.Thread(target=compact)
+    compactor.start()
+    for i in range(1000):
+        chat.append_assistant(f'answer {i}')
+    is_done.set()
+    compactor.join()
+
+    answers = [int(m['content'].split()[1]) for m in chat.messages if m['content'].startswith('answer')]
+    assert answers == list(range(answers[0], 1000))
+
+
+def test_replace_messages_skips_removed_run():
+    chat = build_chat(3)
+    block = chat.snapshot_messages()[1:3]
+    del chat.messages[1:3]
+
+    assert not chat.replace_messages(block, [{'role': 'system', 'content': 'summary'}])
+    assert len(chat.messages) == 5
+
+
+def test_chat_value_is_pickled_without_lock():
+    chat = build_chat(2)
+    copy = pickle.loads(pickle.dumps(chat))
+    copy.append_user('next')
+
+    assert [m['content'] for m in copy.messages][:-1] == [m['content'] for m in chat.messages]
+    assert len(chat.messages) == 5
+
+
+def test_compaction_skill_requires_compactor():
+    agent = deepseek.DeepSeekSingleChatAgent('key', prepare_task_skills=[deepseek.skills.ds_chat_compaction_skill])
+    with pytest.raises(ValueError):
+        agent.application_build()
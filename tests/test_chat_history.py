@@ -0,0 +1,151 @@
+import json
+
+import pytest
+
+import sidusai.core.history as history
+
+
+def message(role: str, content: str) -> dict:
+    return {'role': role, 'content': content}
+
+
+def build_history(size: int, capacity_shift: int = 0) -> tuple:
+    """
+    History and the list of the same messages. The ring is rotated by `capacity_shift` dropped messages,
+    so the messages wrap around the end of the slots
+    """
+    messages = history.ChatHistory([message('system', 'prompt')])
+    for i in range(capacity_shift):
+        messages.append(message('user', f'dropped {i}'))
+    del messages[1:1 + capacity_shift]
+
+    expected = [message('system', 'prompt')]
+    for i in range(size):
+        item = message('user' if i % 2 == 0 else 'assistant', f'message {i}')
+        messages.append(item)
+        expected.append(item)
+    return messages, expected
+
+
+def test_leading_system_messages_are_pinned():
+    messages = history.ChatHistory([message('system', 'a'), message('system', 'b'), message('user', 'c')])
+    messages.append(message('system', 'd'))
+
+    assert messages.pinned == 2
+    assert [m['content'] for m in messages] == ['a', 'b', 'c', 'd']
+
+
+def test_messages_are_records_read_as_dicts():
+    messages = history.ChatHistory([message('user', 'hello')])
+    record = messages[0]
+
+    assert isinstance(record, history.ChatMessage)
+    assert record['content'] == 'hello'
+    assert record.get('summary') is None
+    assert 'role' in record and 'tokens' not in record
+    assert record == message('user', 'hello')
+    with pytest.raises(KeyError):
+        record['name'] = 'x'
+
+
+@pytest.mark.parametrize('shift', [0, 5, 7])
+def test_ring_matches_list(shift):
+    messages, expected = build_history(20, shift)
+    assert messages == expected
+
+    del messages[1:4]
+    del expected[1:4]
+    assert messages == expected
+
+    del messages[10:12]
+    del expected[10:12]
+    assert messages == expected
+
+    messages[5:7] = [message('user', 'x'), message('assistant', 'y'), message('user', 'z')]
+    expected[5:7] = [message('user', 'x'), message('assistant', 'y'), message('user', 'z')]
+    assert messages == expected
+
+    messages[-1] = message('assistant', 'last')
+    expected[-1] = message('assistant', 'last')
+    assert messages == expected
+    assert messages[2:6] == expected[2:6]
+    assert messages[-1] == expected[-1]
+
+
+def test_mutable_sequence_methods():
+    messages, expected = build_history(6)
+
+    messages.insert(3, message('user', 'inserted'))
+    expected.insert(3, message('user', 'inserted'))
+    messages.insert(0, message('system', 'first'))
+    expected.insert(0, message('system', 'first'))
+    assert messages == expected
+    assert messages.pinned == 2
+
+    assert messages.pop() == expected.pop()
+    assert messages.pop(3) == expected.pop(3)
+    messages.remove(message('user', 'message 2'))
+    expected.remove(message('user', 'message 2'))
+    assert messages == expected
+
+    messages += [message('user', 'appended')]
+    assert messages[-1] == message('user', 'appended')
+    assert message('user', 'appended') in messages
+    assert messages.index(message('user', 'appended')) == len(messages) - 1
+
+
+def test_concatenation_returns_new_history():
+    messages, expected = build_history(2)
+    joined = messages + [message('user', 'next')]
+    prefixed = [message('system', 'before')] + messages
+
+    assert isinstance(joined, history.ChatHistory) and isinstance(prefixed, history.ChatHistory)
+    assert joined == expected + [message('user', 'next')]
+    assert prefixed == [message('system', 'before')] + expected
+    assert prefixed.pinned == 2
+    assert len(messages) == 3
+
+
+def test_pinned_prefix_is_rebuilt():
+    messages, expected = build_history(4)
+    del messages[0]
+    del expected[0]
+
+    assert messages.pinned == 0
+    assert messages == expected
+
+
+def test_drop_oldest_keeps_pinned():
+    messages, expected = build_history(10)
+    messages.drop_oldest(4)
+
+    assert messages == expected[:1] + expected[5:]
+    messages.drop_oldest(100)
+    assert messages == expected[:1]
+
+
+def test_ring_grows_and_reuses_slots():
+    messages = history.ChatHistory()
+    for i in range(1000):
+        messages.append(message('user', str(i)))
+        if len(messages) > 10:
+            del messages[0:1]
+
+    assert [m['content'] for m in messages] == [str(i) for i in range(990, 1000)]
+    assert len(messages._slots) == 16
+
+
+def test_slice_with_step_is_rejected():
+    messages, _ = build_history(4)
+    with pytest.raises(ValueError):
+        del messages[::2]
+
+
+def test_encode_json():
+    messages, expected = build_history(3)
+    payload = {'history': messages, 'message': messages[1]}
+
+    decoded = json.loads(json.dumps(payload, default=history.encode_json))
+    assert decoded == {'history': expected, 'message': expected[1]}
+    with pytest.raises(TypeError):
+        json.dumps({'x': object()}, default=history.encode_json)
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+import sidusai.core.context as context
+
+
+class Database:
+    pass
+
+
+class Cache:
+    pass
+
+
+class Service:
+
+    def __init__(self, database: Database, cache: Cache):
+        self.database = database
+        self.cache = cache
+
+
+def build_context(database_builder, cache_builder) -> context.AgentContext:
+    ctx = context.AgentContext('test_component_build')
+    ctx.add_component_builder(database_builder)
+    ctx.add_component_builder(cache_builder)
+    ctx.add_component_builder(Service)
+    return ctx
+
+
+def test_independent_components_are_built_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def build_database() -> Database:
+        barrier.wait()
+        return Database()
+
+    def build_cache() -> Cache:
+        barrier.wait()
+        return Cache()
+
+    ctx = build_context(build_database, build_cache)
+    context.build_components(ctx)
+
+    service = ctx.components[Service]
+    assert service.database is ctx.components[Database]
+    assert service.cache is ctx.components[Cache]
+    assert set(ctx.components_build_times) == {'build_database', 'build_cache', 'service'}
+
+
+def test_component_is_built_after_its_dependencies():
+    built = []
+    lock = threading.Lock()
+
+    def build_database() -> Database:
+        with lock:
+            built.append('database')
+        return Database()
+
+    def build_cache() -> Cache:
+        with lock:
+            built.append('cache')
+        return Cache()
+
+    def build_service(database: Database, cache: Cache) -> Service:
+        with lock:
+            built.append('service')
+        return Service(database, cache)
+
+    ctx = context.AgentContext('test_component_build')
+    ctx.add_component_builder(build_service)
+    ctx.add_component_builder(build_cache)
+    ctx.add_component_builder(build_database)
+    context.build_components(ctx)
+
+    assert sorted(built[:2]) == ['cache', 'database']
+    assert built[2] == 'service'
+
+
+def test_dependencies_graph():
+    ctx = build_context(Database, Cache)
+
+    dependencies = context.build_component_dependencies(ctx)
+    assert dependencies['database'] == [] and dependencies['cache'] == []
+    assert sorted(dependencies['service']) == ['cache', 'database']
+
+
+def test_builder_error_is_raised_and_dependents_are_not_built():
+    def build_database() -> Database:
+        raise RuntimeError('connection refused')
+
+    ctx = build_context(build_database, Cache)
+    with pytest.raises(RuntimeError, match='connection refused'):
+        context.build_components(ctx)
+
+    assert Service not in ctx.components
+
+
+def test_cyclic_dependency_is_rejected():
+    with pytest.raises(ValueError, match='Cyclic dependency'):
+        context.validate_component_dependencies({'a': ['b'], 'b': ['c'], 'c': ['a']})
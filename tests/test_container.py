@@ -0,0 +1,112 @@
+import abc
+
+import pytest
+
+import sidusai as sai
+from sidusai.core.types import NamedTypedContainer
+
+
+class Base:
+    pass
+
+
+class Child(Base):
+    pass
+
+
+class GrandChild(Child):
+    pass
+
+
+class Other:
+    pass
+
+
+class Abstract(abc.ABC):
+    pass
+
+
+class Virtual:
+    pass
+
+
+def test_lookup_by_name_and_type():
+    container = NamedTypedContainer()
+    child = Child()
+    container.put(child, 'child')
+
+    assert container['child'] is child
+    assert container[Child] is child
+    # A base type is resolved by the registered subclass
+    assert container[Base] is child
+    assert container.get_name_from_type(Base) == 'child'
+    assert Other not in container
+
+
+def test_missing_type_is_resolved_after_put():
+    container = NamedTypedContainer()
+    assert container[Base] is None
+
+    grand_child = GrandChild()
+    container.put(grand_child, 'grand_child')
+
+    assert container[Base] is grand_child
+    assert container[Child] is grand_child
+
+
+def test_abstract_type_registered_later_is_resolved():
+    container = NamedTypedContainer()
+    assert container[Abstract] is None
+
+    Abstract.register(Virtual)
+    virtual = Virtual()
+    container.put(virtual, 'virtual')
+
+    assert container[Abstract] is virtual
+
+
+def test_name_collisions_raise():
+    container = NamedTypedContainer()
+    container.put(Child(), 'child')
+
+    with pytest.raises(ValueError):
+        container.put(Child(), 'another_child')
+    with pytest.raises(ValueError):
+        container.put(Other(), 'child')
+
+
+def test_iteration_keeps_names():
+    container = NamedTypedContainer()
+    child, other = Child(), Other()
+    container.put(child, 'child')
+    container.put(other, 'other')
+
+    assert list(container) == [('child', Child, child), ('other', Other, other)]
+    assert len(container) == 2
+
+
+def test_frozen_container_is_read_only():
+    container = NamedTypedContainer()
+    child = Child()
+    container.put(child, 'child')
+    container.freeze()
+
+    assert container.is_frozen
+    with pytest.raises(EnvironmentError):
+        container.put(Other(), 'other')
+    with pytest.raises(EnvironmentError):
+        container['other'] = Other()
+    assert container['child'] is child
+
+
+def test_application_build_freezes_components():
+    agent = sai.Agent('test_container')
+    agent.add_component_builder(Child)
+    agent.application_build()
+    try:
+        assert agent.ctx.components.is_frozen
+        assert agent.ctx.components_builders.is_frozen
+        with pytest.raises(EnvironmentError):
+            agent.ctx.components.put(Other(), 'other')
+    finally:
+        agent.halt(1)
@@ -0,0 +1,150 @@
+import pytest
+
+import sidusai as sai
+import sidusai.core.context as context
+import sidusai.core.plugin as _cp
+
+
+class TextValue(sai.AgentValue):
+
+    def __init__(self, text: str):
+        super().__init__()
+        self.text = text
+
+
+class Formatter:
+
+    def format(self, text: str) -> str:
+        return text.upper()
+
+
+def format_text(value: TextValue, formatter: Formatter) -> TextValue:
+    value.text = formatter.format(value.text)
+    return value
+
+
+def format_text_optional(value: TextValue, formatter: Formatter = None) -> TextValue:
+    if formatter is not None:
+        value.text = formatter.format(value.text)
+    return value
+
+
+def build_formatter() -> Formatter:
+    return Formatter()
+
+
+def strip_text(value: TextValue) -> TextValue:
+    value.text = value.text.strip()
+    return value
+
+
+class TextTask(sai.CompletedAgentTask):
+    pass
+
+
+def build_task_agent(*skills) -> sai.Agent:
+    agent = sai.Agent('test_context')
+    agent.add_component_builder(build_formatter)
+    names = _cp.build_and_register_task_skill_names(list(skills), agent)
+    agent.task_registration(TextTask, skill_names=names)
+    agent.application_build()
+    return agent
+
+
+def test_missing_required_component_fails_the_build():
+    agent = sai.Agent('test_context')
+    agent.add_skill(format_text)
+
+    with pytest.raises(ValueError, match='Formatter'):
+        agent.application_build()
+
+
+def test_missing_optional_component_is_allowed():
+    agent = sai.Agent('test_context')
+    agent.add_skill(format_text_optional)
+
+    agent.application_build()
+
+
+def test_registered_component_passes_validation():
+    agent = sai.Agent('test_context')
+    agent.add_component_builder(build_formatter)
+    agent.add_skill(format_text)
+
+    agent.application_build()
+
+
+def test_skill_pipeline_is_cached():
+    agent = build_task_agent(strip_text, format_text)
+    task_container = agent.ctx.get_task_container(TextTask)
+
+    skills = agent.ctx.get_task_skills(task_container)
+    assert [skill.name for skill in skills] == ['strip_text', 'format_text']
+    assert agent.ctx.get_task_skills(task_container) is skills
+
+
+def test_skill_pipeline_is_resolved_again_after_weight_change():
+    agent = build_task_agent(strip_text, format_text)
+    task_container = agent.ctx.get_task_container(TextTask)
+    skills = agent.ctx.get_task_skills(task_container)
+
+    graph = task_container.skill_graph
+    version = graph.version
+    # A cheap direct edge to the second skill skips the first one
+    graph.set_skill_weight('in', 'format_text__$0', 1)
+
+    assert graph.version == version + 1
+    changed = agent.ctx.get_task_skills(task_container)
+    assert changed is not skills
+    assert [skill.name for skill in changed] == ['format_text']
+    assert agent.ctx.get_task_skills(task_container) is changed
+
+
+def test_task_container_is_found_by_name_and_type():
+    ctx = context.AgentContext('test_context')
+    ctx.add_task_class(TextTask, 'text_task', ['strip_text'])
+
+    task_container = ctx.get_task_container('text_task')
+    assert task_container is not None
+    assert ctx.get_task_container(TextTask) is task_container
+    assert ctx.get_task_container('unknown_task') is None
+    assert ctx.get_task_container([]) is None
+
+
+def test_skill_is_found_by_handler():
+    ctx = context.AgentContext('test_context')
+    skill = ctx.add_agent_skill(strip_text)
+
+    assert ctx.get_skill_by_handler(strip_text) is skill
+    assert ctx.get_skill_by_handler(format_text) is None
+
+
+def test_exception_handlers_are_indexed_by_error_type():
+    ctx = context.AgentContext('test_context')
+
+    def on_value_error(e: Exception):
+        pass
+
+    def on_any_error(e: Exception):
+        pass
+
+    ctx.add_exception_handler(on_value_error, [ValueError, UnicodeError])
+    ctx.add_exception_handler(on_any_error)
+
+    handlers = ctx.get_exception_handlers(UnicodeDecodeError)
+    # The handler is dispatched once even when several of its error types match
+    assert [h.handler for h in handlers] == [on_value_error, on_any_error]
+    assert ctx.get_exception_handlers(UnicodeDecodeError) is handlers
+    assert [h.handler for h in ctx.get_exception_handlers(KeyError)] == [on_any_error]
+
+
+def test_exception_handlers_index_is_cleared_on_add():
+    ctx = context.AgentContext('test_context')
+
+    def on_key_error(e: Exception):
+        pass
+
+    assert ctx.get_exception_handlers(KeyError) == ()
+    ctx.add_exception_handler(on_key_error, [KeyError])
+
+    assert [h.handler for h in ctx.get_exception_handlers(KeyError)] == [on_key_error]
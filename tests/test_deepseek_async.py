@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import sidusai as sai
+import sidusai.plugins.deepseek.components as components
+from tests import deepseek_sse_stub
+
+__answer__ = 'The quick brown fox jumps over the lazy dog'
+
+
+@pytest.fixture
+def server():
+    with deepseek_sse_stub.SSEStubServer(answer=__answer__, token_delay_sec=0) as stub:
+        yield stub
+
+
+def build_chat(content: str = 'Tell me about the fox') -> sai.ChatAgentValue:
+    return sai.ChatAgentValue([{'role': 'user', 'content': content}])
+
+
+def test_requests_of_many_loops_share_the_client_loop(server):
+    client = components.AsyncDeepSeekClientComponent('key', url=server.url, max_retries=0)
+    try:
+        first = asyncio.run(client.request(build_chat()))
+        loop, thread = client._loop, client._loop_thread
+        second = asyncio.run(client.request(build_chat()))
+
+        assert first.status_code == 200 and second.status_code == 200
+        assert first.last_message['content'] == ''.join(server.tokens)
+        # The session is owned by the loop of the client, not by the loops of asyncio.run
+        assert client._loop is loop and client._loop_thread is thread
+        assert thread.is_alive()
+    finally:
+        asyncio.run(client.close())
+
+    assert not thread.is_alive()
+    assert loop.is_closed()
+    assert client._loop is None and client._session is None
+
+
+def test_request_after_close_starts_the_loop_again(server):
+    client = components.AsyncDeepSeekClientComponent('key', url=server.url, max_retries=0)
+    asyncio.run(client.request(build_chat()))
+    first_thread = client._loop_thread
+    asyncio.run(client.close())
+
+    try:
+        response = asyncio.run(client.request(build_chat()))
+        assert response.status_code == 200
+        assert client._loop_thread is not first_thread and client._loop_thread.is_alive()
+    finally:
+        asyncio.run(client.close())
+
+
+def test_close_without_requests():
+    client = components.AsyncDeepSeekClientComponent('key', url='http://127.0.0.1:1/chat/completions')
+    asyncio.run(client.close())
+
+    assert client._loop is None
+
+
+def test_request_many_keeps_the_order(server):
+    client = components.AsyncDeepSeekClientComponent('key', url=server.url, max_retries=0, max_concurrency=2)
+    chats = [build_chat(' '.join(['word'] * (i + 1))) for i in range(6)]
+
+    async def main():
+        try:
+            return await client.request_many(chats)
+        finally:
+            await client.close()
+
+    responses = asyncio.run(main())
+
+    # The prompt tokens of the stub are the words of the messages
+    assert [response.prompt_tokens for response in responses] == [i + 1 for i in range(6)]
+
+
+def test_invalid_max_concurrency():
+    with pytest.raises(ValueError):
+        components.AsyncDeepSeekClientComponent('key', max_concurrency=0)
@@ -0,0 +1,151 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+pytest.importorskip('requests')
+
+import requests
+
+import sidusai as sai
+import sidusai.plugins.deepseek.components as components
+
+
+class StatusStubServer:
+    """
+    Chat completions stub answering with the given statuses in order, then with 200.
+    The client ports of the requests are kept to check the reuse of connections
+    """
+
+    def __init__(self, statuses: list = None, retry_after: str = None):
+        self.statuses = list(statuses) if statuses is not None else []
+        self.retry_after = retry_after
+        self.client_ports = []
+
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._build_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}/chat/completions'
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _build_handler(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                with stub._lock:
+                    stub.client_ports.append(self.client_address[1])
+                    status = stub.statuses.pop(0) if len(stub.statuses) > 0 else 200
+
+                body = json.dumps({
+                    'id': 'stub',
+                    'object': 'chat.completion',
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'ok'}}]
+                } if status == 200 else {'error': {'message': 'stub error'}}).encode('utf-8')
+
+                self.send_response(status)
+                if status != 200 and stub.retry_after is not None:
+                    self.send_header('Retry-After', stub.retry_after)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def build_chat() -> sai.ChatAgentValue:
+    return sai.ChatAgentValue([{'role': 'user', 'content': 'Hello'}])
+
+
+def test_throttled_request_is_retried():
+    with StatusStubServer([429, 503], retry_after='0') as server:
+        client = components.DeepSeekClientComponent('key', url=server.url, max_retries=3)
+        try:
+            response = client.request(build_chat())
+        finally:
+            client.close()
+
+    assert response.status_code == 200
+    assert response.last_message['content'] == 'ok'
+    assert len(server.client_ports) == 3
+
+
+def test_last_error_response_is_returned():
+    with StatusStubServer([500, 500, 500], retry_after='0') as server:
+        client = components.DeepSeekClientComponent('key', url=server.url, max_retries=1)
+        try:
+            response = client.request(build_chat())
+        finally:
+            client.close()
+
+    assert response.status_code == 500
+    assert len(server.client_ports) == 2
+
+
+def test_client_error_is_not_retried():
+    with StatusStubServer([400]) as server:
+        client = components.DeepSeekClientComponent('key', url=server.url, max_retries=3, retry_backoff_sec=0)
+        try:
+            response = client.request(build_chat())
+        finally:
+            client.close()
+
+    assert response.status_code == 400
+    assert len(server.client_ports) == 1
+
+
+def test_failed_connection_is_retried_and_raised():
+    with StatusStubServer() as server:
+        url = server.url
+    client = components.DeepSeekClientComponent('key', url=url, max_retries=1, retry_backoff_sec=0)
+    try:
+        with pytest.raises(requests.ConnectionError):
+            client.request(build_chat())
+    finally:
+        client.close()
+
+
+def test_connection_is_reused():
+    with StatusStubServer() as server:
+        client = components.DeepSeekClientComponent('key', url=server.url)
+        try:
+            for _ in range(5):
+                assert client.request(build_chat()).status_code == 200
+        finally:
+            client.close()
+
+    assert len(server.client_ports) == 5
+    assert len(set(server.client_ports)) == 1
+
+
+def test_retry_backoff_and_retry_after():
+    for attempt in range(10):
+        assert 0 <= components.retry_backoff(0.5, attempt) <= min(components.__max_retry_backoff_sec__, 0.5 * 2 ** attempt)
+
+    class Response:
+
+        def __init__(self, headers: dict):
+            self.headers = headers
+
+    assert components.retry_after_sec(Response({'Retry-After': '2'})) == 2.0
+    assert components.retry_after_sec(Response({'Retry-After': '9999'})) == components.__max_retry_backoff_sec__
+    assert components.retry_after_sec(Response({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})) is None
+    assert components.retry_after_sec(Response({})) is None
@@ -0,0 +1,135 @@
+import pytest
+
+pytest.importorskip('requests')
+
+import sidusai as sai
+import sidusai.plugins.deepseek.components as components
+import sidusai.plugins.deepseek.skills as skills
+from tests import deepseek_sse_stub
+
+__answer__ = 'The quick brown fox jumps over the lazy dog'
+
+
+@pytest.fixture
+def server():
+    with deepseek_sse_stub.SSEStubServer(answer=__answer__, token_delay_sec=0) as stub:
+        yield stub
+
+
+def build_chat() -> sai.ChatAgentValue:
+    return sai.ChatAgentValue([{'role': 'user', 'content': 'Tell me about the fox'}])
+
+
+def test_iter_sse_data_joins_lines_and_skips_comments():
+    lines = [b': keep-alive', b'', b'data: {"a": 1}', b'', 'data:first', 'data: second', '', 'event: x', 'data: [DONE]']
+    assert list(components.iter_sse_data(lines)) == ['{"a": 1}', 'first\nsecond', '[DONE]']
+
+
+def test_stream_aggregates_deltas_and_usage(server):
+    client = components.DeepSeekClientComponent('key', url=server.url, max_retries=0)
+    try:
+        stream = client.stream_chat(build_chat())
+        tokens = list(stream)
+    finally:
+        client.close()
+
+    assert tokens == server.tokens
+    response = stream.response
+    assert response.status_code == 200
+    assert response.last_message == {'role': 'assistant', 'content': ''.join(server.tokens)}
+    assert response.choices[0]['finish_reason'] == 'stop'
+    assert response.completion_tokens == len(server.tokens)
+    assert response.prompt_tokens == 5
+    assert response.total_tokens == 5 + len(server.tokens)
+
+
+def test_stream_stops_at_done(server):
+    client = components.DeepSeekClientComponent('key', url=server.url, max_retries=0)
+    try:
+        response = client.stream_chat(build_chat())._response
+        data = list(components.iter_sse_data(response.iter_lines(chunk_size=None)))
+        response.close()
+    finally:
+        client.close()
+
+    # The usage chunk is sent before [DONE], the stream reads nothing after it
+    assert data[-1] == '[DONE]'
+    assert '"usage": {' in data[-2]
+
+    client = components.DeepSeekClientComponent('key', url=server.url, max_retries=0)
+    try:
+        stream = client.stream_chat(build_chat())
+        assert list(stream) == server.tokens
+        assert stream.response.completion_tokens == len(server.tokens)
+    finally:
+        client.close()
+
+
+def test_request_stream_calls_on_token(server):
+    client = components.DeepSeekClientComponent('key', url=server.url, max_retries=0)
+    received = []
+    try:
+        response = client.request_stream(build_chat(), on_token=received.append)
+    finally:
+        client.close()
+
+    assert received == server.tokens
+    assert response.last_message['content'] == ''.join(received)
+
+
+def test_stream_and_regular_request_agree(server):
+    client = components.DeepSeekClientComponent('key', url=server.url, max_retries=0)
+    try:
+        streamed = client.request_stream(build_chat())
+        regular = client.request(build_chat())
+    finally:
+        client.close()
+
+    assert streamed.last_message['content'] == regular.last_message['content']
+    assert streamed.total_tokens == regular.total_tokens
+
+
+def test_streamed_completion_is_cached(server):
+    cache = components.DeepSeekCompletionCache()
+    client = components.DeepSeekClientComponent('key', url=server.url, max_retries=0, cache=cache, temperature=0)
+    try:
+        first = client.request_stream(build_chat())
+        server.stop()
+
+        received = []
+        second = client.request_stream(build_chat(), on_token=received.append)
+    finally:
+        client.close()
+
+    assert cache.hits == 1 and cache.misses == 1
+    # The cached completion is delivered as one part
+    assert received == [first.last_message['content']]
+    assert second.last_message == first.last_message
+
+
+def test_cached_completion_has_no_usage(server):
+    client = components.DeepSeekClientComponent('key', url=server.url, max_retries=0,
+                                                cache=components.DeepSeekCompletionCache(), temperature=0)
+    try:
+        sent = skills.ds_chat_transform_skill(build_chat(), client)
+        cached = skills.ds_chat_transform_skill(build_chat(), client)
+    finally:
+        client.close()
+
+    assert sent.usage['completion_tokens'] == len(server.tokens)
+    assert cached.usage is None
+    assert cached.messages[-1]['content'] == sent.messages[-1]['content']
+
+
+def test_sampled_request_bypasses_the_cache(server):
+    cache = components.DeepSeekCompletionCache()
+    client = components.DeepSeekClientComponent('key', url=server.url, max_retries=0, cache=cache)
+    try:
+        client.request(build_chat())
+        second = client.request(build_chat())
+    finally:
+        client.close()
+
+    # The default temperature of the request is above the cache threshold
+    assert not second.is_cached
+    assert cache.bypasses == 2 and cache.hits == 0 and cache.misses == 0
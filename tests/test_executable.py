@@ -0,0 +1,78 @@
+import pytest
+
+import sidusai as sai
+import sidusai.core.execute as ex
+import sidusai.core.types as types
+
+
+class TextValue(sai.AgentValue):
+
+    def __init__(self, text: str):
+        super().__init__()
+        self.text = text
+
+
+class Formatter:
+
+    def format(self, text: str) -> str:
+        return text.upper()
+
+
+def build_container(*components) -> types.NamedTypedContainer:
+    container = types.NamedTypedContainer()
+    for component in components:
+        container.put(component, type(component).__name__)
+    return container
+
+
+def format_text(value: TextValue, formatter: Formatter) -> TextValue:
+    value.text = formatter.format(value.text)
+    return value
+
+
+def test_plan_injects_components_and_flow_value():
+    formatter = Formatter()
+    plan = ex.Executable(format_text).compile(build_container(formatter), flow_type=sai.AgentValue)
+
+    assert plan.flow_name == 'value'
+    assert plan.kwargs == {'formatter': formatter}
+    assert plan(TextValue('text')).text == 'TEXT'
+
+
+def test_plan_resolves_component_by_name():
+    def handler(value: TextValue, Formatter: any) -> TextValue:
+        value.text = Formatter.format(value.text)
+        return value
+
+    plan = ex.Executable(handler).compile(build_container(Formatter()), flow_type=sai.AgentValue)
+    assert plan(TextValue('text')).text == 'TEXT'
+
+
+def test_plan_puts_flow_value_by_name():
+    def handler(error: Exception, formatter: Formatter) -> str:
+        return formatter.format(str(error))
+
+    plan = ex.Executable(handler).compile(build_container(Formatter()), flow_name='error')
+    assert plan(ValueError('failed')) == 'FAILED'
+
+
+def test_plan_passes_positional_arguments():
+    class Skill:
+
+        def __call__(self, value: TextValue, formatter: Formatter) -> TextValue:
+            value.text = formatter.format(value.text) + '!'
+            return value
+
+    skill = Skill()
+    plan = ex.Executable(Skill.__call__).compile(build_container(Formatter()), flow_type=sai.AgentValue,
+                                                positional_count=1)
+    assert plan(TextValue('text'), args=(skill,)).text == 'TEXT!'
+
+
+def test_missing_component_is_injected_as_none():
+    plan = ex.Executable(format_text).compile(build_container(), flow_type=sai.AgentValue)
+
+    assert plan.kwargs == {'formatter': None}
+    with pytest.raises(AttributeError):
+        plan(TextValue('text'))
+
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+import sidusai.core.execute as ex
+
+
+def test_jobs_of_a_key_run_in_submission_order(wait_for):
+    executor = ex.KeySerialExecutor(ex.ThreadPool(pool_max_size=8))
+    lock = threading.Lock()
+    executed = {key: [] for key in range(4)}
+    running = {key: 0 for key in range(4)}
+    overlaps = []
+
+    def job(key, index):
+        with lock:
+            running[key] += 1
+            if running[key] > 1:
+                overlaps.append(key)
+        time.sleep(0.001)
+        with lock:
+            executed[key].append(index)
+            running[key] -= 1
+
+    for index in range(50):
+        for key in range(4):
+            executor.execute(key, job, args=(key, index))
+
+    wait_for(lambda: len(executor) == 0)
+    assert overlaps == []
+    for key in range(4):
+        assert executed[key] == list(range(50))
+
+
+def test_keys_run_in_parallel(wait_for):
+    executor = ex.KeySerialExecutor(ex.ThreadPool(pool_max_size=2))
+    barrier = threading.Barrier(2, timeout=5)
+    passed = []
+
+    for key in ['a', 'b']:
+        executor.execute(key, lambda: passed.append(barrier.wait()))
+
+    wait_for(lambda: len(passed) == 2)
+
+
+def test_error_doesnt_stop_the_mailbox(wait_for):
+    executor = ex.KeySerialExecutor(ex.ThreadPool(pool_max_size=1))
+    executed = []
+
+    def fail():
+        raise RuntimeError('job error')
+
+    executor.execute('key', fail)
+    executor.execute('key', executed.append, args=('next',))
+
+    wait_for(lambda: executed == ['next'])
+    wait_for(lambda: 'key' not in executor)
+
+
+def test_rejected_mailbox_is_dropped():
+    pool = ex.ThreadPool(pool_max_size=1, queue_max_size=1, overflow_policy=ex.__overflow_reject__)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    pool.execute(block)
+    assert started.wait(5)
+    pool.execute(lambda: None)
+
+    executor = ex.KeySerialExecutor(pool)
+    dropped = []
+    with pytest.raises(OverflowError):
+        executor.execute('key', lambda: None, on_drop=lambda: dropped.append('key'))
+    release.set()
+
+    assert dropped == ['key']
+    assert 'key' not in executor
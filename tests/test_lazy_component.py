@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+import sidusai as sai
+import sidusai.core.plugin as _cp
+from sidusai.core.types import LazyComponent
+
+
+class Client:
+    pass
+
+
+class NumberValue(sai.AgentValue):
+
+    def __init__(self, number: int):
+        super().__init__()
+        self.number = number
+
+
+class NumberTask(sai.CompletedAgentTask):
+    pass
+
+
+def test_component_is_built_once_under_concurrency():
+    calls = []
+    release = threading.Event()
+
+    def factory():
+        calls.append(1)
+        release.wait(5)
+        return Client()
+
+    component = LazyComponent(factory)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(component.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert component.is_built
+
+
+def test_failed_build_is_retried():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('not ready')
+        return Client()
+
+    component = LazyComponent(factory)
+    with pytest.raises(RuntimeError):
+        component.get()
+    assert not component.is_built
+
+    assert isinstance(component.get(), Client)
+    assert len(calls) == 2
+
+
+def test_lazy_component_is_built_on_first_injection():
+    built = []
+
+    def build_client() -> Client:
+        built.append(1)
+        return Client()
+
+    def use_client(value: NumberValue, client: Client) -> NumberValue:
+        value.number += 1
+        return value
+
+    agent = sai.Agent('test_lazy_component', lazy_components=True)
+    agent.add_component_builder(build_client)
+    names = _cp.build_and_register_task_skill_names([use_client], agent)
+    agent.task_registration(NumberTask, skill_names=names)
+    agent.application_build()
+    try:
+        assert built == []
+        assert isinstance(agent.ctx.components.peek(Client), LazyComponent)
+
+        for number in range(3):
+            assert agent.task_execute(NumberTask(agent).data(NumberValue(number))).result(5).number == number + 1
+        assert built == [1]
+    finally:
+        agent.halt(1)
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+import sidusai as sai
+import sidusai.core.process as process
+
+
+class NumberValue(sai.AgentValue):
+
+    def __init__(self, number: int):
+        super().__init__()
+        self.number = number
+        self.pid = None
+
+
+class NumberTask(sai.CompletedAgentTask):
+    pass
+
+
+class Multiplier:
+
+    def __init__(self, factor: int):
+        self.factor = factor
+
+
+def build_multiplier() -> Multiplier:
+    return Multiplier(3)
+
+
+def multiply(value: NumberValue, multiplier: Multiplier) -> NumberValue:
+    value.number *= multiplier.factor
+    value.pid = os.getpid()
+    return value
+
+
+def test_spawn_pool_round_trip():
+    pool = process.ProcessPool(pool_max_size=1)
+    pool.configure('test_process_pool', [('multiplier', build_multiplier)], [('multiply', multiply)])
+    try:
+        value = pool.submit('multiply', NumberValue(2)).result(60)
+    finally:
+        pool.shutdown()
+
+    assert value.number == 6
+    assert value.pid != os.getpid()
+
+
+def test_not_configured_pool_is_not_started():
+    pool = process.ProcessPool(pool_max_size=1)
+    with pytest.raises(EnvironmentError):
+        pool.submit('multiply', NumberValue(2))
+
+
+def test_unknown_start_method():
+    with pytest.raises(ValueError):
+        process.ProcessPool(start_method='unknown')
+
+
+def test_agent_runs_process_skill():
+    agent = sai.Agent('test_process_pool', process_pool=process.ProcessPool(pool_max_size=1))
+    agent.add_component_builder(build_multiplier)
+    agent.add_skill(multiply, executor='process')
+    agent.task_registration(NumberTask, skill_names=['multiply'])
+    agent.application_build()
+    try:
+        value = agent.task_execute(NumberTask(agent).data(NumberValue(2))).result(60)
+    finally:
+        agent.halt(1)
+
+    # The skill result is a copy of the value made in the worker process
+    assert value.number == 6
+    assert value.pid != os.getpid()
@@ -0,0 +1,133 @@
+import asyncio
+import http.server
+import json
+import threading
+
+import pytest
+
+import sidusai as sai
+
+
+def test_invalid_limit_raises():
+    with pytest.raises(ValueError):
+        sai.RateLimiter(requests_per_minute=0)
+    with pytest.raises(ValueError):
+        sai.RateLimiter(tokens_per_minute=-1)
+
+
+def test_no_limits_never_wait():
+    limiter = sai.RateLimiter()
+    for _ in range(100):
+        assert limiter.acquire(1000).wait_sec == 0
+    assert limiter.stats()['waited'] == 0
+
+
+def test_request_burst_then_wait():
+    limiter = sai.RateLimiter(requests_per_minute=60)
+    permits = [limiter._reserve(0) for _ in range(61)]
+
+    assert all(permit.wait_sec == 0 for permit in permits[:60])
+    # One request per second after the burst of the minute budget
+    assert permits[60].wait_sec == pytest.approx(1.0, abs=0.05)
+    assert limiter.stats()['waited'] == 1
+
+
+def test_tokens_wait_for_refill():
+    limiter = sai.RateLimiter(tokens_per_minute=600)
+    assert limiter._reserve(600).wait_sec == 0
+    # 10 tokens per second are refilled
+    assert limiter._reserve(100).wait_sec == pytest.approx(10.0, abs=0.05)
+
+
+def test_reconcile_returns_unused_tokens_once():
+    limiter = sai.RateLimiter(tokens_per_minute=600)
+    permit = limiter._reserve(600)
+    limiter.reconcile(permit, 100)
+    limiter.reconcile(permit, 0)
+
+    assert permit.is_reconciled
+    assert limiter.stats()['used_tokens'] == 100
+    assert limiter._reserve(500).wait_sec == 0
+    assert limiter._reserve(60).wait_sec > 0
+
+
+def test_acquire_async():
+    limiter = sai.RateLimiter(requests_per_minute=600)
+
+    async def acquire_all():
+        return await asyncio.gather(*[limiter.acquire_async(1) for _ in range(5)])
+
+    permits = asyncio.run(asyncio.wait_for(acquire_all(), timeout=5))
+    assert len(permits) == 5
+    assert limiter.stats()['acquired'] == 5
+
+
+class _RetryHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    calls = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        type(self).calls += 1
+        if type(self).calls == 1:
+            self._send(429, {'error': 'busy'}, {'Retry-After': '0'})
+            return
+        self._send(200, {
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'ok'}}],
+            'usage': {'prompt_tokens': 3, 'completion_tokens': 2, 'total_tokens': 5}
+        })
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_deepseek_retry_acquires_permit_per_attempt():
+    pytest.importorskip('requests')
+    import sidusai.plugins.deepseek.components as components
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _RetryHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    limiter = sai.RateLimiter(requests_per_minute=100, tokens_per_minute=100_000)
+    client = components.DeepSeekClientComponent(
+        'key', url=f'http://127.0.0.1:{server.server_port}/', rate_limiter=limiter, retry_backoff_sec=0
+    )
+    try:
+        response = client.request(sai.ChatAgentValue([{'role': 'user', 'content': 'hi'}]))
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    assert response.status_code == 200
+    stats = limiter.stats()
+    assert stats['acquired'] == 2
+    # The rejected attempt returned its tokens, only the usage of the answer is taken
+    assert stats['used_tokens'] == 5
+
+
+def test_deepseek_failed_request_returns_tokens():
+    pytest.importorskip('requests')
+    import requests
+    import sidusai.plugins.deepseek.components as components
+
+    limiter = sai.RateLimiter(tokens_per_minute=100_000)
+    client = components.DeepSeekClientComponent(
+        'key', url='http://127.0.0.1:1/', rate_limiter=limiter, max_retries=1, retry_backoff_sec=0
+    )
+    try:
+        with pytest.raises(requests.ConnectionError):
+            client.request(sai.ChatAgentValue([{'role': 'user', 'content': 'hi'}]))
+    finally:
+        client.close()
+
+    assert limiter.stats()['acquired'] == 2
+    assert limiter._tokens == pytest.approx(100_000, abs=1)
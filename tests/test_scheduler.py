@@ -0,0 +1,212 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+import sidusai as sai
+import sidusai.core.execute as ex
+import sidusai.core.scheduler as sc
+import sidusai.core.types as types
+
+
+def build_loop(fixed_interval_sec: float = None, cron: str = None,
+               missed_tick_policy: str = sc.__missed_delay__) -> types.LoopContainer:
+    return types.LoopContainer(
+        ex.Executable(lambda: None), fixed_interval_sec,
+        cron=sc.CronExpression(cron) if cron is not None else None, missed_tick_policy=missed_tick_policy
+    )
+
+
+@pytest.mark.parametrize('field, low, high, expected', [
+    ('*', 0, 5, {0, 1, 2, 3, 4, 5}),
+    ('*/2', 0, 5, {0, 2, 4}),
+    ('1-3', 0, 5, {1, 2, 3}),
+    ('1-5/2', 0, 5, {1, 3, 5}),
+    ('0,4', 0, 5, {0, 4}),
+    ('3/2', 0, 9, {3, 5, 7, 9}),
+])
+def test_parse_cron_field(field, low, high, expected):
+    assert sc.parse_cron_field(field, low, high) == expected
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '*/0 * * * *', '5-1 * * * *', '* * 31 2 *'])
+def test_invalid_cron_expression(expression):
+    with pytest.raises(ValueError):
+        sc.CronExpression(expression).next_after(datetime.datetime(2024, 1, 1))
+
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    ('*/15 * * * *', datetime.datetime(2024, 1, 1, 10, 7, 30), datetime.datetime(2024, 1, 1, 10, 15)),
+    ('*/15 * * * *', datetime.datetime(2024, 1, 1, 10, 15), datetime.datetime(2024, 1, 1, 10, 30)),
+    ('0 9 * * *', datetime.datetime(2024, 1, 1, 9, 0), datetime.datetime(2024, 1, 2, 9, 0)),
+    ('0 0 1 * *', datetime.datetime(2024, 12, 15), datetime.datetime(2025, 1, 1)),
+    ('0 0 29 2 *', datetime.datetime(2024, 3, 1), datetime.datetime(2028, 2, 29)),
+    # 2024-01-01 is Monday, Sunday is 0 and 7
+    ('30 8 * * 0', datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 7, 8, 30)),
+    ('30 8 * * 7', datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 7, 8, 30)),
+    # Both day fields are restricted: either of them matches
+    ('0 0 10 * 3', datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 3)),
+])
+def test_cron_next_after(expression, moment, expected):
+    assert sc.CronExpression(expression).next_after(moment) == expected
+
+
+def test_delay_policy_counts_from_completion():
+    loop = build_loop(fixed_interval_sec=10)
+    loop.scheduled_at = 100.0
+
+    assert sc.next_deadline(loop, 135.0) == 145.0
+    assert loop.missed_ticks == 0
+
+
+def test_skip_policy_skips_missed_ticks():
+    loop = build_loop(fixed_interval_sec=10, missed_tick_policy=sc.__missed_skip__)
+    loop.scheduled_at = 100.0
+
+    assert sc.next_deadline(loop, 105.0) == 110.0
+    assert sc.next_deadline(loop, 135.0) == 140.0
+    assert loop.missed_ticks == 3
+
+
+def test_catch_up_policy_keeps_ticks():
+    loop = build_loop(fixed_interval_sec=10, missed_tick_policy=sc.__missed_catch_up__)
+    loop.scheduled_at = 100.0
+
+    assert sc.next_deadline(loop, 135.0) == 110.0
+    assert loop.missed_ticks == 0
+
+
+def test_error_backoff_doubles_up_to_limit():
+    loop = build_loop(fixed_interval_sec=1)
+    loop.error_backoff_sec = 1.0
+
+    backoff = 0.0
+    delays = []
+    for _ in range(8):
+        backoff = sc.next_error_backoff(loop, backoff)
+        delays.append(backoff)
+    assert delays[:3] == [1.0, 2.0, 4.0]
+    assert max(delays) == sc.__max_error_backoff_sec__
+
+
+def test_scheduler_dispatches_nearest_deadline_first():
+    slow = build_loop(fixed_interval_sec=0.2)
+    fast = build_loop(fixed_interval_sec=0.02)
+    dispatched = []
+    scheduler = None
+
+    def dispatch(loop):
+        dispatched.append(loop)
+        if len(dispatched) == 5:
+            scheduler.stop()
+            return
+        scheduler.complete(loop)
+
+    scheduler = sc.LoopScheduler([slow, fast], dispatch)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert dispatched == [fast] * 5
+
+
+def test_loop_is_not_run_concurrently_with_itself():
+    loop = build_loop(fixed_interval_sec=0.01)
+    dispatched = []
+    scheduler = sc.LoopScheduler([loop], dispatched.append)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(0.1)
+    scheduler.stop()
+    thread.join(5)
+
+    # The loop is not completed, so it is not scheduled again
+    assert dispatched == [loop]
+    assert loop.is_executing
+
+
+def test_zero_interval_is_rejected():
+    agent = sai.Agent('test_scheduler')
+    with pytest.raises(ValueError):
+        agent.add_loop_method(lambda: None, fixed_interval_sec=0)
+
+
+def test_errors_of_scheduled_loop_are_counted():
+    agent = sai.Agent('test_scheduler', thread_pool=ex.ThreadPool(pool_max_size=2))
+    failed = threading.Event()
+    runs = []
+
+    def fail():
+        runs.append(1)
+        # The error of the third run is counted before the fourth run starts
+        if len(runs) > 3:
+            failed.set()
+        raise RuntimeError('loop error')
+
+    agent.add_loop_method(fail, fixed_interval_sec=0.01)
+    thread = threading.Thread(target=agent.application_run)
+    thread.start()
+    assert failed.wait(5)
+    agent.halt(1)
+    thread.join(5)
+
+    assert not thread.is_alive()
+    metrics = agent.loop_metrics()
+    assert list(metrics.values())[0]['errors'] >= 3
+
+
+def test_continuous_loop_is_reinvoked_until_stop(wait_for):
+    loop = build_loop()
+    runs = []
+    worker = sc.ContinuousLoopWorker(loop, runs.append)
+    worker.start()
+    wait_for(lambda: len(runs) >= 10)
+
+    worker.stop()
+    worker.join(5)
+    assert not worker.is_alive
+    assert not loop.is_executing
+
+
+def test_continuous_loop_errors_are_counted_with_backoff():
+    loop = build_loop()
+    loop.error_backoff_sec = 60.0
+    failed = threading.Event()
+
+    def fail(_loop):
+        failed.set()
+        raise RuntimeError('loop error')
+
+    worker = sc.ContinuousLoopWorker(loop, fail)
+    worker.start()
+    assert failed.wait(5)
+    time.sleep(0.05)
+
+    # The worker waits for the backoff after the error and stop interrupts the wait
+    assert loop.errors == 1
+    worker.stop()
+    worker.join(5)
+    assert not worker.is_alive
+
+
+def test_continuous_loop_of_agent_is_stopped_by_halt(wait_for):
+    agent = sai.Agent('test_scheduler', thread_pool=ex.ThreadPool(pool_max_size=2))
+    polled = threading.Event()
+
+    def poll():
+        polled.set()
+        time.sleep(0.005)
+
+    agent.add_loop_method(poll, continuous=True)
+    thread = threading.Thread(target=agent.application_run)
+    thread.start()
+    assert polled.wait(5)
+    agent.halt(1)
+    thread.join(5)
+
+    assert not thread.is_alive()
+    # Workers are not joined by halt, they leave after the current run
+    wait_for(lambda: all(not worker.is_alive for worker in agent._loop_workers))
+    assert list(agent.loop_metrics().values())[0]['runs'] > 0
@@ -0,0 +1,97 @@
+import heapq
+import itertools
+import random
+
+import pytest
+
+import sidusai.core.graph as graph
+
+
+def materialized_shortest_path(skill_graph: graph.AgentSkillGraph, source: str, target: str) -> list:
+    """
+    Dijkstra's algorithm over the materialized complete graph, as networkx.dijkstra_path runs it
+    on the graph of the previous implementation: neighbors are visited in the order of the vertices
+    """
+    adjacency = {
+        v: [(u, skill_graph.get_skill_weight(v, u)) for u in skill_graph.nodes if skill_graph.has_edge(v, u)]
+        for v in skill_graph.nodes
+    }
+
+    counter = itertools.count()
+    fringe = [(0, next(counter), source)]
+    dist = {}
+    seen = {source: 0}
+    pred = {source: None}
+    while fringe:
+        d, _, v = heapq.heappop(fringe)
+        if v in dist:
+            continue
+        dist[v] = d
+        if v == target:
+            break
+        for u, cost in adjacency[v]:
+            if u in dist:
+                continue
+            if u not in seen or d + cost < seen[u]:
+                seen[u] = d + cost
+                pred[u] = v
+                heapq.heappush(fringe, (d + cost, next(counter), u))
+
+    path = []
+    node = target
+    while node is not None:
+        path.append(node)
+        node = pred[node]
+    return path[::-1]
+
+
+def build_random_graph(rnd: random.Random) -> graph.AgentSkillGraph:
+    full_skill_names = [f'skill_{i}' for i in range(rnd.randint(2, 8))]
+    task_skills = [rnd.choice(full_skill_names) for _ in range(rnd.randint(1, 6))]
+    skill_graph = graph.AgentSkillGraph(full_skill_names, task_skills)
+
+    # Weight changes with equal weights, so the choice between equal paths is checked too
+    for _ in range(rnd.randint(0, 10)):
+        from_node, to_node = rnd.sample(skill_graph.nodes, 2)
+        if skill_graph.has_edge(from_node, to_node):
+            skill_graph.set_skill_weight(from_node, to_node, rnd.choice([0, 1, 2, 50, 100, 150]))
+    return skill_graph
+
+
+def test_task_skills_are_the_path():
+    skill_graph = graph.AgentSkillGraph(['a', 'b', 'c'], ['a', 'c', 'a'])
+    assert skill_graph.get_active_nodes() == ['a', 'c', 'a']
+
+
+def test_unweighted_edges_have_default_weight():
+    skill_graph = graph.AgentSkillGraph(['a', 'b'], ['a'])
+
+    assert skill_graph.get_skill_weight('in', 'a__$0') == 1
+    assert skill_graph.get_skill_weight('a__$0', 'b__$0') == 100
+    assert not skill_graph.has_edge('in', 'out')
+    with pytest.raises(KeyError):
+        skill_graph.set_skill_weight('in', 'out', 1)
+
+
+def test_paths_match_materialized_graph():
+    rnd = random.Random(0)
+    for _ in range(1000):
+        skill_graph = build_random_graph(rnd)
+
+        expected = materialized_shortest_path(skill_graph, graph.__in__, graph.__out__)
+        assert skill_graph.shortest_path(graph.__in__, graph.__out__) == expected
+
+
+def test_paths_match_networkx():
+    nx = pytest.importorskip('networkx')
+
+    rnd = random.Random(1)
+    for _ in range(200):
+        skill_graph = build_random_graph(rnd)
+        nx_graph = nx.Graph()
+        for v, u in itertools.combinations(skill_graph.nodes, 2):
+            if skill_graph.has_edge(v, u):
+                nx_graph.add_edge(v, u, weight=skill_graph.get_skill_weight(v, u))
+
+        expected = nx.dijkstra_path(nx_graph, graph.__in__, graph.__out__)
+        assert skill_graph.shortest_path(graph.__in__, graph.__out__) == expected
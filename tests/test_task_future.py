@@ -0,0 +1,161 @@
+import concurrent.futures as futures
+import threading
+
+import pytest
+
+import sidusai as sai
+import sidusai.core.execute as ex
+import sidusai.core.plugin as _cp
+
+
+class NumberValue(sai.AgentValue):
+
+    def __init__(self, number: int):
+        super().__init__()
+        self.number = number
+
+
+class NumberTask(sai.CompletedAgentTask):
+    pass
+
+
+def build_agent(*skills) -> sai.Agent:
+    agent = sai.Agent('test_task_future', thread_pool=ex.ThreadPool(pool_max_size=2))
+    names = _cp.build_and_register_task_skill_names(list(skills), agent)
+    agent.task_registration(NumberTask, skill_names=names)
+    agent.application_build()
+    return agent
+
+
+def increment(value: NumberValue) -> NumberValue:
+    value.number += 1
+    return value
+
+
+def test_result_and_timing():
+    handle = ex.TaskFuture(task=None)
+    assert not handle.done() and handle.wait_time is None
+
+    assert handle.set_running()
+    handle.set_result(42)
+
+    assert handle.result(1) == 42
+    assert handle.done() and not handle.cancelled()
+    assert handle.wait_time >= 0 and handle.run_time >= 0 and handle.latency >= handle.run_time
+
+
+def test_queued_task_is_cancelled():
+    handle = ex.TaskFuture(task=None)
+    called = []
+    handle.add_done_callback(called.append)
+
+    assert handle.cancel()
+    assert handle.cancelled() and handle.cancel_requested
+    assert not handle.set_running()
+    assert called == [handle]
+    with pytest.raises(futures.CancelledError):
+        handle.result(1)
+
+
+def test_running_task_is_cancelled_cooperatively():
+    handle = ex.TaskFuture(task=None)
+    handle.set_running()
+
+    assert handle.cancel()
+    assert handle.cancel_requested and not handle.done()
+    handle.set_result(None)
+    assert not handle.cancel()
+
+
+def test_task_execute_returns_final_value():
+    agent = build_agent(increment, increment)
+    try:
+        handle = agent.task_execute(NumberTask(agent).data(NumberValue(1)))
+        assert handle.result(5).number == 3
+    finally:
+        agent.halt(1)
+
+
+def test_task_error_is_set_on_the_handle():
+    def fail(value: NumberValue) -> NumberValue:
+        raise RuntimeError('skill error')
+
+    agent = build_agent(fail)
+    try:
+        handle = agent.task_execute(NumberTask(agent).data(NumberValue(1)))
+        assert isinstance(handle.exception(5), RuntimeError)
+    finally:
+        agent.halt(1)
+
+
+def test_running_task_stops_before_next_skill():
+    started = threading.Event()
+    release = threading.Event()
+    executed = []
+
+    def wait(value: NumberValue) -> NumberValue:
+        started.set()
+        release.wait(5)
+        return value
+
+    def after(value: NumberValue) -> NumberValue:
+        executed.append(value.number)
+        return value
+
+    agent = build_agent(wait, after)
+    try:
+        handle = agent.task_execute(NumberTask(agent).data(NumberValue(1)))
+        assert started.wait(5)
+        handle.cancel()
+        release.set()
+
+        with pytest.raises(futures.CancelledError):
+            handle.result(5)
+        assert handle.cancelled()
+        assert executed == []
+    finally:
+        agent.halt(1)
+
+
+def test_task_execute_many_limits_tasks_in_flight():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def track(value: NumberValue) -> NumberValue:
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        threading.Event().wait(0.01)
+        with lock:
+            running[0] -= 1
+        return value
+
+    agent = build_agent(track)
+    try:
+        tasks = (NumberTask(agent).data(NumberValue(i)) for i in range(10))
+        handles = list(agent.task_execute_many(tasks, max_concurrency=2))
+
+        assert sorted(handle.result().number for handle in handles) == list(range(10))
+        assert running[1] <= 2
+    finally:
+        agent.halt(1)
+
+
+def test_task_after_halt_is_cancelled():
+    agent = build_agent(increment)
+    agent.halt(1)
+
+    assert agent.task_execute(NumberTask(agent).data(NumberValue(1))).cancelled()
+
+
+def test_unregistered_task_is_resolved_with_error():
+    class UnknownTask(sai.CompletedAgentTask):
+        pass
+
+    agent = build_agent(increment)
+    try:
+        handle = agent.task_execute(UnknownTask(agent).data(NumberValue(1)))
+        assert isinstance(handle.exception(5), ValueError)
+    finally:
+        report = agent.halt(1)
+    assert report['abandoned'] == 0
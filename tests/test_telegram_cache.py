@@ -0,0 +1,276 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('telebot')
+
+import sidusai.plugins.telegram.components as components
+
+
+def contents(messages) -> list:
+    return [m['content'] for m in messages]
+
+
+def test_message_limit_trims_block_after_system_prompt():
+    cache = components.TelegramChatInMemoryCache(6, trim_block_size=2)
+    cache.put_system(1, 'system')
+    for i in range(6):
+        cache.put_user(1, f'user {i}')
+        cache.put_assistant(1, f'assistant {i}')
+
+    messages = cache[1]
+    assert messages[0]['content'] == 'system'
+    assert len(messages) <= 6
+    assert messages[1]['role'] == 'user'
+    assert contents(messages)[-1] == 'assistant 5'
+
+
+def test_history_prefix_is_stable_between_trims():
+    cache = components.TelegramChatInMemoryCache(10)
+    cache.put_system(1, 'system')
+    prefixes = []
+    for i in range(20):
+        cache.put_user(1, f'user {i}')
+        cache.put_assistant(1, f'assistant {i}')
+        prefixes.append(tuple(contents(cache[1])[:3]))
+
+    # Half of the limit is dropped at once, so the prefix changes only once in a few turns
+    assert len(set(prefixes)) < len(prefixes) // 2
+
+
+@pytest.mark.parametrize('roles, limit, block_size, expected', [
+    (['system', 'user', 'assistant', 'user', 'assistant', 'user'], 4, 2, ['system', 'user']),
+    (['system', 'system', 'user', 'assistant', 'user', 'assistant'], 5, 1, ['system', 'system', 'user', 'assistant']),
+    # The answer is dropped with its question, the first message is pinned
+    (['user', 'assistant', 'user', 'assistant', 'user'], 4, 1, ['user', 'user']),
+])
+def test_trim_messages_keeps_pinned_and_starts_with_user(roles, limit, block_size, expected):
+    messages = [{'role': role, 'content': str(i)} for i, role in enumerate(roles)]
+    trimmed = components.trim_messages(messages, limit, block_size)
+
+    assert [m['role'] for m in trimmed] == expected
+    # The newest message is always kept
+    assert trimmed[-1]['content'] == str(len(roles) - 1)
+
+
+def test_trim_messages_under_limit_is_unchanged():
+    messages = [{'role': 'user', 'content': 'hello'}]
+    assert components.trim_messages(messages, 4, 2) == [{'role': 'user', 'content': 'hello'}]
+
+
+def test_cache_stats_ratio():
+    cache = components.TelegramChatInMemoryCache()
+    assert cache.cache_stats(1) == {
+        'requests': 0, 'prompt_cache_hit_tokens': 0, 'prompt_cache_miss_tokens': 0, 'hit_ratio': 0.0
+    }
+
+    cache.record_usage(1, {'prompt_cache_hit_tokens': 30, 'prompt_cache_miss_tokens': 10})
+    cache.record_usage(1, {'prompt_cache_hit_tokens': None, 'prompt_cache_miss_tokens': 10})
+    # Completions served from the cache have no usage
+    cache.record_usage(1, None)
+
+    stats = cache.cache_stats(1)
+    assert stats['requests'] == 2
+    assert stats['prompt_cache_hit_tokens'] == 30 and stats['prompt_cache_miss_tokens'] == 20
+    assert stats['hit_ratio'] == 0.6
+
+
+def test_token_budget_trims_block_and_keeps_running_total():
+    cache = components.TelegramChatInMemoryCache(token_budget=100, trim_block_tokens=50)
+    cache.put_system(1, 'x' * 40)
+    totals = []
+    for i in range(10):
+        cache.put_user(1, 'x' * 40)
+        cache.put_assistant(1, 'x' * 40)
+        totals.append(cache.total_tokens(1))
+
+    messages = cache[1]
+    assert messages[0]['role'] == 'system' and messages[1]['role'] == 'user'
+    assert max(totals) <= 100
+    # A block of at least 50 tokens is dropped at once
+    assert min(totals) <= 50
+    assert cache.total_tokens(1) == sum(m['tokens'] for m in messages)
+    assert cache.total_tokens(2) == 0
+
+
+def test_invalid_limit_raises():
+    with pytest.raises(ValueError):
+        components.TelegramChatInMemoryCache(max_users=0)
+
+
+def test_least_recently_used_user_is_dropped_without_spill():
+    cache = components.TelegramChatInMemoryCache(max_users=2)
+    for user_id in [1, 2, 3]:
+        cache.put_user(user_id, f'hello {user_id}')
+
+    assert cache[1] is None
+    assert contents(cache[3]) == ['hello 3']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_locked_user_is_not_evicted():
+    cache = components.TelegramChatInMemoryCache(max_users=1)
+    cache.put_user(1, 'hello')
+    cache.lock(1)
+    cache.put_user(2, 'hello')
+
+    assert cache[1] is not None
+    cache.unlock(1)
+    cache.put_user(3, 'hello')
+    assert cache[1] is None
+
+
+def test_lock_is_counted_by_request():
+    cache = components.TelegramChatInMemoryCache(max_users=1)
+    cache.put_user(1, 'hello')
+    cache.lock(1)
+    cache.lock(1)
+    # The first request is done, the second is still answered
+    cache.unlock(1)
+    cache.put_user(2, 'hello')
+
+    assert cache.is_locking(1)
+    assert cache[1] is not None
+    cache.unlock(1)
+    assert not cache.is_locking(1)
+    assert cache.stats()['locked_users'] == 0
+
+
+def test_idle_user_is_evicted_by_ttl():
+    cache = components.TelegramChatInMemoryCache(ttl_sec=0.05)
+    cache.put_user(1, 'hello')
+    time.sleep(0.1)
+    cache.put_user(2, 'hello')
+
+    assert cache.stats()['users'] == 1
+
+
+def test_byte_limit():
+    cache = components.TelegramChatInMemoryCache(max_bytes=2000)
+    for user_id in range(10):
+        cache.put_user(user_id, 'x' * 100)
+
+    stats = cache.stats()
+    assert stats['bytes'] <= 2000
+    assert stats['users'] < 10
+
+
+def test_evicted_history_is_spilled_and_loaded_back(tmp_path):
+    cache = components.TelegramChatInMemoryCache(max_users=1, spill_path=str(tmp_path / 'spill.db'))
+    cache.put_system(1, 'system')
+    cache.put_user(1, 'question')
+    cache.record_usage(1, {'prompt_cache_hit_tokens': 3, 'prompt_cache_miss_tokens': 1})
+    cache.put_user(2, 'hello')
+
+    stats = cache.stats()
+    assert stats['users'] == 1 and stats['spilled_users'] == 1
+
+    messages = cache[1]
+    assert contents(messages) == ['system', 'question']
+    assert messages.pinned == 1
+    assert cache.cache_stats(1)['prompt_cache_hit_tokens'] == 3
+    # User 2 is spilled now, user 1 is in memory only
+    assert cache.stats()['spilled_users'] == 1
+    assert cache.spill.get(1) is None
+    cache.close()
+
+
+def test_spill_survives_restart(tmp_path):
+    path = str(tmp_path / 'spill.db')
+    cache = components.TelegramChatInMemoryCache(max_users=1, spill_path=path)
+    cache.put_user(1, 'first')
+    cache.put_user(2, 'second')
+    cache.close()
+
+    reopened = components.TelegramChatInMemoryCache(max_users=1, spill_path=path)
+    assert contents(reopened[1]) == ['first']
+    reopened.close()
+
+
+def test_concurrent_users_keep_their_messages(tmp_path):
+    cache = components.TelegramChatInMemoryCache(max_users=3, spill_path=str(tmp_path / 'spill.db'))
+    users = 8
+    messages = 40
+
+    def talk(user_id: int):
+        for i in range(messages):
+            cache.put_user(user_id, f'{user_id}:{i}')
+
+    threads = [threading.Thread(target=talk, args=(user_id,)) for user_id in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for user_id in range(users):
+        assert contents(cache[user_id]) == [f'{user_id}:{i}' for i in range(messages)]
+    assert cache.stats()['users'] <= 3
+    cache.close()
+
+
+def test_spill_is_read_outside_the_lock(tmp_path):
+    cache = components.TelegramChatInMemoryCache(max_users=1, spill_path=str(tmp_path / 'spill.db'))
+    cache.put_user(1, 'first')
+    cache.put_user(2, 'second')
+
+    store_get = cache.spill.get
+    locked = []
+
+    def get(user_id):
+        locked.append(cache._lock.locked())
+        return store_get(user_id)
+
+    cache.spill.get = get
+    assert contents(cache[1]) == ['first']
+    cache.put_user(3, 'third')
+
+    assert len(locked) > 0 and not any(locked)
+    cache.close()
+
+
+def test_spill_written_during_the_read_is_read_again(tmp_path):
+    cache = components.TelegramChatInMemoryCache(max_users=1, spill_path=str(tmp_path / 'spill.db'))
+    cache.put_user(1, 'first')
+    cache.put_user(2, 'second')
+
+    store_get = cache.spill.get
+    reads = []
+
+    def get(user_id):
+        reads.append(user_id)
+        spilled = store_get(user_id)
+        if len(reads) == 1:
+            # Another thread writes a history between the read and the lock of the cache
+            assert cache._lock.acquire(timeout=5)
+            cache._spill_writes += 1
+            cache._lock.release()
+        return spilled
+
+    cache.spill.get = get
+    assert contents(cache[1]) == ['first']
+    assert reads == [1, 1]
+    assert cache.stats()['reloads'] == 1
+    cache.close()
+
+
+def test_agent_halt_closes_the_cache(tmp_path):
+    import sidusai.plugins.deepseek as deepseek
+    import sidusai.plugins.telegram as telegram
+
+    cache = components.TelegramChatInMemoryCache(max_users=1, spill_path=str(tmp_path / 'spill.db'))
+    agent = telegram.TelegramAiAgent('key', 'system', [deepseek.DeepSeekPlugin('key')], cache=cache)
+    agent.application_build()
+    assert agent.ctx.components[components.TelegramChatInMemoryCache] is cache
+
+    cache.put_user(1, 'first')
+    cache.put_user(2, 'second')
+    assert agent.halt(1)['closed_components'] >= 1
+
+    # The file of the cache is closed
+    with pytest.raises(sqlite3.ProgrammingError):
+        len(cache.spill)
+    reopened = components.TelegramChatInMemoryCache(max_users=1, spill_path=str(tmp_path / 'spill.db'))
+    assert contents(reopened[1]) == ['first']
+    reopened.close()
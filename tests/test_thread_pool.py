@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+
+import sidusai.core.execute as ex
+
+
+def blocking_pool(overflow_policy: str, queue_max_size: int = 2) -> tuple:
+    """
+    Pool with one worker blocked by the first job, so the next jobs stay in the queue
+    """
+    pool = ex.ThreadPool(pool_max_size=1, queue_max_size=queue_max_size, overflow_policy=overflow_policy)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    pool.execute(block)
+    assert started.wait(5)
+    return pool, release
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'pool_max_size': 0},
+    {'queue_max_size': 0},
+    {'overflow_policy': 'drop_all'},
+])
+def test_invalid_config_raises(kwargs):
+    with pytest.raises(ValueError):
+        ex.ThreadPool(**kwargs)
+
+
+def test_jobs_are_executed_by_bounded_workers(wait_for):
+    pool = ex.ThreadPool(pool_max_size=3)
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def job():
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    results = [pool.submit(job) for _ in range(20)]
+    for future in results:
+        future.result(5)
+
+    assert running[1] <= 3
+    assert pool.workers <= 3
+    wait_for(lambda: pool.stats()['completed'] == 20)
+
+
+def test_reject_policy_raises_overflow(wait_for):
+    pool, release = blocking_pool(ex.__overflow_reject__)
+    pool.execute(lambda: None)
+    pool.execute(lambda: None)
+    with pytest.raises(OverflowError):
+        pool.execute(lambda: None)
+    release.set()
+
+    assert pool.stats()['rejected'] == 1
+    wait_for(lambda: pool.stats()['completed'] == 3)
+
+
+def test_shed_oldest_policy_drops_queued_job(wait_for):
+    pool, release = blocking_pool(ex.__overflow_shed_oldest__)
+    executed = []
+    dropped = []
+    for i in range(3):
+        pool.execute(executed.append, args=(i,), on_drop=lambda i=i: dropped.append(i))
+    release.set()
+
+    wait_for(lambda: pool.stats()['completed'] == 3)
+    assert dropped == [0]
+    assert executed == [1, 2]
+    assert pool.stats()['shed'] == 1
+
+
+def test_shed_job_cancels_future():
+    pool, release = blocking_pool(ex.__overflow_shed_oldest__, queue_max_size=1)
+    first = pool.submit(lambda: 1)
+    second = pool.submit(lambda: 2)
+    release.set()
+
+    assert first.cancelled()
+    assert second.result(5) == 2
+
+
+def test_on_drop_can_submit_to_the_pool():
+    pool, release = blocking_pool(ex.__overflow_shed_oldest__, queue_max_size=1)
+    retried = []
+    first = pool.submit(lambda: 1)
+    # The callback runs when the job is shed, it must not be called under the pool lock
+    first.add_done_callback(lambda _: retried.append(pool.submit(lambda: 3)))
+
+    submitter = threading.Thread(target=pool.submit, args=(lambda: 2,), daemon=True)
+    submitter.start()
+    submitter.join(5)
+    assert not submitter.is_alive()
+    release.set()
+
+    assert first.cancelled()
+    assert retried[0].result(5) == 3
+
+
+def test_block_policy_waits_for_free_slot():
+    pool, release = blocking_pool(ex.__overflow_block__, queue_max_size=1)
+    pool.execute(lambda: None)
+    submitted = threading.Event()
+
+    def submit():
+        pool.execute(lambda: None)
+        submitted.set()
+
+    threading.Thread(target=submit).start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(5)
+
+
+def test_failed_job_is_counted_and_worker_survives(wait_for):
+    pool = ex.ThreadPool(pool_max_size=1)
+
+    def fail():
+        raise RuntimeError('job error')
+
+    pool.execute(fail)
+    assert pool.submit(lambda: 'ok').result(5) == 'ok'
+    wait_for(lambda: pool.stats()['failed'] == 1)
+
+
+def test_idle_workers_leave_the_pool(wait_for):
+    pool = ex.ThreadPool(pool_max_size=2, keep_alive_sec=0.05)
+    pool.submit(lambda: None).result(5)
+
+    wait_for(lambda: pool.workers == 0)
@@ -0,0 +1,84 @@
+import pytest
+
+import sidusai as sai
+import sidusai.core.tokens as tokens
+
+
+def message(role: str, chars: int) -> dict:
+    return {'role': role, 'content': 'x' * chars}
+
+
+@pytest.mark.parametrize('text, expected', [(None, 0), ('', 0), ('abc', 1), ('abcd', 1), ('abcde', 2)])
+def test_estimate_tokens(text, expected):
+    assert tokens.estimate_tokens(text) == expected
+
+
+def test_message_tokens_are_cached_in_the_message():
+    msg = message('user', 40)
+    assert tokens.count_message_tokens(msg) == 10 + tokens.__message_overhead_tokens__
+    assert msg[tokens.__tokens_key__] == 14
+
+    # The cached count is used, the content is not estimated again
+    msg['content'] = ''
+    assert tokens.count_message_tokens(msg) == 14
+
+
+def test_chat_tokens_include_max_completion():
+    messages = [message('system', 40), message('user', 40)]
+    assert tokens.estimate_chat_tokens(messages) == 28
+    assert tokens.estimate_chat_tokens(messages, max_completion_tokens=100) == 128
+
+
+def test_token_cut_keeps_newest_and_starts_with_user():
+    messages = [message('system', 40), message('user', 40), message('assistant', 40),
+                message('user', 40), message('assistant', 40), message('user', 40)]
+    total = tokens.estimate_chat_tokens(messages)
+    pinned = tokens.count_pinned_messages(messages)
+    assert pinned == 1
+
+    # One dropped message is enough, the answer is dropped with its question
+    cut, dropped = tokens.find_token_cut(messages, pinned, total, total - 1)
+    assert cut == 3 and dropped == 28
+
+    # Nothing fits, the newest message is kept anyway
+    cut, dropped = tokens.find_token_cut(messages, pinned, total, 0)
+    assert cut == len(messages) - 1
+    assert dropped == total - 14 - 14
+
+
+def test_chat_value_is_trimmed_to_the_budget():
+    chat = sai.ChatAgentValue(token_budget=60)
+    chat.append_system('x' * 40)
+    for _ in range(5):
+        chat.append_user('x' * 40)
+        chat.append_assistant('x' * 40)
+
+    messages = chat.snapshot_messages()
+    assert messages[0]['role'] == 'system'
+    assert messages[1]['role'] == 'user'
+    assert chat.total_tokens() <= 60
+    # The running total is the sum of the kept messages
+    assert chat.total_tokens() == tokens.estimate_chat_tokens(messages)
+
+
+def test_newest_message_is_kept_over_budget():
+    chat = sai.ChatAgentValue(token_budget=10)
+    chat.append_user('x' * 400)
+
+    assert chat.last_content() == 'x' * 400
+    assert chat.total_tokens() == 104
+
+
+def test_running_total_is_counted_again_after_replace():
+    chat = sai.ChatAgentValue()
+    chat.append_user('x' * 40)
+    chat.append_assistant('x' * 40)
+    assert chat.total_tokens() == 28
+
+    old = chat.snapshot_messages()
+    assert chat.replace_messages(old, [message('system', 4)])
+    assert chat.total_tokens() == 5
+
+    # Messages appended outside the value are counted on the next call
+    chat.messages.append(message('user', 8))
+    assert chat.total_tokens() == 11